@@ -0,0 +1,36 @@
+"""
+Authentication of the admin endpoints (profiler, memory diagnostics, event-loop
+stalls, agent registry).
+
+Admin endpoints expose stack traces and process internals, and some change how a
+worker runs (e.g. sample every thread's stack), so they need a token:
+- ADMIN_TOKEN: shared secret, sent as `Authorization: Bearer <token>` or
+  `X-Admin-Token: <token>`. Unset (the default), the admin endpoints answer 404.
+"""
+
+import hmac
+import os
+from typing import Any, Optional
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def _request_token(request: Any) -> str:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token.strip()
+    return request.headers.get("x-admin-token", "")
+
+
+def admin_denied(request: Any) -> Optional[Any]:
+    """The error response for a request without the admin token, or None when it may proceed."""
+    from fastapi.responses import JSONResponse
+
+    if not ADMIN_TOKEN:
+        return JSONResponse(content={"error": "Not found"}, status_code=404)
+    if not hmac.compare_digest(_request_token(request).encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse(
+            content={"error": "Admin token required"}, status_code=401, headers={"WWW-Authenticate": "Bearer"}
+        )
+    return None
@@ -1,100 +1,358 @@
 """
 LangGraph agent implementation for agentic chat.
 This matches the TypeScript implementation and supports CopilotKit frontend tools.
+
+Importing this module is cheap: langchain_openai, langgraph and dotenv are only
+imported when the graph is first used, so the servers can bind their port before
+paying for the heavy imports. `agentic_chat_graph` is still available as a module
+attribute (langgraph.json and `from agent import agentic_chat_graph` keep working),
+it is simply compiled on first access.
 """
 
+from __future__ import annotations
+
 import os
-from typing import List, Any, Optional
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage
-from langchain_core.runnables import RunnableConfig
-from langgraph.graph import StateGraph, START, END, MessagesState
-from langgraph.types import Command
-from dotenv import load_dotenv
+import threading
+import time
+from typing import Annotated, Any, Dict, List, Optional, TypedDict
+
+from checkpoint_cache import add_checkpoint_cache
+from checkpointer import get_checkpointer, open_checkpointer
+from hot_runs import TOOL_RESUME, TOOL_WAIT_NODE, add_hot_checkpoints, observe_resumed
+from message_records import STATE_MESSAGES, add_message_records, new_message
+from model_router import ROUTES, RouteDecision, classify_turn, stream_routed
+from prompt_layout import bind_tools_cached, build_prompt, record_usage
+from tool_selection import record_tool_recall, select_tools
+from tracing import instrument_checkpointer, span
+
+_graph = None
+_graph_lock = threading.Lock()
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+_models: Dict[tuple, Any] = {}
+_env_loaded = False
+
+
+def load_env():
+    """Load the .env file once (dotenv is imported on first call)."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    _env_loaded = True
+
+
+def get_model(model_name: str = "gpt-4o"):
+    """
+    Return a shared chat model client for `model_name`.
+    The client (and its HTTP connection pool) is reused across turns instead of
+    being rebuilt on every call to chat_node.
+
+    AGENT_MODEL_BACKEND selects the implementation:
+    - "openai" (default): ChatOpenAI, requires OPENAI_API_KEY
+    - "fake": fake_model.FakeStreamingChatModel, for load tests and offline runs
+    - "replay": model_replay.ReplayChatModel, serves responses from MODEL_CASSETTE_PATH
+    - "record": ChatOpenAI, with every streamed response appended to MODEL_CASSETTE_PATH
+    """
+    load_env()
+    backend = os.getenv("AGENT_MODEL_BACKEND", "openai").lower()
+    if backend == "fake":
+        key = ("fake", model_name)
+        if key not in _models:
+            from fake_model import FakeStreamingChatModel, fake_model_settings
+
+            _models[key] = FakeStreamingChatModel(**fake_model_settings(model_name))
+        return _models[key]
+    if backend == "replay":
+        key = ("replay", model_name)
+        if key not in _models:
+            from model_replay import ReplayChatModel
+
+            _models[key] = ReplayChatModel(model=model_name)
+        return _models[key]
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError(
+            "OPENAI_API_KEY environment variable is not set. "
+            "Please set it in your .env file or environment."
+        )
+
+    key = (backend, model_name, api_key)
+    model = _models.get(key)
+    if model is None:
+        from langchain_openai import ChatOpenAI
+
+        # stream_usage: report token usage (incl. cached tokens) on streamed calls
+        model = ChatOpenAI(model=model_name, api_key=api_key, stream_usage=True)
+        if backend == "record":
+            from model_replay import RecordingChatModel
 
-# Load environment variables
-load_dotenv()
+            model = RecordingChatModel(inner=model)
+        _models[key] = model
+    return model
 
 
-class AgentState(MessagesState):
+async def router_node(state: AgentState, config: Optional[RunnableConfig] = None):
     """
-    State of our graph.
-    Inherits from MessagesState to get messages management.
+    Classify the turn with local heuristics (see model_router) and record the
+    chosen model route in the state for chat_node.
     """
-    tools: List[Any]
+    from langgraph.types import Command
+
+    decision = classify_turn(state["messages"], state.get("tools", []))
+    return Command(
+        goto="chat_node",
+        update={
+            "model_route": decision.route,
+            "model_route_reason": decision.reason,
+        }
+    )
 
 
 async def chat_node(state: AgentState, config: Optional[RunnableConfig] = None):
     """
     Standard chat node based on the ReAct design pattern. It handles:
     - The model to use (and binds in CopilotKit actions and tools)
-    - The system prompt
+    - The system prompt (see prompt_layout for the cache-friendly layout)
     - Getting a response from the model
     - Handling tool calls
 
-    For more about the ReAct design pattern, see: 
+    For more about the ReAct design pattern, see:
     https://www.perplexity.ai/search/react-agents-NcXLQhreS0WDzpVaS4m9Cg
     """
+    from langchain_core.messages import AIMessage, message_chunk_to_message
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import END
+    from langgraph.types import Command
 
-    # 1. Define the model
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError(
-            "OPENAI_API_KEY environment variable is not set. "
-            "Please set it in your .env file or environment."
-        )
-    
-    model = ChatOpenAI(model="gpt-4o", api_key=api_key)
+    # 1. Define the model: the route picked by router_node (fast or strong),
+    #    the other route is the fallback
+    decision = RouteDecision(
+        state.get("model_route") or "strong",
+        state.get("model_route_reason") or "unrouted",
+    )
 
     # Define config for the model
     if config is None:
         config = RunnableConfig(recursion_limit=25)
 
-    # 2. Bind the tools to the model
-    # This includes tools from CopilotKit (frontend tools via useFrontendTool)
-    model_with_tools = model.bind_tools(
-        [
-            *state["tools"],
+    # 2. Assemble the prompt with a cache-friendly, byte-stable prefix:
+    #    tools ordered by name, then the (constant) system prompt, then the conversation.
+    #    This includes tools from CopilotKit (frontend tools via useFrontendTool)
+    tools_fingerprint, tools, messages = build_prompt(
+        state,
+        extra_tools=[
             # Add your custom tools here if needed
         ],
-        # 2.1 Disable parallel tool calls to avoid race conditions,
-        #     enable this for faster performance if you want to manage
-        #     the complexity of running tool calls in parallel.
-        parallel_tool_calls=False,
     )
+    #    Only the tools relevant to the recent conversation are bound (see tool_selection)
+    selection = select_tools(state["messages"], tools_fingerprint, tools)
+    tools_fingerprint, tools = selection.fingerprint, selection.tools
 
-    # 3. Define the system message by which the chat model will be run
-    system_message = SystemMessage(
-        content="You are a helpful assistant."
-    )
+    # 3. Bind the tools to the model (reused across turns for the same tool set)
+    def bind(model_name: str):
+        return bind_tools_cached(
+            get_model(model_name),
+            tools_fingerprint,
+            tools,
+            # 3.1 Disable parallel tool calls to avoid race conditions,
+            #     enable this for faster performance if you want to manage
+            #     the complexity of running tool calls in parallel.
+            parallel_tool_calls=False,
+        )
 
     # 4. Run the model to generate a response
-    response = await model_with_tools.ainvoke([
-        system_message,
-        *state["messages"],
-    ], config)
+    #    Streamed so the time to first token can be traced; chunks are merged
+    #    back into a single AIMessage (including tool calls)
+    with span("model.call", route=decision.route, reason=decision.reason, tools=len(tools)) as model_span:
+        response = None
+        async for chunk in stream_routed(decision, bind, messages, config):
+            if response is None:
+                model_span.set_attribute("ttft_ms", model_span.duration_ms)
+                response = chunk
+            else:
+                response = response + chunk
+    response = message_chunk_to_message(response) if response is not None else AIMessage(content="")
+    record_usage(response, tools_fingerprint)
+    record_tool_recall(selection, response)
 
-    # 5. Return using Command to control flow
+    # 5. Return using Command to control flow: frontend tool calls end the run,
+    #    or pause it in tool_wait_node with TOOL_RESUME=interrupt (see hot_runs)
     return Command(
-        goto=END,
+        goto=TOOL_WAIT_NODE if TOOL_RESUME == "interrupt" and response.tool_calls else END,
         update={
             "messages": response
         }
     )
 
 
-# Define the graph
-workflow = StateGraph(AgentState)
-workflow.add_node("chat_node", chat_node)
-workflow.set_entry_point("chat_node")
+async def tool_wait_node(state: AgentState, config: Optional[RunnableConfig] = None):
+    """
+    Pause the run at the frontend tool calls of the last message until their
+    results are sent back as Command(resume={"toolResults": {toolCallId: result}}),
+    then continue in chat_node with the tool messages.
+    """
+    from langgraph.types import Command, interrupt
+
+    calls = [
+        {"id": call["id"], "name": call["name"], "args": call.get("args", {})}
+        for call in state["messages"][-1].tool_calls or []
+    ]
+    resumed = interrupt({"toolCalls": calls})
+    observe_resumed(((config or {}).get("configurable") or {}).get("thread_id"))
+    results = resumed.get("toolResults", {}) if isinstance(resumed, dict) else {}
+    return Command(
+        goto="chat_node",
+        update={
+            "messages": [
+                new_message("tool", results.get(call["id"], ""), tool_call_id=call["id"], name=call["name"])
+                for call in calls
+            ]
+        }
+    )
+
+
+def _build_graph():
+    """Define and compile the graph. Imports langgraph on first call."""
+    global AgentState, RunnableConfig
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import StateGraph, START, END, MessagesState
+
+    load_env()
+
+    if STATE_MESSAGES == "compact":
+        class AgentState(TypedDict):
+            """
+            State of our graph, with the messages kept as compact records
+            (see message_records; materialized for the model call only).
+            """
+            messages: Annotated[List[Any], add_message_records]
+            tools: List[Any]
+            model_route: str
+            model_route_reason: str
+    else:
+        class AgentState(MessagesState):
+            """
+            State of our graph.
+            Inherits from MessagesState to get messages management.
+            """
+            tools: List[Any]
+            model_route: str
+            model_route_reason: str
+
+    # Define the graph
+    workflow = StateGraph(AgentState)
+    workflow.add_node("router_node", router_node)
+    workflow.add_node("chat_node", chat_node)
+    workflow.add_node(TOOL_WAIT_NODE, tool_wait_node)
+    workflow.set_entry_point("router_node")
+
+    # Add explicit edges, matching the pattern in other examples
+    workflow.add_edge(START, "router_node")
+    workflow.add_edge("router_node", "chat_node")
+    workflow.add_edge("chat_node", END)
+
+    # LangGraph Platform/Studio will use its own checkpointer when deployed
+    return workflow.compile(checkpointer=shared_checkpointer())
+
+
+def shared_checkpointer():
+    """
+    The checkpointer every agent graph of this process is compiled with (see
+    agent_registry.py): MemorySaver, or Postgres with CHECKPOINTER=postgres (see
+    checkpointer.py), behind a Redis cache of the latest state when REDIS_URI is
+    set (checkpoint_cache.py) and the hot paused runs of TOOL_RESUME=interrupt
+    (hot_runs.py).
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = instrument_checkpointer(
+                    add_hot_checkpoints(add_checkpoint_cache(get_checkpointer()))
+                )
+    return _checkpointer
+
+
+def get_agentic_chat_graph():
+    """Return the compiled graph, compiling it on first use."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = _build_graph()
+    return _graph
+
+
+async def thread_has_checkpoint(thread_id: str) -> bool:
+    """Whether the shared checkpointer already holds state for `thread_id`."""
+    config = {"configurable": {"thread_id": thread_id}}
+    return await shared_checkpointer().aget_tuple(config) is not None
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Compile the graph and pre-bind the model so the first request does not pay
+    for imports, graph compilation or client construction.
+    Returns the time spent in each step (milliseconds).
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    get_agentic_chat_graph()
+    timings["compile_graph_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    try:
+        for model_name in set(ROUTES.values()):
+            get_model(model_name).bind_tools([], parallel_tool_calls=False)
+    except ValueError as e:
+        # Missing API key: the graph is ready, the model will fail on first use anyway
+        print(f"Warm-up skipped model binding: {e}")
+    timings["bind_model_ms"] = (time.perf_counter() - start) * 1000
+
+    print(f"Agent warm-up done: {timings}")
+    return timings
+
+
+def report_warm_up(future):
+    """Done-callback of a background warm-up: print its failure instead of dropping it."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        print(f"Agent warm-up failed: {type(error).__name__}: {error}")
+
+
+async def warm_up_on_startup():
+    """
+    Startup hook for the FastAPI servers.
+    AGENT_WARMUP controls the startup-optimized mode:
+    - "background" (default): start serving immediately, warm up in a worker thread
+    - "eager": block startup until the warm-up is done
+    - "off": compile lazily on the first request
+    The checkpointer is opened first in every mode (see checkpointer.py).
+    """
+    import asyncio
 
-# Add explicit edges, matching the pattern in other examples
-workflow.add_edge(START, "chat_node")
-workflow.add_edge("chat_node", END)
+    await open_checkpointer()
+    mode = os.getenv("AGENT_WARMUP", "background").lower()
+    if mode == "off":
+        return
+    if mode == "eager":
+        warm_up()
+        return
+    asyncio.get_running_loop().run_in_executor(None, warm_up).add_done_callback(report_warm_up)
 
-# Always use MemorySaver for conversation history
-# LangGraph Platform/Studio will use its own checkpointer when deployed
-from langgraph.checkpoint.memory import MemorySaver
-memory = MemorySaver()
-agentic_chat_graph = workflow.compile(checkpointer=memory)
 
+def __getattr__(name: str):
+    # Lazily exposes the compiled graph and state class (PEP 562)
+    if name == "agentic_chat_graph":
+        return get_agentic_chat_graph()
+    if name in ("AgentState", "RunnableConfig"):
+        get_agentic_chat_graph()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,298 @@
+"""
+Registry of the agent graphs hosted by this process.
+
+Agents are discovered from a langgraph.json-style config (AGENTS_CONFIG, default
+the langgraph.json next to this file):
+    {"graphs": {"agentic_chat": "./agent.py:agentic_chat_graph",
+                "researcher": {"path": "./agents/researcher.py:build", "description": "..."}}}
+The first graph is the default agent. Listing agents only reads the config; an
+agent's module is imported and its graph compiled on its first run (in a worker
+thread, so the event loop keeps serving). The attribute may be a compiled graph,
+an uncompiled StateGraph, or a function returning either.
+
+All agents share one process's resources:
+- uncompiled graphs are compiled with the shared checkpointer
+  (agent.shared_checkpointer: Postgres/Memory behind the Redis cache, traced)
+- graphs that use agent.get_model and prompt_layout share the model clients (and
+  their connection pools) and the tool schema and bound-model caches
+
+Idle agents are unloaded (their compiled graph is dropped and a module the registry
+imported is released) when:
+- more than AGENT_MAX_LOADED agents are compiled (default 0: no limit), least
+  recently used first
+- the process RSS exceeds AGENT_MEMORY_LIMIT_MB (default 0: off; Linux), agents
+  unused for AGENT_IDLE_S (default 300) first, least recently used first
+The next run compiles the agent again. Checked at most every 30 seconds, on use.
+Agents pinned with `registry.pin(name)` are never unloaded: server_copilotkit pins
+every agent, because the CopilotKit SDK endpoint keeps a reference to each graph
+(dropping the registry's copy would free nothing and compile a second one).
+"""
+
+import asyncio
+import gc
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import metrics
+from memory_stats import rss_mb
+
+AGENTS_CONFIG = os.getenv("AGENTS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "langgraph.json"))
+AGENT_MAX_LOADED = int(os.getenv("AGENT_MAX_LOADED", "0"))
+AGENT_MEMORY_LIMIT_MB = float(os.getenv("AGENT_MEMORY_LIMIT_MB", "0"))
+AGENT_IDLE_S = float(os.getenv("AGENT_IDLE_S", "300"))
+
+_PRESSURE_CHECK_INTERVAL_S = 30.0
+# Descriptions of agents whose langgraph.json entry is a bare path (the CLI format)
+_DEFAULT_DESCRIPTIONS = {"agentic_chat": "A simple agentic chat flow using LangGraph"}
+
+agents_loaded = metrics.gauge("agent_registry_loaded", "Agent graphs compiled in this process")
+agent_loads = metrics.counter("agent_registry_loads_total", "Agent graph compilations, by agent")
+agent_unloads = metrics.counter("agent_registry_unloads_total", "Agent graphs unloaded, by reason (max_loaded, memory)")
+load_seconds = metrics.histogram("agent_registry_load_seconds", "Time to import and compile an agent graph")
+
+
+class UnknownAgent(KeyError):
+    """No agent with this name in the registry config."""
+
+    status_code = 404
+
+
+class AgentEntry:
+    """One configured agent and, once used, its compiled graph."""
+
+    __slots__ = ("name", "path", "attribute", "description", "graph", "module_name", "owns_module", "pinned", "last_used", "lock")
+
+    def __init__(self, name: str, path: str, attribute: str, description: str = ""):
+        self.name = name
+        self.path = path
+        self.attribute = attribute
+        self.description = description or _DEFAULT_DESCRIPTIONS.get(name) or f"{name} (LangGraph agent)"
+        self.graph = None
+        self.module_name: Optional[str] = None
+        # Whether the registry imported the module (and may release it)
+        self.owns_module = False
+        # Referenced outside the registry (e.g. by the CopilotKit SDK): never unloaded
+        self.pinned = False
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "description": self.description, "type": "langgraph"}
+
+
+def _compile(target: Any) -> Any:
+    """A compiled graph from a compiled graph, a StateGraph or a factory function."""
+    if callable(target) and not hasattr(target, "astream") and not hasattr(target, "compile"):
+        target = target()
+    if hasattr(target, "astream"):
+        return target
+    from agent import shared_checkpointer
+
+    return target.compile(checkpointer=shared_checkpointer())
+
+
+class AgentRegistry:
+    """Lazily compiled agent graphs, by name."""
+
+    def __init__(self, config_path: str = AGENTS_CONFIG):
+        self.config_path = config_path
+        self._entries: Optional["OrderedDict[str, AgentEntry]"] = None
+        self._lock = threading.Lock()
+        self._last_pressure_check = 0.0
+
+    @property
+    def entries(self) -> "OrderedDict[str, AgentEntry]":
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self._read_config()
+        return self._entries
+
+    def _read_config(self) -> "OrderedDict[str, AgentEntry]":
+        with open(self.config_path, encoding="utf-8") as f:
+            config = json.load(f)
+        base = os.path.dirname(os.path.abspath(self.config_path))
+        entries: "OrderedDict[str, AgentEntry]" = OrderedDict()
+        for name, spec in config.get("graphs", {}).items():
+            if isinstance(spec, dict):
+                location, description = spec["path"], spec.get("description", "")
+            else:
+                location, description = spec, ""
+            path, _, attribute = location.rpartition(":")
+            entries[name] = AgentEntry(name, os.path.normpath(os.path.join(base, path)), attribute, description)
+        if not entries:
+            raise ValueError(f"No graphs configured in {self.config_path}")
+        return entries
+
+    @property
+    def default(self) -> str:
+        return next(iter(self.entries))
+
+    def names(self) -> List[str]:
+        return list(self.entries)
+
+    def has(self, name: str) -> bool:
+        return name in self.entries
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """The agents list of the CopilotKit info response (nothing is compiled)."""
+        return [entry.describe() for entry in self.entries.values()]
+
+    def resolve(self, name: Optional[str]) -> str:
+        """`name`, or the default agent when empty; UnknownAgent for a name not configured."""
+        name = name or self.default
+        if name not in self.entries:
+            raise UnknownAgent(name)
+        return name
+
+    def request_agent(self, data: Dict[str, Any]) -> str:
+        """The agent a generateCopilotResponse request's `data` asks for (agentSession.agentName)."""
+        session = data.get("agentSession")
+        return self.resolve(session.get("agentName") if isinstance(session, dict) else None)
+
+    def get_graph(self, name: Optional[str] = None) -> Any:
+        """The compiled graph of agent `name` (default agent when None), compiling it on first use."""
+        entry = self.entries[self.resolve(name)]
+        entry.last_used = time.monotonic()
+        if entry.graph is None:
+            with entry.lock:
+                if entry.graph is None:
+                    self._load(entry)
+        graph = entry.graph
+        self._check_pressure()
+        return graph
+
+    async def aget_graph(self, name: Optional[str] = None) -> Any:
+        """get_graph, compiling in a worker thread when the agent is not loaded yet."""
+        entry = self.entries[self.resolve(name)]
+        if entry.graph is not None:
+            return self.get_graph(entry.name)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_graph, entry.name)
+
+    def _load(self, entry: AgentEntry):
+        start = time.perf_counter()
+        module = self._import(entry)
+        entry.graph = _compile(getattr(module, entry.attribute))
+        load_seconds.observe(time.perf_counter() - start)
+        agent_loads.inc(labels={"agent": entry.name})
+        agents_loaded.set(self.loaded_count())
+        print(f"Agent {entry.name} loaded in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _import(self, entry: AgentEntry):
+        module_name = os.path.splitext(os.path.basename(entry.path))[0]
+        module = sys.modules.get(module_name)
+        if module is not None and os.path.abspath(getattr(module, "__file__", "") or "") == entry.path:
+            # Already imported by the server (e.g. agent.py): share it, never release it
+            entry.module_name, entry.owns_module = module_name, False
+            return module
+        if module is not None:
+            module_name = f"_agent_{entry.name}_{module_name}"
+        spec = importlib.util.spec_from_file_location(module_name, entry.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(module_name, None)
+            raise
+        entry.module_name, entry.owns_module = module_name, True
+        return module
+
+    def loaded_count(self) -> int:
+        return sum(1 for entry in self.entries.values() if entry.graph is not None)
+
+    def pin(self, name: str):
+        """Keep agent `name` loaded: unload() leaves it alone from now on."""
+        self.entries[self.resolve(name)].pinned = True
+
+    def unload(self, name: str, reason: str = "manual") -> bool:
+        """Drop agent `name`'s compiled graph (runs in progress keep their reference); no-op when pinned."""
+        entry = self.entries[name]
+        with entry.lock:
+            if entry.graph is None or entry.pinned:
+                return False
+            entry.graph = None
+            if entry.owns_module and entry.module_name:
+                # Shared with no one else: let the module (and what it built) be freed
+                sys.modules.pop(entry.module_name, None)
+                entry.module_name, entry.owns_module = None, False
+        agent_unloads.inc(labels={"reason": reason})
+        agents_loaded.set(self.loaded_count())
+        print(f"Agent {name} unloaded ({reason})")
+        return True
+
+    def _check_pressure(self):
+        now = time.monotonic()
+        if now - self._last_pressure_check < _PRESSURE_CHECK_INTERVAL_S and (
+            not AGENT_MAX_LOADED or self.loaded_count() <= AGENT_MAX_LOADED
+        ):
+            return
+        self._last_pressure_check = now
+        self.unload_idle()
+
+    def unload_idle(self) -> List[str]:
+        """Unload agents over AGENT_MAX_LOADED, then idle agents while the RSS is over AGENT_MEMORY_LIMIT_MB."""
+        loaded = sorted(
+            (entry for entry in self.entries.values() if entry.graph is not None and not entry.pinned),
+            key=lambda entry: entry.last_used,
+        )
+        unloaded = []
+        if AGENT_MAX_LOADED:
+            while len(loaded) > AGENT_MAX_LOADED:
+                entry = loaded.pop(0)
+                if self.unload(entry.name, "max_loaded"):
+                    unloaded.append(entry.name)
+        rss = rss_mb() if AGENT_MEMORY_LIMIT_MB else None
+        if rss is not None and rss > AGENT_MEMORY_LIMIT_MB:
+            idle_before = time.monotonic() - AGENT_IDLE_S
+            for entry in loaded:
+                if entry.last_used > idle_before:
+                    break
+                if self.unload(entry.name, "memory"):
+                    unloaded.append(entry.name)
+                gc.collect()
+                rss = rss_mb()
+                if rss is None or rss <= AGENT_MEMORY_LIMIT_MB:
+                    break
+        return unloaded
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "config": self.config_path,
+            "default": self.default,
+            "rssMb": rss_mb(),
+            "agents": [
+                {
+                    **entry.describe(),
+                    "loaded": entry.graph is not None,
+                    "pinned": entry.pinned,
+                    "idleS": round(now - entry.last_used, 1) if entry.last_used else None,
+                }
+                for entry in self.entries.values()
+            ],
+        }
+
+
+registry = AgentRegistry()
+
+
+def add_agent_registry(app, path: str = "/debug/agents"):
+    """Expose the registry's agents, their load state and the process RSS on `path` (admin token, see admin.py)."""
+    from fastapi import Request
+
+    from admin import admin_denied
+
+    async def agent_stats(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        return registry.stats()
+
+    app.add_api_route(path, agent_stats, methods=["GET"], include_in_schema=False)
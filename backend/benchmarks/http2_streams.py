@@ -0,0 +1,146 @@
+"""
+HTTP/1.1 vs HTTP/2 latency with many concurrent streams from one client.
+
+A browser opens at most 6 HTTP/1.1 connections per origin, and every streaming
+generateCopilotResponse holds one; over HTTP/2 all of a page's streams share one
+connection. For each --streams step this starts that many streams at once (the
+first turn of synthetic sessions, each on a fresh thread):
+- http1: over at most --h1-connections connections (default 6, the browser cap)
+- http2: over one HTTP/2 connection (h2c prior knowledge for http:// URLs, ALPN
+  for https://)
+and reports per protocol the time to response headers (includes queueing for a
+connection), TTFT (first content frame) and completion, p50/p95/p99, and the
+wall time of the step.
+
+Serve HTTP/2 and HTTP/1.1 from the same server (see serving.py), with a fake model:
+    AGENT_MODEL_BACKEND=fake SERVER_HTTP=2 python serving.py server_ndjson:app
+
+Usage (from backend/; needs httpx with HTTP/2 support: pip install "httpx[http2]"):
+    python benchmarks/http2_streams.py --url http://localhost:3006/copilotkit/ --streams 6,24,96
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import TurnResult, percentile, record_chunk, synthetic_sessions, with_thread_id  # noqa: E402
+
+_HEADERS = {"Content-Type": "application/json", "Accept": "multipart/mixed, application/x-ndjson, application/json"}
+
+
+def make_client(protocol: str, h1_connections: int, verify: bool):
+    import httpx
+
+    if protocol == "http2":
+        return httpx.AsyncClient(http1=False, http2=True, verify=verify, limits=httpx.Limits(max_connections=1))
+    return httpx.AsyncClient(
+        http1=True, http2=False, verify=verify,
+        limits=httpx.Limits(max_connections=h1_connections, max_keepalive_connections=h1_connections),
+    )
+
+
+async def stream_turn(client, url: str, payload: bytes, timeout: float, http_version: str) -> TurnResult:
+    import httpx
+
+    result = TurnResult(time.perf_counter())
+    try:
+        # No pool timeout: waiting for a free connection is what is measured
+        async with client.stream("POST", url, content=payload, headers=_HEADERS, timeout=httpx.Timeout(timeout, pool=None)) as response:
+            result.first_byte = time.perf_counter()
+            result.status = response.status_code
+            if response.http_version != http_version:
+                raise RuntimeError(f"served over {response.http_version}, not {http_version}")
+            pending = b""
+            async for chunk in response.aiter_bytes():
+                pending = record_chunk(result, pending, chunk)
+        result.ok = 200 <= result.status < 300
+    except Exception as e:  # Connection errors and timeouts are results, not crashes
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.end = time.perf_counter()
+    return result
+
+
+def summarize(results: List[TurnResult], wall_s: float) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+
+    def dist(values):
+        return {f"p{int(q * 100)}": round(percentile(values, q), 1) for q in (0.5, 0.95, 0.99)}
+
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = r.error or f"HTTP {r.status}"
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "streams": len(results),
+        "ok": len(ok),
+        "wall_s": round(wall_s, 2),
+        "headers_ms": dist([(r.first_byte - r.start) * 1000 for r in ok if r.first_byte]),
+        "ttft_ms": dist([(r.first_content - r.start) * 1000 for r in ok if r.first_content]),
+        "completion_ms": dist([(r.end - r.start) * 1000 for r in ok]),
+        "errors": errors,
+    }
+
+
+async def run_step(url: str, sessions: List[List[Dict[str, Any]]], streams: int, protocol: str, args) -> Dict[str, Any]:
+    http_version = "HTTP/2" if protocol == "http2" else "HTTP/1.1"
+    payloads = [with_thread_id(sessions[i % len(sessions)][0], f"h2-{uuid.uuid4()}") for i in range(streams)]
+    async with make_client(protocol, args.h1_connections, not args.insecure) as client:
+        # Open the connection (and compile the graph) outside the measurement
+        await stream_turn(client, url, with_thread_id(sessions[0][0], f"h2-warmup-{uuid.uuid4()}"), args.timeout, http_version)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(stream_turn(client, url, payload, args.timeout, http_version) for payload in payloads))
+        return summarize(list(results), time.perf_counter() - start)
+
+
+async def run(args) -> Dict[str, Any]:
+    sessions = synthetic_sessions(max(args.sessions, 1), 1, args.actions, args.words)
+    steps = []
+    for streams in (int(value) for value in args.streams.split(",")):
+        for protocol in ("http1", "http2"):
+            summary = await run_step(args.url, sessions, streams, protocol, args)
+            steps.append({"protocol": protocol, **summary})
+            print(
+                f"{protocol:>5} streams={streams:<4} ok={summary['ok']:<4} wall={summary['wall_s']:>6}s  "
+                f"headers {summary['headers_ms']}  ttft {summary['ttft_ms']}  completion {summary['completion_ms']}"
+            )
+            if summary["errors"]:
+                print(f"      errors {summary['errors']}")
+    return {"url": args.url, "h1Connections": args.h1_connections, "steps": steps}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:3006/copilotkit/", help="generateCopilotResponse endpoint")
+    parser.add_argument("--streams", default="6,24,96", help="Comma-separated concurrent stream counts")
+    parser.add_argument("--h1-connections", type=int, default=6, help="HTTP/1.1 connections per origin (browser cap)")
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct synthetic sessions")
+    parser.add_argument("--actions", type=int, default=8, help="Max frontend actions per synthetic session")
+    parser.add_argument("--words", type=int, default=40, help="Max words per synthetic user message")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-read timeout (seconds)")
+    parser.add_argument("--insecure", action="store_true", help="Do not verify the TLS certificate (self-signed h2)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        import h2  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        raise SystemExit('Needs httpx with HTTP/2 support: pip install "httpx[http2]"')
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
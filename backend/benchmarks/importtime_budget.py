@@ -0,0 +1,104 @@
+"""
+Import-time benchmark for the server entry points.
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for each entry
+point and fails (exit code 1) when the cumulative import time exceeds its budget.
+
+Usage (from backend/):
+    python benchmarks/importtime_budget.py
+    python benchmarks/importtime_budget.py --repeat 5 --top 15
+    python benchmarks/importtime_budget.py --budget-ms 300 server_ndjson
+
+Budgets are read from benchmarks/importtime_budget.json ({"module": budget_ms}).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "importtime_budget.json")
+PYTHONPATH = [BACKEND_DIR, os.path.join(BACKEND_DIR, "python-implementations")]
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[float, str]]]:
+    """
+    Import `module` in a fresh interpreter.
+    Returns the cumulative import time of the module (ms) and the self time (ms)
+    of every module it pulled in.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(PYTHONPATH + [env.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+    # Never let the benchmark warm up the agent or read a real key
+    env["AGENT_WARMUP"] = "off"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        raise RuntimeError(f"import {module} failed: {last_line}")
+
+    cumulative_ms = None
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append((int(self_us) / 1000, name.strip()))
+        if name.strip() == module:
+            cumulative_ms = int(cumulative_us) / 1000
+
+    if cumulative_ms is None:
+        raise RuntimeError(f"import {module}: no importtime entry found")
+    return cumulative_ms, sorted(imports, reverse=True)
+
+
+def load_budgets() -> Dict[str, float]:
+    with open(BUDGET_FILE) as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: every module in the budget file)")
+    parser.add_argument("--budget-ms", type=float, help="Override the budget for every module")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module, the best one is kept")
+    parser.add_argument("--top", type=int, default=10, help="Show the N slowest imports per module")
+    args = parser.parse_args(argv)
+
+    budgets = load_budgets()
+    modules = args.modules or list(budgets)
+
+    failed = False
+    for module in modules:
+        budget = args.budget_ms if args.budget_ms is not None else budgets.get(module)
+        try:
+            runs = [measure_import(module) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            print(f"✗ {e}")
+            failed = True
+            continue
+
+        best_ms, imports = min(runs, key=lambda run: run[0])
+        over_budget = budget is not None and best_ms > budget
+        failed = failed or over_budget
+
+        status = "✗" if over_budget else "✓"
+        budget_text = f"{budget:.0f} ms" if budget is not None else "no budget"
+        print(f"{status} {module}: {best_ms:.1f} ms (budget {budget_text})")
+        for self_ms, name in imports[:args.top]:
+            print(f"    {self_ms:8.1f} ms  {name}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
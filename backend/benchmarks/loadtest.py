@@ -0,0 +1,428 @@
+"""
+Load generator that replays CopilotKit sessions against any of the Python servers.
+
+Sessions come from a recording (RECORD_REQUESTS_PATH, see session_recording.py) or
+are synthesized with growing message histories and frontend action sets. Each
+virtual user replays one session turn by turn under its own threadId.
+
+Arrival models:
+- closed loop (--mode closed): N concurrent users, each sends its next turn when
+  the previous one completes (plus --think-ms)
+- open loop (--mode open): turns arrive as a Poisson process at --rate req/s,
+  independent of how fast the server answers
+
+Sweeping --rates or --concurrency runs one step per value and reports where
+throughput saturates (achieved throughput stops tracking the offered load, or
+p95 completion latency doubles versus the first step).
+
+For reproducible runs start the server with a fake or recorded model backend, e.g.
+    AGENT_MODEL_BACKEND=fake uvicorn server_ndjson:app --port 3006
+
+Usage (from backend/):
+    python benchmarks/loadtest.py --url http://localhost:3006/copilotkit/ --synthetic 50
+    python benchmarks/loadtest.py --url http://localhost:3006/copilotkit/ \\
+        --sessions recorded.jsonl --mode open --rates 1,2,4,8,16 --duration 30
+    python benchmarks/loadtest.py --url http://localhost:3006/copilotkit/langgraph \\
+        --synthetic 20 --mode closed --concurrency 1,4,16,64
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+# ----------------------------------------------------------------------------
+# Sessions
+# ----------------------------------------------------------------------------
+
+
+def load_recorded_sessions(path: str) -> List[List[Dict[str, Any]]]:
+    """Group recorded request bodies by threadId, keeping their recorded order."""
+    sessions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            body = json.loads(record["body"])
+            thread_id = record.get("threadId") or str(uuid.uuid4())
+            sessions.setdefault(thread_id, []).append(body)
+    return list(sessions.values())
+
+
+def _synthetic_action(index: int) -> Dict[str, Any]:
+    return {
+        "name": f"frontend_action_{index}",
+        "description": f"Synthetic frontend action number {index} used for load testing.",
+        "jsonSchema": json.dumps({
+            "type": "object",
+            "properties": {
+                "value": {"type": "string", "description": "Value passed to the action"},
+                "count": {"type": "number", "description": "How many times to apply it"},
+            },
+            "required": ["value"],
+        }),
+        "available": "enabled",
+    }
+
+
+def synthetic_sessions(count: int, turns: int, actions: int, words: int, seed: int = 7) -> List[List[Dict[str, Any]]]:
+    """
+    Build `count` sessions of `turns` generateCopilotResponse bodies. Every turn
+    carries the full history so far (like the frontend does), so payloads grow.
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(count):
+        thread_id = str(uuid.uuid4())
+        action_set = [_synthetic_action(i) for i in range(rng.randint(max(1, actions // 2), max(1, actions)))]
+        history: List[Dict[str, Any]] = []
+        session = []
+        for turn in range(turns):
+            text = " ".join(f"word{rng.randint(0, 999)}" for _ in range(rng.randint(1, words)))
+            history.append({"id": str(uuid.uuid4()), "textMessage": {"role": "user", "content": f"Turn {turn}: {text}"}})
+            session.append({
+                "operationName": "generateCopilotResponse",
+                "query": "mutation generateCopilotResponse($data: GenerateCopilotResponseInput!) { generateCopilotResponse(data: $data) { threadId runId } }",
+                "variables": {"data": {
+                    "threadId": thread_id,
+                    "agentSession": {"agentName": "agentic_chat"},
+                    "agentStates": [],
+                    "context": [],
+                    "frontend": {"actions": action_set},
+                    "messages": list(history),
+                }},
+            })
+            # Assume an answer of similar length for the next turn's history
+            history.append({"id": str(uuid.uuid4()), "textMessage": {"role": "assistant", "content": f"Answer to turn {turn}: {text}"}})
+        sessions.append(session)
+    return sessions
+
+
+def with_thread_id(body: Dict[str, Any], thread_id: str) -> bytes:
+    """Re-target a recorded body at a fresh thread so concurrent replays don't share state."""
+    body = json.loads(json.dumps(body))
+    data = body.setdefault("variables", {}).setdefault("data", {})
+    data["threadId"] = thread_id
+    return json.dumps(body).encode("utf-8")
+
+
+# ----------------------------------------------------------------------------
+# Minimal streaming HTTP/1.1 client (stdlib only)
+# ----------------------------------------------------------------------------
+
+
+class TurnResult:
+    __slots__ = ("ok", "status", "start", "first_byte", "first_content", "end", "frame_times", "bytes", "error")
+
+    def __init__(self, start: float):
+        self.ok = False
+        self.status = 0
+        self.start = start
+        self.first_byte: Optional[float] = None
+        self.first_content: Optional[float] = None
+        self.end: Optional[float] = None
+        self.frame_times: List[float] = []
+        self.bytes = 0
+        self.error = ""
+
+
+def _is_content_frame(line: bytes) -> bool:
+    """A frame that carries assistant text (incremental item appended to a message's content)."""
+    if not line.startswith(b"{") or b'"incremental"' not in line:
+        return False
+    try:
+        frame = json.loads(line)
+    except ValueError:
+        return False
+    for item in frame.get("incremental", []):
+        path = item.get("path") or []
+        if "content" in path and item.get("items"):
+            return True
+    return False
+
+
+def record_chunk(result: TurnResult, pending: bytes, chunk: bytes) -> bytes:
+    """Timestamp the frames completed by `chunk`; returns the incomplete rest."""
+    now = time.perf_counter()
+    result.bytes += len(chunk)
+    *lines, pending = (pending + chunk).split(b"\n")
+    for line in lines:
+        line = line.strip()
+        if not line.startswith(b"{"):
+            continue
+        result.frame_times.append(now)
+        if result.first_content is None and _is_content_frame(line):
+            result.first_content = now
+    return pending
+
+
+async def send_turn(url: str, payload: bytes, timeout: float) -> TurnResult:
+    """POST one generateCopilotResponse and timestamp every frame of the streamed answer."""
+    parts = urlsplit(url)
+    if parts.scheme != "http":
+        raise ValueError("Only http:// URLs are supported")
+    host, port = parts.hostname, parts.port or 80
+    path = parts.path or "/"
+
+    result = TurnResult(time.perf_counter())
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            f"Content-Type: application/json\r\nAccept: multipart/mixed, application/x-ndjson, application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("ascii") + payload
+        )
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        result.first_byte = time.perf_counter()
+        result.status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        pending = b""
+        async for chunk in _read_body(reader, headers, timeout):
+            pending = record_chunk(result, pending, chunk)
+        result.ok = 200 <= result.status < 300
+    except Exception as e:  # Connection errors and timeouts are results, not crashes
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.end = time.perf_counter()
+        if writer is not None:
+            writer.close()
+    return result
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str], timeout: float):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), timeout)
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                return
+            chunk = await asyncio.wait_for(reader.readexactly(size), timeout)
+            await reader.readline()
+            yield chunk
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            chunk = await asyncio.wait_for(reader.read(min(remaining, 65536)), timeout)
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await asyncio.wait_for(reader.read(65536), timeout)
+            if not chunk:
+                return
+            yield chunk
+
+
+# ----------------------------------------------------------------------------
+# Arrival models
+# ----------------------------------------------------------------------------
+
+
+class SessionPool:
+    """Hands out the next turn of each session to virtual users, under fresh threadIds."""
+
+    def __init__(self, sessions: List[List[Dict[str, Any]]]):
+        self.sessions = sessions
+        self._next_session = 0
+
+    def next_user(self) -> List[Any]:
+        session = self.sessions[self._next_session % len(self.sessions)]
+        self._next_session += 1
+        return [session, 0, f"lt-{uuid.uuid4()}"]
+
+    def next_payload(self, user: List[Any]) -> bytes:
+        session, turn, thread_id = user
+        if turn >= len(session):
+            user[:] = self.next_user()
+            session, turn, thread_id = user
+        user[1] = turn + 1
+        return with_thread_id(session[turn], thread_id)
+
+
+async def run_closed_loop(url: str, pool: SessionPool, concurrency: int, duration: float, think_ms: float, timeout: float) -> List[TurnResult]:
+    results: List[TurnResult] = []
+    deadline = time.perf_counter() + duration
+
+    async def user_loop():
+        user = pool.next_user()
+        while time.perf_counter() < deadline:
+            results.append(await send_turn(url, pool.next_payload(user), timeout))
+            if think_ms:
+                await asyncio.sleep(think_ms / 1000)
+
+    await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(url: str, pool: SessionPool, rate: float, duration: float, timeout: float, seed: int = 11) -> List[TurnResult]:
+    """Poisson arrivals at `rate` req/s; each arrival continues a session (or starts one)."""
+    rng = random.Random(seed)
+    tasks = []
+    idle_users: List[List[Any]] = []
+    deadline = time.perf_counter() + duration
+
+    async def one_turn(user):
+        result = await send_turn(url, pool.next_payload(user), timeout)
+        idle_users.append(user)
+        return result
+
+    while time.perf_counter() < deadline:
+        user = idle_users.pop() if idle_users else pool.next_user()
+        tasks.append(asyncio.ensure_future(one_turn(user)))
+        await asyncio.sleep(rng.expovariate(rate))
+    return list(await asyncio.gather(*tasks))
+
+
+# ----------------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------------
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(results: List[TurnResult], elapsed: float) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    ttft = [(r.first_content - r.start) * 1000 for r in ok if r.first_content]
+    completion = [(r.end - r.start) * 1000 for r in ok]
+    gaps = [
+        (later - earlier) * 1000
+        for r in ok
+        for earlier, later in zip(r.frame_times, r.frame_times[1:])
+    ]
+
+    def dist(values):
+        return {f"p{int(q * 100)}": round(percentile(values, q), 1) for q in (0.5, 0.9, 0.95, 0.99)}
+
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = r.error or f"HTTP {r.status}"
+            errors[key] = errors.get(key, 0) + 1
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "ttft_ms": dist(ttft),
+        "inter_frame_gap_ms": dist(gaps),
+        "completion_ms": dist(completion),
+        "mean_bytes": round(sum(r.bytes for r in ok) / len(ok)) if ok else 0,
+        "errors": errors,
+    }
+
+
+def detect_saturation(steps: List[Dict[str, Any]], mode: str) -> Optional[Dict[str, Any]]:
+    """
+    First step where throughput stops tracking the offered load:
+    - open loop: achieved < 90% of the offered rate, or p95 completion >= 2x the first step
+    - closed loop: doubling-ish concurrency adds < 10% throughput, or p95 >= 2x the first step
+    """
+    if not steps:
+        return None
+    baseline_p95 = steps[0]["summary"]["completion_ms"]["p95"]
+    for previous, step in zip([None] + steps, steps):
+        summary = step["summary"]
+        p95 = summary["completion_ms"]["p95"]
+        if step is not steps[0] and not math.isnan(baseline_p95) and p95 >= 2 * baseline_p95:
+            return {"at": step["load"], "reason": f"p95 completion {p95}ms >= 2x baseline {baseline_p95}ms"}
+        if mode == "open" and summary["throughput_rps"] < 0.9 * step["load"]:
+            return {"at": step["load"], "reason": f"achieved {summary['throughput_rps']} req/s < 90% of offered {step['load']}"}
+        if mode == "closed" and previous is not None:
+            gain = summary["throughput_rps"] / max(previous["summary"]["throughput_rps"], 1e-9)
+            if gain < 1.1:
+                return {"at": step["load"], "reason": f"throughput +{(gain - 1) * 100:.0f}% from concurrency {previous['load']} to {step['load']}"}
+    return None
+
+
+def print_step(mode: str, load: float, summary: Dict[str, Any]):
+    label = f"rate={load} req/s" if mode == "open" else f"concurrency={int(load)}"
+    print(f"\n== {label}: {summary['ok']}/{summary['requests']} ok, {summary['throughput_rps']} req/s")
+    print(f"   TTFT          {summary['ttft_ms']}")
+    print(f"   frame gap     {summary['inter_frame_gap_ms']}")
+    print(f"   completion    {summary['completion_ms']}")
+    if summary["errors"]:
+        print(f"   errors        {summary['errors']}")
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.sessions:
+        sessions = load_recorded_sessions(args.sessions)
+    else:
+        sessions = synthetic_sessions(args.synthetic, args.turns, args.actions, args.words)
+    if not sessions:
+        raise SystemExit("No sessions to replay")
+    print(f"Replaying {len(sessions)} sessions ({sum(len(s) for s in sessions)} turns) against {args.url}")
+
+    loads = [float(x) for x in (args.rates if args.mode == "open" else args.concurrency).split(",")]
+    steps = []
+    for load in loads:
+        pool = SessionPool(sessions)
+        start = time.perf_counter()
+        if args.mode == "open":
+            results = await run_open_loop(args.url, pool, load, args.duration, args.timeout)
+        else:
+            results = await run_closed_loop(args.url, pool, int(load), args.duration, args.think_ms, args.timeout)
+        summary = summarize(results, time.perf_counter() - start)
+        print_step(args.mode, load, summary)
+        steps.append({"load": load, "summary": summary})
+
+    saturation = detect_saturation(steps, args.mode)
+    if len(steps) > 1:
+        print(f"\nSaturation: {saturation['reason'] + ' (at ' + str(saturation['at']) + ')' if saturation else 'not reached'}")
+    return {"mode": args.mode, "url": args.url, "steps": steps, "saturation": saturation}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:3006/copilotkit/", help="generateCopilotResponse endpoint")
+    parser.add_argument("--sessions", help="Recorded sessions (RECORD_REQUESTS_PATH file)")
+    parser.add_argument("--synthetic", type=int, default=20, help="Number of synthetic sessions when --sessions is not given")
+    parser.add_argument("--turns", type=int, default=6, help="Turns per synthetic session")
+    parser.add_argument("--actions", type=int, default=8, help="Max frontend actions per synthetic session")
+    parser.add_argument("--words", type=int, default=40, help="Max words per synthetic user message")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", default="1,4,16", help="Closed loop: comma-separated concurrency steps")
+    parser.add_argument("--rates", default="1,2,4", help="Open loop: comma-separated arrival rates (req/s)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per step")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Closed loop: pause between a user's turns")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-read timeout (seconds)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Memory and conversion-time benchmark for the state message formats
+(STATE_MESSAGES=langchain vs compact, see message_records.py).
+
+Builds --threads synthetic conversations of --turns turns each (a short user
+message, an assistant reply carrying the response and usage metadata a real model
+call leaves on it, and every few turns a tool call), the way the servers and
+chat_node fill the state, and reports per format:
+- conversion: time to turn the request messages into state messages
+- resident: bytes allocated (tracemalloc) to hold every thread's messages, per thread
+- checkpoint: serialized size of one thread's messages (LangGraph's JsonPlusSerializer,
+  when langgraph is installed)
+- materialize: time to build the LangChain prompt messages from the state
+  (a no-op for the langchain format)
+
+The langchain rows need langchain_core; without it only the compact rows are printed.
+
+Usage (from backend/):
+    python benchmarks/state_memory.py --threads 200 --turns 20
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_records import MessageRecord, as_langchain  # noqa: E402
+
+_REPLIES = ["Done!", "Sure, I changed it.", "Here is what I found: " + "lorem ipsum " * 30]
+_PROMPTS = ["ok", "thanks", "make the background blue", "add a todo: buy milk", "what can you do?"]
+
+
+def conversation(seed: int, turns: int) -> List[Dict[str, Any]]:
+    """One thread's messages as plain dicts (what the servers decode from a request)."""
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": rng.choice(_PROMPTS), "id": f"u-{seed}-{turn}"})
+        reply: Dict[str, Any] = {
+            "role": "assistant",
+            "content": rng.choice(_REPLIES),
+            "id": f"run-{seed}-{turn}",
+            "usage_metadata": {"input_tokens": 900 + turn * 40, "output_tokens": 35, "total_tokens": 935 + turn * 40},
+        }
+        if turn % 4 == 3:
+            reply["tool_calls"] = [{"id": f"call-{seed}-{turn}", "name": "setThemeColor", "args": {"color": "blue"}, "type": "tool_call"}]
+        messages.append(reply)
+    return messages
+
+
+def langchain_messages(messages: List[Dict[str, Any]]) -> List[Any]:
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    converted = []
+    for message in messages:
+        if message["role"] == "user":
+            converted.append(HumanMessage(content=message["content"], id=message["id"]))
+        else:
+            converted.append(AIMessage(
+                content=message["content"],
+                id=message["id"],
+                tool_calls=message.get("tool_calls", []),
+                usage_metadata=message["usage_metadata"],
+                response_metadata={"finish_reason": "stop", "model_name": "gpt-4o-2024-08-06", "system_fingerprint": "fp_1"},
+            ))
+    return converted
+
+
+def compact_messages(messages: List[Dict[str, Any]]) -> List[Any]:
+    return [
+        MessageRecord(
+            message["role"], message["content"], message["id"],
+            tool_calls=message.get("tool_calls"), usage_metadata=message.get("usage_metadata"),
+        )
+        for message in messages
+    ]
+
+
+def checkpoint_bytes(messages: List[Any]) -> Optional[int]:
+    try:
+        from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    except ImportError:
+        return None
+    _, data = JsonPlusSerializer().dumps_typed(messages)
+    return len(data)
+
+
+def measure(name: str, convert: Callable[[List[Dict[str, Any]]], List[Any]], threads: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    states = [convert(messages) for messages in threads]
+    conversion_s = time.perf_counter() - start
+    resident, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    materialize_ms = None
+    try:
+        start = time.perf_counter()
+        for state in states:
+            as_langchain(state)
+        materialize_ms = (time.perf_counter() - start) * 1000
+    except ImportError:
+        pass
+
+    return {
+        "format": name,
+        "conversionMs": conversion_s * 1000,
+        "residentPerThread": resident // len(threads),
+        "checkpointBytes": checkpoint_bytes(states[0]),
+        "materializeMs": materialize_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    threads = [conversation(seed, args.turns) for seed in range(args.threads)]
+    results = []
+    try:
+        import langchain_core.messages  # noqa: F401
+
+        results.append(measure("langchain", langchain_messages, threads))
+    except ImportError:
+        print("langchain_core not installed: langchain rows skipped")
+    results.append(measure("compact", compact_messages, threads))
+
+    print(f"{args.threads} threads x {args.turns} turns ({args.turns * 2} messages per thread)")
+    print(f"{'format':>10} {'convert ms':>11} {'resident/thread':>16} {'checkpoint':>11} {'materialize ms':>15}")
+    for result in results:
+        checkpoint = result["checkpointBytes"] if result["checkpointBytes"] is not None else "-"
+        materialize = f"{result['materializeMs']:.1f}" if result["materializeMs"] is not None else "-"
+        print(
+            f"{result['format']:>10} {result['conversionMs']:>11.1f} {result['residentPerThread']:>16} "
+            f"{checkpoint:>11} {materialize:>15}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+End-to-end check of frontend tool round-trips with TOOL_RESUME=interrupt (hot_runs.py).
+
+Each round drives one thread through what the CopilotKit frontend does with a
+frontend action:
+1. a generateCopilotResponse turn whose answer calls the action: the stream must
+   carry an ActionExecutionMessageOutput whose id is the tool-call id, and the run
+   pauses at it
+2. the next generateCopilotResponse with the history, the action execution and its
+   resultMessage (actionExecutionId = that id): the paused run must resume and
+   answer with text, without calling the action again
+
+and reports per round the time of the resume turn (p50/p95), plus the change of
+hot_runs_total by event on /metrics (resumed_hot when the run was still held).
+Exits non-zero when a round fails.
+
+Start the server with a fake model that calls the first frontend action:
+    TOOL_RESUME=interrupt AGENT_MODEL_BACKEND=fake FAKE_MODEL_TOOL_CALLS=on python server_ndjson.py
+
+Usage (from backend/):
+    python benchmarks/tool_resume.py --url http://localhost:3006 --rounds 20
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import _synthetic_action, percentile  # noqa: E402
+
+_HOT_RUN_EVENT = re.compile(r'^hot_runs_total\{event="(\w+)"\} ([0-9.e+]+)$', re.MULTILINE)
+
+
+def _request(url: str, method: str = "GET", body: Optional[bytes] = None, timeout: float = 60.0) -> Tuple[int, str]:
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    try:
+        headers = {"Content-Type": "application/json", "Accept": "multipart/mixed, application/x-ndjson"} if body else {}
+        connection.request(method, parts.path or "/", body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read().decode("utf-8")
+    finally:
+        connection.close()
+
+
+def stream_items(text: str) -> List[Dict[str, Any]]:
+    """The incremental entries of an NDJSON or multipart generateCopilotResponse stream."""
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        entries.extend(json.loads(line).get("incremental", []))
+    return entries
+
+
+def action_executions(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        item for entry in entries for item in entry.get("items", [])
+        if isinstance(item, dict) and item.get("__typename") == "ActionExecutionMessageOutput"
+    ]
+
+
+def response_status(entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    for entry in entries:
+        data = entry.get("data") or {}
+        if data.get("__typename") == "CopilotResponse":
+            return data.get("status")
+    return None
+
+
+def text_of(entries: List[Dict[str, Any]]) -> str:
+    return "".join(
+        item for entry in entries if "content" in (entry.get("path") or [])
+        for item in entry.get("items", []) if isinstance(item, str)
+    )
+
+
+def hot_run_events(base: str) -> Dict[str, float]:
+    status, text = _request(base + "/metrics")
+    if status != 200:
+        return {}
+    return {event: float(value) for event, value in _HOT_RUN_EVENT.findall(text)}
+
+
+def _body(thread_id: str, action: Dict[str, Any], messages: List[Dict[str, Any]]) -> bytes:
+    return json.dumps({
+        "operationName": "generateCopilotResponse",
+        "variables": {"data": {
+            "threadId": thread_id,
+            "agentSession": {"agentName": "agentic_chat"},
+            "frontend": {"actions": [action]},
+            "messages": messages,
+        }},
+    }).encode("utf-8")
+
+
+def run_round(url: str, timeout: float) -> Dict[str, Any]:
+    thread_id = f"tool-resume-{uuid.uuid4()}"
+    action = _synthetic_action(0)
+    history = [{"id": str(uuid.uuid4()), "textMessage": {"role": "user", "content": "Run the frontend action"}}]
+
+    status, text = _request(url, "POST", _body(thread_id, action, history), timeout)
+    entries = stream_items(text)
+    calls = action_executions(entries)
+    if status != 200 or not calls:
+        reason = (response_status(entries) or {}).get("reason") or f"HTTP {status}"
+        return {"ok": False, "error": f"no ActionExecutionMessageOutput in the first turn ({reason})"}
+    call = calls[0]
+
+    history += [
+        {"id": call["id"], "actionExecutionMessage": {
+            "name": call["name"], "arguments": call["arguments"][0], "parentMessageId": call["parentMessageId"],
+        }},
+        {"id": str(uuid.uuid4()), "resultMessage": {
+            "actionExecutionId": call["id"], "actionName": call["name"], "result": json.dumps({"done": True}),
+        }},
+    ]
+    start = time.perf_counter()
+    status, text = _request(url, "POST", _body(thread_id, action, history), timeout)
+    resume_ms = (time.perf_counter() - start) * 1000
+    entries = stream_items(text)
+    result = response_status(entries) or {}
+    if status != 200 or result.get("code") != "Success":
+        return {"ok": False, "error": f"resume failed: {result.get('reason') or f'HTTP {status}'}"}
+    if action_executions(entries):
+        return {"ok": False, "error": "the resumed run called the action again (not resumed)"}
+    if not text_of(entries):
+        return {"ok": False, "error": "the resumed run answered no text"}
+    return {"ok": True, "resume_ms": resume_ms}
+
+
+def run(args) -> Dict[str, Any]:
+    base = args.url.rstrip("/")
+    url = base + args.path
+    before = hot_run_events(base)
+    rounds = [run_round(url, args.timeout) for _ in range(args.rounds)]
+    after = hot_run_events(base)
+
+    resume_ms = [row["resume_ms"] for row in rounds if row["ok"]]
+    report = {
+        "url": url,
+        "rounds": len(rounds),
+        "ok": len(resume_ms),
+        "resume_ms": {f"p{int(q * 100)}": round(percentile(resume_ms, q), 1) for q in (0.5, 0.95)},
+        "hot_run_events": {event: after[event] - before.get(event, 0) for event in after if after[event] != before.get(event, 0)},
+        "errors": sorted({row["error"] for row in rounds if not row["ok"]}),
+    }
+    print(f"rounds={report['rounds']} ok={report['ok']}  resume turn {report['resume_ms']}")
+    print(f"hot_runs_total delta {report['hot_run_events']}")
+    for error in report["errors"]:
+        print(f"error: {error}")
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:3006", help="Server base URL")
+    parser.add_argument("--path", default="/copilotkit/", help="generateCopilotResponse endpoint")
+    parser.add_argument("--rounds", type=int, default=10, help="Pause/resume round-trips, one thread each")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout (seconds)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["rounds"] and report["ok"] == report["rounds"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
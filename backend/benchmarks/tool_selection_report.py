@@ -0,0 +1,146 @@
+"""
+Offline report for tool_selection: tool recall and prompt tokens saved per turn.
+
+Labelled turns come from recorded sessions (RECORD_REQUESTS_PATH, see
+session_recording.py): in a request's message history, every user message that
+was followed by actionExecutionMessages is a turn whose expected tools are the
+actions the model called. Each turn is counted once per thread, whichever
+recorded request it appears in. A JSONL file of explicit cases works too:
+    {"messages": [{"role": "user", "content": "..."}], "tools": [...], "expected": ["name"]}
+with `tools` in the OpenAI function format the servers bind.
+
+For each TOP_K the report prints:
+- recall: share of turns where every expected tool was kept
+- tools bound per turn (mean) out of the tools available
+- estimated prompt tokens of tool schemas saved per turn and in total
+
+Usage (from backend/):
+    python benchmarks/tool_selection_report.py --sessions recorded.jsonl --top-k 4,8,12
+    python benchmarks/tool_selection_report.py --cases cases.jsonl --json
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_layout import canonical_tools, tool_name  # noqa: E402
+from tool_selection import rank_tools, schema_tokens  # noqa: E402
+
+Turn = Tuple[List[Dict[str, Any]], List[Any], List[str]]
+
+
+def action_tool(action: Dict[str, Any]) -> Dict[str, Any]:
+    """A CopilotKit frontend action as the OpenAI function tool the servers bind."""
+    parameters: Any = action.get("jsonSchema") or action.get("parameters") or {}
+    if isinstance(parameters, str):
+        try:
+            parameters = json.loads(parameters)
+        except ValueError:
+            parameters = {}
+    if isinstance(parameters, list):
+        parameters = {
+            "type": "object",
+            "properties": {
+                param.get("name"): {"type": param.get("type", "string"), "description": param.get("description", "")}
+                for param in parameters
+            },
+        }
+    return {
+        "type": "function",
+        "function": {
+            "name": action.get("name"),
+            "description": action.get("description", ""),
+            "parameters": parameters,
+        },
+    }
+
+
+def session_turns(path: str) -> Iterator[Turn]:
+    """Labelled turns from a session recording."""
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            body = json.loads(record["body"]) if isinstance(record.get("body"), str) else record.get("body", record)
+            data = body.get("variables", {}).get("data", {})
+            tools = [action_tool(action) for action in data.get("frontend", {}).get("actions", [])]
+            history: List[Dict[str, Any]] = []
+            turns = []
+            for message in data.get("messages", []):
+                text = message.get("textMessage")
+                if text:
+                    history.append({"role": text.get("role"), "content": text.get("content", "")})
+                    if text.get("role") == "user":
+                        key = (data.get("threadId"), message.get("id") or text.get("content"))
+                        turns.append((key, list(history), []))
+                action = message.get("actionExecutionMessage")
+                if action and turns:
+                    turns[-1][2].append(action.get("name"))
+            for key, messages, expected in turns:
+                if expected and key not in seen:
+                    seen.add(key)
+                    yield messages, tools, expected
+
+
+def case_turns(path: str) -> Iterator[Turn]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                case = json.loads(line)
+                yield case["messages"], case["tools"], case["expected"]
+
+
+def report(turns: List[Turn], top_k: int) -> Dict[str, Any]:
+    hits = bound = available = saved = 0
+    for messages, tools, expected in turns:
+        fingerprint, canonical = canonical_tools(tools)
+        if len(canonical) <= top_k:
+            selected = {tool_name(tool) for tool in canonical}
+        else:
+            selected = rank_tools(messages, fingerprint, canonical, top_k)
+        hits += all(name in selected for name in expected)
+        bound += len(selected)
+        available += len(canonical)
+        saved += sum(schema_tokens(tool) for tool in canonical if tool_name(tool) not in selected)
+    count = max(len(turns), 1)
+    return {
+        "topK": top_k,
+        "turns": len(turns),
+        "recall": round(hits / count, 3),
+        "toolsBoundPerTurn": round(bound / count, 1),
+        "toolsAvailablePerTurn": round(available / count, 1),
+        "tokensSavedPerTurn": round(saved / count),
+        "tokensSavedTotal": saved,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sessions", help="session recording (RECORD_REQUESTS_PATH)")
+    source.add_argument("--cases", help="JSONL of {messages, tools, expected}")
+    parser.add_argument("--top-k", default="4,8,12", help="comma-separated TOP_K values to compare")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args()
+
+    # Turns where the model called an action, after de-duplicating repeated histories
+    turns = list(session_turns(args.sessions) if args.sessions else case_turns(args.cases))
+    results = [report(turns, int(k)) for k in args.top_k.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(turns)} labelled turns")
+    print(f"{'top-k':>6} {'recall':>7} {'bound':>7} {'of':>5} {'saved/turn':>11} {'saved total':>12}")
+    for result in results:
+        print(
+            f"{result['topK']:>6} {result['recall']:>7.1%} {result['toolsBoundPerTurn']:>7} "
+            f"{result['toolsAvailablePerTurn']:>5} {result['tokensSavedPerTurn']:>11} {result['tokensSavedTotal']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Per-turn payload and latency: POST generateCopilotResponse vs a WebSocket session.
+
+Replays the same synthetic multi-turn sessions (see loadtest.synthetic_sessions)
+two ways against one server:
+- post: every turn is a new POST carrying the full history and every frontend
+  action schema (what the CopilotKit frontend sends)
+- ws: one socket per session (ws_sessions.py); the actions are sent once when the
+  session opens, then each turn sends only its new user message
+
+and reports per transport the bytes uploaded per turn (p50/p95/max and by turn
+number, where POST grows with the history), TTFT (first content) and completion,
+p50/p95. Sessions run --concurrency at a time.
+
+Start the server with a fake model:
+    AGENT_MODEL_BACKEND=fake python server_ndjson.py
+
+Usage (from backend/; needs the websockets package):
+    python benchmarks/ws_sessions.py --url http://localhost:3006 --sessions 20 --turns 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import TurnResult, percentile, send_turn, synthetic_sessions, with_thread_id  # noqa: E402
+
+
+def ws_url(base: str, path: str) -> str:
+    return base.replace("https://", "wss://").replace("http://", "ws://").rstrip("/") + path
+
+
+async def post_session(url: str, turns: List[Dict[str, Any]], timeout: float) -> List[Dict[str, Any]]:
+    thread_id = f"ws-bench-post-{uuid.uuid4()}"
+    rows = []
+    for body in turns:
+        payload = with_thread_id(body, thread_id)
+        result = await send_turn(url, payload, timeout)
+        rows.append(_row(result, len(payload)))
+    return rows
+
+
+async def ws_session(url: str, turns: List[Dict[str, Any]], timeout: float) -> List[Dict[str, Any]]:
+    import websockets
+
+    data = turns[0]["variables"]["data"]
+    rows = []
+    async with websockets.connect(url, max_size=None) as socket:
+        await socket.send(json.dumps({
+            "type": "session", "threadId": f"ws-bench-ws-{uuid.uuid4()}",
+            "agentName": data["agentSession"]["agentName"], "actions": data["frontend"]["actions"],
+        }))
+        opened = json.loads(await asyncio.wait_for(socket.recv(), timeout))
+        if opened.get("type") != "session":
+            raise RuntimeError(f"Session not opened: {opened}")
+        for body in turns:
+            new_message = body["variables"]["data"]["messages"][-1]
+            payload = json.dumps({"type": "turn", "messages": [new_message]})
+            result = TurnResult(time.perf_counter())
+            await socket.send(payload)
+            try:
+                while True:
+                    event = json.loads(await asyncio.wait_for(socket.recv(), timeout))
+                    if result.first_byte is None:
+                        result.first_byte = time.perf_counter()
+                    if event["type"] in ("text", "tool_call") and result.first_content is None:
+                        result.first_content = time.perf_counter()
+                    elif event["type"] == "error":
+                        raise RuntimeError(event["message"])
+                    elif event["type"] == "run" and event["status"] != "started":
+                        result.ok = event["status"] == "success"
+                        result.error = event.get("error") or ("" if result.ok else event["status"])
+                        break
+            except Exception as e:  # Timeouts and server errors are results, not crashes
+                result.error = f"{type(e).__name__}: {e}"
+            result.end = time.perf_counter()
+            rows.append(_row(result, len(payload.encode("utf-8"))))
+    return rows
+
+
+def _row(result: TurnResult, sent: int) -> Dict[str, Any]:
+    return {
+        "ok": result.ok,
+        "sent": sent,
+        "ttft_ms": (result.first_content - result.start) * 1000 if result.first_content else None,
+        "completion_ms": (result.end - result.start) * 1000,
+        "error": result.error,
+    }
+
+
+def summarize(sessions: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    rows = [row for session in sessions for row in session]
+    ok = [row for row in rows if row["ok"]]
+
+    def dist(values):
+        return {f"p{int(q * 100)}": round(percentile(values, q), 1) for q in (0.5, 0.95)}
+
+    turns = max((len(session) for session in sessions), default=0)
+    sent_by_turn = [
+        round(sum(session[i]["sent"] for session in sessions if i < len(session)) / len(sessions))
+        for i in range(turns)
+    ]
+    sent = [row["sent"] for row in rows]
+    return {
+        "turns": len(rows),
+        "ok": len(ok),
+        "sent_bytes": {**dist(sent), "max": max(sent, default=0), "total": sum(sent)},
+        "sent_bytes_by_turn": sent_by_turn,
+        "ttft_ms": dist([row["ttft_ms"] for row in ok if row["ttft_ms"] is not None]),
+        "completion_ms": dist([row["completion_ms"] for row in ok]),
+        "errors": sorted({row["error"] for row in rows if row["error"]}),
+    }
+
+
+async def run_transport(transport: str, args, sessions: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    if transport == "post":
+        url = args.url.rstrip("/") + args.post_path
+        replay = post_session
+    else:
+        url = ws_url(args.url, args.ws_path)
+        replay = ws_session
+
+    async def one(turns):
+        async with semaphore:
+            return await replay(url, turns, args.timeout)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(turns) for turns in sessions))
+    return {"transport": transport, "wall_s": round(time.perf_counter() - start, 2), **summarize(list(results))}
+
+
+async def run(args) -> Dict[str, Any]:
+    sessions = synthetic_sessions(args.sessions, args.turns, args.actions, args.words)
+    reports = []
+    for transport in ("post", "ws"):
+        report = await run_transport(transport, args, sessions)
+        reports.append(report)
+        print(
+            f"{transport:>4} turns={report['turns']:<5} ok={report['ok']:<5} wall={report['wall_s']:>6}s  "
+            f"sent {report['sent_bytes']}  ttft {report['ttft_ms']}  completion {report['completion_ms']}"
+        )
+        print(f"     sent bytes by turn {report['sent_bytes_by_turn']}")
+        if report["errors"]:
+            print(f"     errors {report['errors'][:5]}")
+    post, ws = reports
+    if ws["sent_bytes"]["total"]:
+        print(f"upload reduction: {post['sent_bytes']['total'] / ws['sent_bytes']['total']:.1f}x")
+    return {"url": args.url, "sessions": args.sessions, "turns": args.turns, "transports": reports}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:3006", help="Server base URL")
+    parser.add_argument("--post-path", default="/copilotkit/", help="generateCopilotResponse endpoint")
+    parser.add_argument("--ws-path", default="/copilotkit/ws", help="WebSocket session endpoint")
+    parser.add_argument("--sessions", type=int, default=20, help="Synthetic sessions per transport")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per session")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions replayed at once")
+    parser.add_argument("--actions", type=int, default=8, help="Max frontend actions per synthetic session")
+    parser.add_argument("--words", type=int, default=40, help="Max words per synthetic user message")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-read timeout (seconds)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        raise SystemExit("Needs the websockets package: pip install websockets")
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
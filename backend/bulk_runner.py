@@ -0,0 +1,329 @@
+"""
+Bulk execution of the agent graph for offline, non-interactive workloads.
+
+Runs `agentic_chat_graph.ainvoke` (what server_manual's handle_send_message does per
+request) for every thread in a JSONL input file:
+- bounded concurrency: at most --concurrency graph runs in flight
+- upstream-aware pacing: request and token budgets per minute (--rpm, --tpm);
+  on a rate limit the request rate is halved and everything pauses for the
+  provider's Retry-After (or an exponential backoff), then the rate recovers
+  gradually while calls succeed
+- retries with backoff for rate limits, timeouts, connection and 5xx errors
+- results are appended to the output JSONL as they complete; the output file is
+  the checkpoint: a rerun skips every id already in it, so a killed job resumes
+  where it stopped (a record torn by the kill is dropped and run again)
+
+Input lines (one thread each; "id" defaults to "threadId", then the line number;
+"threadId" defaults to "bulk-<id>"):
+    {"id": "q1", "threadId": "t-1", "message": "What is LangGraph?"}
+    {"id": "q2", "messages": [{"role": "user", "content": "..."}], "tools": [...]}
+Output lines:
+    {"id": "q1", "threadId": "t-1", "status": "ok", "response": "...", "toolCalls": [],
+     "usage": {...}, "attempts": 1, "latencyMs": 812.4}
+    {"id": "q2", "threadId": "bulk-q2", "status": "error", "error": "...", "attempts": 5}
+
+Usage (from backend/):
+    python bulk_runner.py threads.jsonl answers.jsonl --concurrency 16 --rpm 500 --tpm 200000
+    python bulk_runner.py threads.jsonl answers.jsonl --retry-errors   # also redo failed ids
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from message_records import new_message
+from model_router import retry_reason
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_RPM = float(os.getenv("BULK_RPM", "0"))
+BULK_TPM = float(os.getenv("BULK_TPM", "0"))
+BULK_MAX_ATTEMPTS = int(os.getenv("BULK_MAX_ATTEMPTS", "5"))
+# Completion tokens assumed per request when budgeting tokens per minute
+BULK_OUTPUT_TOKENS = int(os.getenv("BULK_OUTPUT_TOKENS", "500"))
+
+_ROLES = {"user": "human", "human": "human", "assistant": "ai", "ai": "ai", "system": "system"}
+
+
+class Pacer:
+    """
+    Request/token budget per minute with multiplicative decrease on rate limits
+    and additive recovery on success (0 = unlimited).
+    """
+
+    def __init__(self, rpm: float = 0.0, tpm: float = 0.0):
+        self.max_rpm = rpm
+        self.rpm = rpm
+        self.tpm = tpm
+        self._tokens = tpm
+        self._next_request_at = 0.0
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + (now - self._refilled_at) * self.tpm / 60)
+        self._refilled_at = now
+
+    async def acquire(self, tokens: int):
+        # One waiter at a time, so requests are released in order and evenly spaced
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self._paused_until - now, 0.0)
+                if self.rpm:
+                    wait = max(wait, self._next_request_at - now)
+                if self.tpm and self._tokens < min(tokens, self.tpm):
+                    wait = max(wait, (min(tokens, self.tpm) - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self._next_request_at = max(now, self._next_request_at) + 60 / self.rpm
+            if self.tpm:
+                self._tokens -= tokens
+
+    def on_rate_limited(self, retry_after: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        if self.rpm:
+            self.rpm = max(self.max_rpm / 64, self.rpm / 2)
+
+    def on_success(self, tokens_used: int = 0, tokens_estimated: int = 0):
+        if self.rpm and self.rpm < self.max_rpm:
+            self.rpm = min(self.max_rpm, self.rpm + self.max_rpm / 20)
+        if self.tpm and tokens_used:
+            # Settle the estimate against the usage the provider reported
+            self._tokens = min(self.tpm, self._tokens + tokens_estimated - tokens_used)
+
+
+def read_inputs(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (id, input) for every line of the input JSONL file."""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item_id = str(item.get("id") or item.get("threadId") or line_number)
+            yield item_id, item
+
+
+def completed_ids(output_path: str, retry_errors: bool = False) -> Set[str]:
+    """Ids already in the output file (the checkpoint). A torn last line is ignored (see drop_torn_line)."""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if retry_errors and record.get("status") != "ok":
+                continue
+            done.add(str(record.get("id")))
+    return done
+
+
+def drop_torn_line(output_path: str) -> int:
+    """
+    Truncate the output file after its last newline, dropping a record torn by a
+    crash, so the next append starts on its own line. Returns the bytes dropped.
+    """
+    if not os.path.exists(output_path):
+        return 0
+    with open(output_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position < end:
+            f.truncate(position)
+        return end - position
+
+
+def _input_messages(item: Dict[str, Any]) -> List[Any]:
+    if "messages" in item:
+        return [
+            new_message(_ROLES.get(message.get("role", "user"), "human"), message.get("content", ""))
+            for message in item["messages"]
+        ]
+    return [new_message("human", item.get("message", ""))]
+
+
+def _estimate_tokens(item: Dict[str, Any]) -> int:
+    text = json.dumps(item.get("messages") or item.get("message", ""))
+    return len(text) // 4 + BULK_OUTPUT_TOKENS
+
+
+def _retry_after(error: BaseException, attempt: int) -> float:
+    """Seconds to wait before retrying: the provider's Retry-After, else exponential backoff."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name) if hasattr(headers, "get") else None
+        if value:
+            try:
+                return float(value) / (1000 if name.endswith("ms") else 1)
+            except ValueError:
+                pass
+    return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def run_item(graph: Any, item_id: str, item: Dict[str, Any], pacer: Pacer, max_attempts: int = BULK_MAX_ATTEMPTS) -> Dict[str, Any]:
+    """Run the graph for one input, with pacing and retries; returns the output record."""
+    thread_id = item.get("threadId") or f"bulk-{item_id}"
+    config = {"configurable": {"thread_id": thread_id}}
+    state = {"messages": _input_messages(item), "tools": item.get("tools", [])}
+    estimated = _estimate_tokens(item)
+
+    start = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+        await pacer.acquire(estimated)
+        try:
+            result = await graph.ainvoke(state, config)
+        except Exception as e:
+            reason = retry_reason(e)
+            if reason is None or attempt == max_attempts:
+                return {
+                    "id": item_id, "threadId": thread_id, "status": "error",
+                    "error": f"{type(e).__name__}: {e}", "attempts": attempt,
+                }
+            delay = _retry_after(e, attempt)
+            if reason == "rate_limited":
+                pacer.on_rate_limited(delay)
+            print(f"[{item_id}] {reason} (attempt {attempt}/{max_attempts}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        response = result["messages"][-1]
+        usage = dict(getattr(response, "usage_metadata", None) or {})
+        pacer.on_success(int(usage.get("total_tokens", 0) or 0), estimated)
+        return {
+            "id": item_id,
+            "threadId": thread_id,
+            "status": "ok",
+            "response": response.content,
+            "toolCalls": [
+                {"name": call["name"], "args": call["args"]} for call in getattr(response, "tool_calls", None) or []
+            ],
+            "usage": usage,
+            "attempts": attempt,
+            "latencyMs": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+
+async def run_bulk(
+    input_path: str,
+    output_path: str,
+    concurrency: int = BULK_CONCURRENCY,
+    rpm: float = BULK_RPM,
+    tpm: float = BULK_TPM,
+    max_attempts: int = BULK_MAX_ATTEMPTS,
+    retry_errors: bool = False,
+    progress_every_s: float = 10.0,
+    graph: Any = None,
+) -> Dict[str, Any]:
+    """
+    Run every input not yet in `output_path` and append the results to it.
+    Returns {"skipped", "ok", "errors", "elapsedS"}.
+    """
+    if graph is None:
+        from agent import get_agentic_chat_graph
+        from checkpointer import open_checkpointer
+
+        # Thread state goes to Postgres with CHECKPOINTER=postgres
+        await open_checkpointer()
+        graph = get_agentic_chat_graph()
+
+    done = completed_ids(output_path, retry_errors)
+    torn = drop_torn_line(output_path)
+    if torn:
+        print(f"Dropped a torn {torn}-byte record at the end of {output_path}")
+    pacer = Pacer(rpm, tpm)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"skipped": 0, "ok": 0, "errors": 0}
+    start = time.monotonic()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        async def worker():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                record = await run_item(graph, *entry, pacer, max_attempts)
+                counts["ok" if record["status"] == "ok" else "errors"] += 1
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_every_s)
+                finished = counts["ok"] + counts["errors"]
+                elapsed = time.monotonic() - start
+                print(
+                    f"Bulk: {finished} done ({counts['errors']} errors), {counts['skipped']} skipped, "
+                    f"{finished / elapsed * 60:.0f}/min, pacing {pacer.rpm or 'unlimited'} rpm"
+                )
+
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        reporter = asyncio.create_task(report())
+        try:
+            for item_id, item in read_inputs(input_path):
+                if item_id in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(item_id)
+                await queue.put((item_id, item))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for task in workers:
+                task.cancel()
+            out.flush()
+            os.fsync(out.fileno())
+
+    summary = {**counts, "elapsedS": round(time.monotonic() - start, 1)}
+    print(f"Bulk run finished: {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of thread inputs")
+    parser.add_argument("output", help="JSONL file of results (appended to, and used to resume)")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=BULK_RPM, help="requests per minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=BULK_TPM, help="tokens per minute (0 = unlimited)")
+    parser.add_argument("--max-attempts", type=int, default=BULK_MAX_ATTEMPTS)
+    parser.add_argument("--retry-errors", action="store_true", help="rerun ids whose previous result was an error")
+    args = parser.parse_args(argv)
+
+    from agent import load_env
+
+    load_env()
+    asyncio.run(run_bulk(
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_attempts=args.max_attempts,
+        retry_errors=args.retry_errors,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Redis read-through cache of the latest checkpoint per thread.
+
+Every turn reads the thread's latest checkpoint at least twice (the delta-sync
+check in the servers, then the graph run itself), and with a durable checkpointer
+each read is a database round trip plus blob decoding. `add_checkpoint_cache`
+wraps any checkpointer instance, the same way tracing.instrument_checkpointer does:
+- latest-checkpoint reads (no checkpoint_id in the config) are served from Redis,
+  filled from the checkpointer on a miss
+- every write (aput, aput_writes, adelete_thread) bumps the thread's generation
+  counter, which invalidates its entries for all workers sharing the Redis; a
+  fill racing with a write lands under the old generation and is never read
+- reads of a specific checkpoint_id always go to the checkpointer
+
+Enabled when REDIS_URI is set (see redis_client.py) and CHECKPOINT_CACHE is not
+"off". Entries expire after CHECKPOINT_CACHE_TTL_S (default 3600).
+"""
+
+import os
+from typing import Any
+
+import metrics
+from redis_client import get_redis
+
+CHECKPOINT_CACHE = os.getenv("CHECKPOINT_CACHE", "on").lower()
+CHECKPOINT_CACHE_TTL_S = float(os.getenv("CHECKPOINT_CACHE_TTL_S", "3600"))
+
+cache_requests = metrics.counter(
+    "checkpoint_cache_requests_total", "Latest-checkpoint reads by cache result (hit, miss, error)"
+)
+
+
+def _generation_key(thread_id: Any) -> str:
+    return f"ckpt:gen:{thread_id}"
+
+
+def add_checkpoint_cache(checkpointer, redis=None):
+    """
+    Put a Redis read-through cache in front of `checkpointer` (in place; returns it).
+    No-op without Redis or with CHECKPOINT_CACHE=off.
+    """
+    redis = redis if redis is not None else get_redis()
+    if checkpointer is None or redis is None or CHECKPOINT_CACHE == "off":
+        return checkpointer
+    if getattr(checkpointer, "_cached", False):
+        return checkpointer
+
+    from langgraph.checkpoint.base import CheckpointTuple
+
+    serde = checkpointer.serde
+    aget_tuple = checkpointer.aget_tuple
+    aput = checkpointer.aput
+    aput_writes = checkpointer.aput_writes
+    adelete_thread = getattr(checkpointer, "adelete_thread", None)
+
+    def dumps(checkpoint_tuple) -> bytes:
+        type_, data = serde.dumps_typed(list(checkpoint_tuple))
+        return type_.encode("utf-8") + b"\0" + data
+
+    def loads(raw: bytes):
+        type_, _, data = raw.partition(b"\0")
+        return CheckpointTuple(*serde.loads_typed((type_.decode("utf-8"), data)))
+
+    async def invalidate(thread_id):
+        key = _generation_key(thread_id)
+        try:
+            await redis.incr(key)
+            # Outlives every entry of the generation it guards
+            await redis.expire(key, int(CHECKPOINT_CACHE_TTL_S * 2))
+        except Exception as e:
+            print(f"Checkpoint cache invalidation failed: {e}")
+
+    async def cached_aget_tuple(config):
+        configurable = (config or {}).get("configurable", {})
+        thread_id = configurable.get("thread_id")
+        if thread_id is None or configurable.get("checkpoint_id"):
+            return await aget_tuple(config)
+        try:
+            generation = int(await redis.get(_generation_key(thread_id)) or 0)
+            key = f"ckpt:latest:{thread_id}:{configurable.get('checkpoint_ns', '')}:{generation}"
+            raw = await redis.get(key)
+        except Exception as e:
+            # Redis down: fall back to the checkpointer
+            cache_requests.inc(labels={"result": "error"})
+            print(f"Checkpoint cache read failed: {e}")
+            return await aget_tuple(config)
+        if raw is not None:
+            cache_requests.inc(labels={"result": "hit"})
+            return loads(raw)
+
+        cache_requests.inc(labels={"result": "miss"})
+        checkpoint_tuple = await aget_tuple(config)
+        if checkpoint_tuple is not None:
+            try:
+                await redis.set(key, dumps(checkpoint_tuple), ex=CHECKPOINT_CACHE_TTL_S)
+            except Exception as e:
+                print(f"Checkpoint cache fill failed: {e}")
+        return checkpoint_tuple
+
+    async def invalidating_aput(config, *args, **kwargs):
+        result = await aput(config, *args, **kwargs)
+        await invalidate(config["configurable"]["thread_id"])
+        return result
+
+    async def invalidating_aput_writes(config, *args, **kwargs):
+        result = await aput_writes(config, *args, **kwargs)
+        await invalidate(config["configurable"]["thread_id"])
+        return result
+
+    checkpointer.aget_tuple = cached_aget_tuple
+    checkpointer.aput = invalidating_aput
+    checkpointer.aput_writes = invalidating_aput_writes
+
+    if adelete_thread is not None:
+        async def invalidating_adelete_thread(thread_id, *args, **kwargs):
+            result = await adelete_thread(thread_id, *args, **kwargs)
+            await invalidate(thread_id)
+            return result
+
+        checkpointer.adelete_thread = invalidating_adelete_thread
+
+    checkpointer._cached = True
+    return checkpointer
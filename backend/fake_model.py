@@ -0,0 +1,167 @@
+"""
+Fake streaming chat model for load tests and offline runs.
+
+Selected with AGENT_MODEL_BACKEND=fake. It needs no API key and streams a
+deterministic reply with configurable latency, so server-side overhead can be
+measured without paying for (or waiting on) OpenAI:
+- FAKE_MODEL_TTFT_MS: delay before the first token (default 300)
+- FAKE_MODEL_TOKEN_DELAY_MS: delay between tokens (default 15)
+- FAKE_MODEL_REPLY_WORDS: length of the reply in words (default 60)
+- FAKE_MODEL_PROFILES: per-model "ttft_ms:token_delay_ms" overrides, e.g.
+  "gpt-4o-mini=150:6,gpt-4o=400:18" (default "gpt-4o-mini=150:6"), so routed
+  fast/strong models have different latencies
+- FAKE_MODEL_RATE_LIMIT: per-model probability of failing with a 429, e.g.
+  "gpt-4o=0.2" (default none), to exercise model fallbacks
+- FAKE_MODEL_TOOL_CALLS: "on" to answer a turn that has bound tools with a call
+  to the first tool instead of text, and the tool result with text (default
+  "off"), to exercise frontend tool round-trips
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORDS = (
+    "Sure here is a short answer that the fake model streams one token at a time so "
+    "the runtime can be measured without calling the real model provider"
+).split()
+
+
+def _parse_model_map(value: str) -> Dict[str, str]:
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {name.strip(): setting.strip() for name, setting in pairs}
+
+
+def fake_model_settings(model: str) -> Dict[str, Any]:
+    """FakeStreamingChatModel keyword arguments for `model` from the profile settings."""
+    settings: Dict[str, Any] = {"model": model}
+    profile = _parse_model_map(os.getenv("FAKE_MODEL_PROFILES", "gpt-4o-mini=150:6")).get(model)
+    if profile:
+        ttft_ms, _, token_delay_ms = profile.partition(":")
+        settings["ttft_ms"] = float(ttft_ms)
+        if token_delay_ms:
+            settings["token_delay_ms"] = float(token_delay_ms)
+    rate_limit = _parse_model_map(os.getenv("FAKE_MODEL_RATE_LIMIT", "")).get(model)
+    if rate_limit:
+        settings["rate_limit_rate"] = float(rate_limit)
+    return settings
+
+
+class FakeRateLimitError(Exception):
+    """Simulated provider rate limit (HTTP 429)."""
+
+    status_code = 429
+
+
+def _tool_name(tool: Any) -> Optional[str]:
+    if isinstance(tool, dict):
+        return tool.get("function", tool).get("name")
+    return getattr(tool, "name", None)
+
+
+def _approx_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4 + 1
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Deterministic chat model that streams a canned reply with simulated latency."""
+
+    ttft_ms: float = float(os.getenv("FAKE_MODEL_TTFT_MS", "300"))
+    token_delay_ms: float = float(os.getenv("FAKE_MODEL_TOKEN_DELAY_MS", "15"))
+    reply_words: int = int(os.getenv("FAKE_MODEL_REPLY_WORDS", "60"))
+    rate_limit_rate: float = 0.0
+    call_tools: bool = os.getenv("FAKE_MODEL_TOOL_CALLS", "off").lower() in ("1", "true", "on")
+    model: str = "fake-streaming"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        # Tools are accepted (so chat_node works unchanged); called only with FAKE_MODEL_TOOL_CALLS=on
+        return self.bind(tools=tools, **kwargs)
+
+    def _tool_call(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The call to the first bound tool this turn makes, if any (never right after a tool result)."""
+        tools = kwargs.get("tools") or []
+        if not self.call_tools or not tools or (messages and isinstance(messages[-1], ToolMessage)):
+            return None
+        name = _tool_name(tools[0])
+        return {"name": name, "args": {}, "id": f"call_{uuid.uuid4().hex[:24]}"} if name else None
+
+    def _tokens(self) -> List[str]:
+        words = [_WORDS[i % len(_WORDS)] for i in range(self.reply_words)]
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    @staticmethod
+    def _tool_call_chunk(call: Dict[str, Any]) -> AIMessageChunk:
+        return AIMessageChunk(content="", tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+        ])
+
+    def _check_rate_limit(self):
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            raise FakeRateLimitError(f"Simulated rate limit for {self.model}")
+
+    def _usage(self, messages: List[BaseMessage]):
+        input_tokens = _approx_tokens(messages)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": self.reply_words,
+            "total_tokens": input_tokens + self.reply_words,
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._check_rate_limit()
+        call = self._tool_call(messages, kwargs)
+        time.sleep((self.ttft_ms + self.token_delay_ms * self.reply_words) / 1000)
+        message = AIMessage(
+            content="" if call else "".join(self._tokens()),
+            tool_calls=[call] if call else [],
+            usage_metadata=self._usage(messages),
+            response_metadata={"model_name": self.model},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.ttft_ms / 1000)
+        self._check_rate_limit()
+        call = self._tool_call(messages, kwargs)
+        if call:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(call))
+        for i, token in enumerate([] if call else self._tokens()):
+            if i:
+                time.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            usage_metadata=self._usage(messages),
+            response_metadata={"model_name": self.model},
+        ))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.ttft_ms / 1000)
+        self._check_rate_limit()
+        call = self._tool_call(messages, kwargs)
+        if call:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(call))
+        for i, token in enumerate([] if call else self._tokens()):
+            if i:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            usage_metadata=self._usage(messages),
+            response_metadata={"model_name": self.model},
+        ))
@@ -0,0 +1,274 @@
+"""
+Hot runs across frontend tool round-trips (TOOL_RESUME=interrupt).
+
+By default chat_node ends the run when the model calls a frontend tool; the
+frontend executes it and sends the result in a new generateCopilotResponse that
+starts a new run: the server converts the request's messages, the graph reloads
+(and decodes) the thread's checkpoint and routes the turn again. With
+TOOL_RESUME=interrupt:
+- chat_node hands tool-calling responses to `tool_wait_node`, which pauses the run
+  with a LangGraph `interrupt` carrying the pending tool calls
+- the paused run is held hot: the thread's interrupted checkpoint, already
+  decoded, stays in memory for HOT_RUN_TTL_S seconds (at most HOT_RUN_MAX runs,
+  least recently paused evicted first; expired runs are dropped on the next
+  pause or lookup)
+- server_ndjson and server_graphql stream the tool calls as
+  ActionExecutionMessageOutputs (stream_frames.action_execution_payload) whose id
+  is the tool-call id, and WebSocket sessions as `tool_call` events with a toolCallId
+- when the results arrive (`resultMessage`s with that id as actionExecutionId in
+  the next generateCopilotResponse, or `tool_result` on a WebSocket session) those
+  servers resume the paused run with
+  Command(resume={"toolResults": {toolCallId: result}}) instead of converting the
+  request's messages as a new turn; while the run is hot the graph's checkpoint
+  load is served from memory. tool_wait_node appends the tool messages and goes
+  straight back to chat_node, with the model route of the paused run.
+- after eviction (timeout, capacity, or any other write to the thread) the result
+  still resumes the run, from the checkpointer
+
+Metrics: `hot_runs_held`, `hot_runs_total{event}` (paused, resumed_hot, resumed_cold,
+expired, evicted, invalidated), `hot_run_resume_seconds{source}` (from the resume
+request to the paused node running again) and `hot_run_pause_seconds` (the time the
+frontend took to return the result).
+
+Settings:
+- TOOL_RESUME: "end" (default) or "interrupt"
+- HOT_RUN_TTL_S (default 120), HOT_RUN_MAX (default 1000)
+
+LangGraph Studio, the CopilotKit SDK server and server_manual do not resume paused
+runs with the tool results, so keep the default for them. End-to-end check:
+`python benchmarks/tool_resume.py` (see its docstring).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Sequence
+
+import metrics
+
+TOOL_RESUME = os.getenv("TOOL_RESUME", "end").lower()
+HOT_RUN_TTL_S = float(os.getenv("HOT_RUN_TTL_S", "120"))
+HOT_RUN_MAX = int(os.getenv("HOT_RUN_MAX", "1000"))
+
+# The node paused at frontend tool calls, and the key of its interrupt payload
+TOOL_WAIT_NODE = "tool_wait_node"
+_TOOL_CALLS = "toolCalls"
+
+runs_held = metrics.gauge("hot_runs_held", "Paused runs held hot in memory")
+run_events = metrics.counter(
+    "hot_runs_total", "Paused-run events (paused, resumed_hot, resumed_cold, expired, evicted, invalidated)"
+)
+resume_seconds = metrics.histogram(
+    "hot_run_resume_seconds", "Time from a tool result's resume request to the paused node running again, by source",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+pause_seconds = metrics.histogram(
+    "hot_run_pause_seconds", "Time runs stayed paused waiting for frontend tool results",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class HotRun:
+    """A run paused at frontend tool calls: the calls it waits for and its decoded checkpoint."""
+
+    __slots__ = ("thread_id", "tool_call_ids", "checkpoint", "paused_at", "expires_at")
+
+    def __init__(self, thread_id: str, tool_call_ids: FrozenSet[str], checkpoint: Any, ttl_s: float):
+        self.thread_id = thread_id
+        self.tool_call_ids = tool_call_ids
+        self.checkpoint = checkpoint
+        self.paused_at = time.monotonic()
+        self.expires_at = self.paused_at + ttl_s
+
+
+class HotRunStore:
+    """Paused runs by thread, evicted after `ttl_s` or beyond `max_runs` (oldest first)."""
+
+    def __init__(self, ttl_s: float = HOT_RUN_TTL_S, max_runs: int = HOT_RUN_MAX):
+        self.ttl_s = ttl_s
+        self.max_runs = max_runs
+        self._runs: "OrderedDict[str, HotRun]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._runs
+
+    def hold(self, thread_id: str, tool_call_ids: FrozenSet[str], checkpoint: Any):
+        with self._lock:
+            self._runs.pop(thread_id, None)
+            self._runs[thread_id] = HotRun(thread_id, tool_call_ids, checkpoint, self.ttl_s)
+            evicted = 0
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+                evicted += 1
+        run_events.inc(labels={"event": "paused"})
+        if evicted:
+            run_events.inc(evicted, labels={"event": "evicted"})
+        self.sweep()
+
+    def get(self, thread_id: str) -> Optional[HotRun]:
+        run = self._runs.get(thread_id)
+        if run is not None and run.expires_at <= time.monotonic():
+            self.release(thread_id, "expired")
+            return None
+        return run
+
+    def release(self, thread_id: str, event: Optional[str] = None) -> Optional[HotRun]:
+        with self._lock:
+            run = self._runs.pop(thread_id, None)
+        if run is not None and event:
+            run_events.inc(labels={"event": event})
+        runs_held.set(len(self._runs))
+        return run
+
+    def sweep(self) -> int:
+        """Drop the expired runs; returns how many."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [thread_id for thread_id, run in self._runs.items() if run.expires_at <= now]
+            for thread_id in expired:
+                del self._runs[thread_id]
+        if expired:
+            run_events.inc(len(expired), labels={"event": "expired"})
+        runs_held.set(len(self._runs))
+        return len(expired)
+
+
+hot_runs = HotRunStore()
+# Resume requests whose paused node has not run yet: thread -> (start, source, paused_at)
+_resuming: Dict[str, tuple] = {}
+
+
+def tool_results(items: Sequence[Any]) -> Dict[str, str]:
+    """{toolCallId: result} of CopilotKit `resultMessage`s and {"role": "tool", "toolCallId"} dicts."""
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if "resultMessage" in item:
+            call_id, result = item["resultMessage"].get("actionExecutionId"), item["resultMessage"].get("result")
+        elif item.get("role") == "tool":
+            call_id, result = item.get("toolCallId"), item.get("content")
+        else:
+            continue
+        if call_id:
+            results[call_id] = result if isinstance(result, str) else json.dumps(result)
+    return results
+
+
+def _pending_tool_calls(interrupts: Sequence[Any]) -> Optional[Sequence[Dict[str, Any]]]:
+    for interrupt in interrupts or ():
+        value = getattr(interrupt, "value", None)
+        if isinstance(value, dict) and _TOOL_CALLS in value:
+            return value[_TOOL_CALLS]
+    return None
+
+
+async def resume_command(graph: Any, thread_id: str, items: Sequence[Any]) -> Optional[Any]:
+    """
+    Command(resume=...) when the request's messages `items` carry, since the last
+    assistant reply, results for the tool calls `thread_id` is paused at; None
+    otherwise, and always with TOOL_RESUME=end.
+    """
+    if TOOL_RESUME != "interrupt":
+        return None
+    from langgraph.types import Command
+
+    from request_body import messages_since_last_assistant
+
+    results = tool_results(messages_since_last_assistant(items))
+    if not results:
+        return None
+    run = hot_runs.get(thread_id)
+    if run is not None and run.tool_call_ids & results.keys():
+        source, paused_at = "hot", run.paused_at
+    else:
+        # Not hot (evicted, or paused on another worker): ask the checkpointer
+        state = await graph.aget_state({"configurable": {"thread_id": thread_id}})
+        pending = [
+            call for task in state.tasks for call in (_pending_tool_calls(task.interrupts) or ())
+        ]
+        if not any(call.get("id") in results for call in pending):
+            return None
+        source, paused_at = "cold", None
+    _resuming[thread_id] = (time.perf_counter(), source, paused_at)
+    return Command(resume={"toolResults": results})
+
+
+async def hold_paused_run(graph: Any, thread_id: str, event: Any) -> bool:
+    """
+    Once a run has finished, keep it hot if its last step `event` paused it at
+    frontend tool calls (an `__interrupt__` update from tool_wait_node). Called after
+    the stream ends, so the interrupted checkpoint has been written. Returns whether
+    the run is held.
+    """
+    if TOOL_RESUME != "interrupt" or not isinstance(event, dict):
+        return False
+    calls = _pending_tool_calls(event.get("__interrupt__"))
+    if not calls:
+        return False
+    _resuming.pop(thread_id, None)
+    checkpoint = await graph.checkpointer.aget_tuple({"configurable": {"thread_id": thread_id}})
+    hot_runs.hold(thread_id, frozenset(call.get("id") for call in calls), checkpoint)
+    return True
+
+
+def observe_resumed(thread_id: Optional[str]):
+    """Called by the paused node once it runs again: records the resume latency."""
+    resuming = _resuming.pop(thread_id, None)
+    if resuming is None:
+        return
+    start, source, paused_at = resuming
+    resume_seconds.observe(time.perf_counter() - start, labels={"source": source})
+    run_events.inc(labels={"event": f"resumed_{source}"})
+    if paused_at is not None:
+        pause_seconds.observe(time.monotonic() - paused_at)
+
+
+def add_hot_checkpoints(checkpointer):
+    """
+    Serve the latest-checkpoint reads of hot threads from the held, decoded
+    checkpoint (in place; returns it). Any write to a thread releases its hot run.
+    No-op with TOOL_RESUME=end.
+    """
+    if checkpointer is None or TOOL_RESUME != "interrupt" or getattr(checkpointer, "_hot", False):
+        return checkpointer
+
+    aget_tuple = checkpointer.aget_tuple
+    aput = checkpointer.aput
+    aput_writes = checkpointer.aput_writes
+
+    async def hot_aget_tuple(config):
+        configurable = (config or {}).get("configurable", {})
+        thread_id = configurable.get("thread_id")
+        if thread_id is not None and not configurable.get("checkpoint_id") and not configurable.get("checkpoint_ns"):
+            run = hot_runs.get(thread_id)
+            if run is not None and run.checkpoint is not None:
+                return run.checkpoint
+        return await aget_tuple(config)
+
+    def release(config):
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id not in hot_runs:
+            return
+        # Writes of the resumed run are expected; anything else supersedes the paused run
+        hot_runs.release(thread_id, None if thread_id in _resuming else "invalidated")
+
+    async def releasing_aput(config, *args, **kwargs):
+        release(config)
+        return await aput(config, *args, **kwargs)
+
+    async def releasing_aput_writes(config, *args, **kwargs):
+        release(config)
+        return await aput_writes(config, *args, **kwargs)
+
+    checkpointer.aget_tuple = hot_aget_tuple
+    checkpointer.aput = releasing_aput
+    checkpointer.aput_writes = releasing_aput_writes
+    checkpointer._hot = True
+    return checkpointer
@@ -0,0 +1,33 @@
+"""
+Append JSON lines to a file from a background thread.
+Used for trace export and request recording so the event loop never does file I/O.
+"""
+
+import json
+import queue
+import threading
+from typing import Any, Dict
+
+
+class BackgroundJsonlWriter:
+    """Queue records and append them to `path` as JSON lines from a daemon thread."""
+
+    def __init__(self, path: str, max_queue: int = 1000):
+        self.path = path
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._run, name=f"jsonl-writer:{path}", daemon=True).start()
+
+    def submit(self, record: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            pass  # Drop records rather than block requests
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Writing to {self.path} failed: {e}")
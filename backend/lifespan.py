@@ -0,0 +1,56 @@
+"""
+Startup and shutdown hooks of the FastAPI servers, run by one lifespan handler.
+
+Starlette 1.x removed `app.add_event_handler` and `@app.on_event`, so every
+server is built with `FastAPI(..., lifespan=lifespan)` and hooks are registered
+with `on_startup(app, hook)` / `on_shutdown(app, hook)`, by the servers and by the
+`add_*(app)` helpers (watchdog, memory stats, run scheduler, ...). Hooks may be
+plain functions or coroutine functions:
+- startup hooks run in registration order before the app serves requests
+- shutdown hooks run in reverse registration order; one failing does not stop
+  the others
+"""
+
+import inspect
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List
+
+
+def _hooks(app, phase: str) -> List[Callable[[], Any]]:
+    name = f"{phase}_hooks"
+    hooks = getattr(app.state, name, None)
+    if hooks is None:
+        hooks = []
+        setattr(app.state, name, hooks)
+    return hooks
+
+
+def on_startup(app, hook: Callable[[], Any]):
+    """Run `hook` when `app` starts."""
+    _hooks(app, "startup").append(hook)
+
+
+def on_shutdown(app, hook: Callable[[], Any]):
+    """Run `hook` when `app` shuts down."""
+    _hooks(app, "shutdown").append(hook)
+
+
+async def _call(hook: Callable[[], Any]):
+    result = hook()
+    if inspect.isawaitable(result):
+        await result
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Lifespan handler running the hooks registered with on_startup / on_shutdown."""
+    for hook in _hooks(app, "startup"):
+        await _call(hook)
+    try:
+        yield
+    finally:
+        for hook in reversed(_hooks(app, "shutdown")):
+            try:
+                await _call(hook)
+            except Exception as e:
+                print(f"Shutdown hook {getattr(hook, '__name__', hook)} failed: {e}")
@@ -0,0 +1,358 @@
+"""
+Memory introspection for a worker: which conversation threads and which
+structures hold memory.
+
+- per thread: bytes of the thread's state held by the in-process checkpointer
+  (MemorySaver): checkpoints, channel values (one per state field: `messages`,
+  `tools`, ...) and pending writes, split by state field. Checkpointers that keep
+  state out of process (Postgres) report no threads.
+- per structure: deep size of the process-wide caches (tool schemas, tool selection
+  indexes, tool snapshots sent to clients, the in-process stream buffer)
+- heap diffs: tracemalloc snapshots, compared between two points in time
+
+Sizes are estimates: the serialized bytes the checkpointer holds (plus object
+headers), and sys.getsizeof summed over the objects a structure references.
+
+Admin endpoints (admin token, see admin.py):
+- GET /debug/memory?top=10: RSS, thread size distribution (p50/p95/max), per-field
+  totals, the `top` heaviest threads, structure sizes
+- POST /debug/memory/snapshot?frames=5: start tracemalloc (if needed) and take the
+  baseline snapshot
+- GET /debug/memory/diff?top=20&group_by=lineno&reset=false: allocations grown since
+  the baseline (group_by: lineno, filename or traceback); reset=true makes the new
+  snapshot the baseline
+- DELETE /debug/memory/snapshot: stop tracemalloc (it slows allocations while on)
+
+The memory_* gauges are refreshed every MEMORY_STATS_INTERVAL_S.
+
+Settings:
+- MEMORY_STATS_INTERVAL_S: metrics refresh interval (default 60, 0 = only on request)
+- MEMORY_TOP_THREADS: default number of threads listed (default 10)
+- MEMORY_TRACEMALLOC_FRAMES: default frames stored per allocation (default 5)
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import metrics
+from lifespan import on_shutdown, on_startup
+
+MEMORY_STATS_INTERVAL_S = float(os.getenv("MEMORY_STATS_INTERVAL_S", "60"))
+MEMORY_TOP_THREADS = int(os.getenv("MEMORY_TOP_THREADS", "10"))
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "5"))
+
+# Objects visited at most by deep_size
+_MAX_OBJECTS = 1_000_000
+# Not walked by deep_size: code, and objects referencing the loop, threads or sockets
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType)
+_OPAQUE_MODULES = frozenset({"asyncio", "threading", "concurrent", "_thread", "socket", "ssl"})
+# Bytes of a checkpoint itself (metadata, versions) rather than of a state field
+_CHECKPOINT_FIELD = "__checkpoint__"
+
+rss_bytes = metrics.gauge("memory_rss_bytes", "Resident set size of the process")
+checkpoint_threads = metrics.gauge("memory_checkpoint_threads", "Threads held by the in-process checkpointer")
+checkpoint_bytes = metrics.gauge("memory_checkpoint_bytes", "Bytes of thread state held by the in-process checkpointer, by state field")
+thread_bytes = metrics.gauge("memory_thread_bytes", "Bytes of state per thread, by statistic (p50, p95, max)")
+structure_bytes = metrics.gauge("memory_structure_bytes", "Deep size of process-wide caches, by structure")
+traced_bytes = metrics.gauge("memory_traced_bytes", "Bytes allocated and traced by tracemalloc (0 when not tracing)")
+
+
+def rss_mb() -> Optional[float]:
+    """Resident set size in MiB (Linux), None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _payload_bytes(value: Any, depth: int = 0) -> int:
+    """Size of a stored entry: its bytes/str payloads and the tuples holding them."""
+    if isinstance(value, tuple) and depth < 4:
+        return sys.getsizeof(value) + sum(_payload_bytes(item, depth + 1) for item in value)
+    return sys.getsizeof(value)
+
+
+def deep_size(obj: Any, max_objects: int = _MAX_OBJECTS) -> int:
+    """sys.getsizeof summed over `obj` and the objects it references (each counted once)."""
+    seen = set()
+    pending = [obj]
+    total = 0
+    while pending and len(seen) < max_objects:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _OPAQUE_TYPES) or type(item).__module__.partition(".")[0] in _OPAQUE_MODULES:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            pending.extend(item)
+        elif not isinstance(item, (str, bytes, bytearray, int, float)):
+            attributes = getattr(item, "__dict__", None)
+            if isinstance(attributes, dict):
+                pending.append(attributes)
+            for slot in getattr(type(item), "__slots__", ()):
+                if isinstance(slot, str) and hasattr(item, slot):
+                    pending.append(getattr(item, slot))
+    return total
+
+
+def _shared_saver() -> Any:
+    from agent import shared_checkpointer
+
+    return shared_checkpointer()
+
+
+def thread_memory(checkpointer: Any = None) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Per thread id: {"bytes", "checkpoints", "writes", "fields": {state field: bytes}}
+    of an in-process checkpointer (MemorySaver); None when state is kept elsewhere.
+    Safe to call from a worker thread: each level is copied before it is walked.
+    """
+    saver = checkpointer if checkpointer is not None else _shared_saver()
+    storage = getattr(saver, "storage", None)
+    if not isinstance(storage, dict):
+        return None
+    threads: Dict[str, Dict[str, Any]] = {}
+
+    def account(thread_id: Any, field: str, size: int) -> Dict[str, Any]:
+        thread = threads.get(thread_id)
+        if thread is None:
+            thread = threads[thread_id] = {"bytes": 0, "checkpoints": 0, "writes": 0, "fields": {}}
+        thread["bytes"] += size
+        thread["fields"][field] = thread["fields"].get(field, 0) + size
+        return thread
+
+    for thread_id, namespaces in list(storage.items()):
+        for checkpoints in list(namespaces.values()):
+            for saved in list(checkpoints.values()):
+                account(thread_id, _CHECKPOINT_FIELD, _payload_bytes(saved))["checkpoints"] += 1
+    # (thread_id, checkpoint_ns, channel, version) -> serialized channel value
+    for key, value in list((getattr(saver, "blobs", None) or {}).items()):
+        account(key[0], str(key[2]), _payload_bytes(value))
+    # (thread_id, checkpoint_ns, checkpoint_id) -> {(task_id, index): (task_id, channel, value, ...)}
+    for key, task_writes in list((getattr(saver, "writes", None) or {}).items()):
+        for write in list(task_writes.values()):
+            channel = write[1] if isinstance(write, tuple) and len(write) > 2 and isinstance(write[1], str) else "__writes__"
+            account(key[0], channel, _payload_bytes(write))["writes"] += 1
+    return threads
+
+
+def structure_sizes() -> Dict[str, int]:
+    """Deep size of the process-wide caches of the modules loaded in this process."""
+    roots = {
+        "toolSchemas": ("prompt_layout", "_tool_cache"),
+        "toolIndexes": ("tool_selection", "_indexes"),
+        "streamBuffer": ("stream_buffer", "_store"),
+    }
+    sizes = {}
+    for name, (module_name, attribute) in roots.items():
+        module = sys.modules.get(module_name)
+        value = getattr(module, attribute, None) if module is not None else None
+        # The Redis stream store holds nothing in process
+        if value is not None and not hasattr(value, "redis"):
+            sizes[name] = deep_size(list(value.items()) if isinstance(value, dict) else value)
+    return sizes
+
+
+def _percentile(ordered: List[int], fraction: float) -> int:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+def memory_report(top: int = MEMORY_TOP_THREADS, checkpointer: Any = None) -> Dict[str, Any]:
+    """The /debug/memory body; also refreshes the memory_* gauges. Blocking: run it off the loop."""
+    rss = rss_mb()
+    if rss is not None:
+        rss_bytes.set(round(rss * 1024 * 1024))
+    report: Dict[str, Any] = {"rssMb": round(rss, 1) if rss is not None else None}
+
+    saver = checkpointer if checkpointer is not None else _shared_saver()
+    report["checkpointer"] = type(saver).__name__
+    threads = thread_memory(saver)
+    if threads is None:
+        report["threads"] = None
+    else:
+        sizes = sorted(thread["bytes"] for thread in threads.values())
+        fields: Dict[str, int] = {}
+        for thread in threads.values():
+            for field, size in thread["fields"].items():
+                fields[field] = fields.get(field, 0) + size
+        distribution = {"p50": _percentile(sizes, 0.5), "p95": _percentile(sizes, 0.95), "max": sizes[-1] if sizes else 0}
+        checkpoint_threads.set(len(threads))
+        for field, size in fields.items():
+            checkpoint_bytes.set(size, labels={"field": field})
+        for stat, size in distribution.items():
+            thread_bytes.set(size, labels={"stat": stat})
+        heaviest = sorted(threads.items(), key=lambda item: -item[1]["bytes"])[:max(top, 0)]
+        report["threads"] = {
+            "count": len(threads),
+            "bytes": sum(sizes),
+            "perThread": distribution,
+            "fields": dict(sorted(fields.items(), key=lambda item: -item[1])),
+            "top": [{"threadId": thread_id, **thread} for thread_id, thread in heaviest],
+        }
+
+    structures = structure_sizes()
+    for name, size in structures.items():
+        structure_bytes.set(size, labels={"structure": name})
+    report["structures"] = structures
+    report["tracemalloc"] = heap.stats()
+    return report
+
+
+class HeapSnapshots:
+    """tracemalloc baseline snapshot and diffs against it."""
+
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_time = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def start(self, frames: int = MEMORY_TRACEMALLOC_FRAMES) -> Dict[str, Any]:
+        """Start tracing (allocations made before are not traced) and take the baseline."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(frames, 1))
+            self.baseline = self._take()
+            self.baseline_time = time.time()
+        return self.stats()
+
+    def stop(self) -> Dict[str, Any]:
+        with self._lock:
+            tracemalloc.stop()
+            self.baseline = None
+        return self.stats()
+
+    def diff(self, top: int = 20, group_by: str = "lineno", reset: bool = False) -> Dict[str, Any]:
+        """The `top` allocation sites by growth since the baseline."""
+        with self._lock:
+            if self.baseline is None or not tracemalloc.is_tracing():
+                raise RuntimeError("No baseline snapshot: POST /debug/memory/snapshot first")
+            current = self._take()
+            changes = current.compare_to(self.baseline, group_by)
+            since = self.baseline_time
+            if reset:
+                self.baseline, self.baseline_time = current, time.time()
+        return {
+            "sinceS": round(time.time() - since, 1),
+            "groupBy": group_by,
+            "sizeDiff": sum(change.size_diff for change in changes),
+            "top": [
+                {
+                    "location": [f"{frame.filename}:{frame.lineno}" for frame in change.traceback]
+                    if group_by == "traceback" else f"{change.traceback[0].filename}:{change.traceback[0].lineno}",
+                    "sizeDiff": change.size_diff,
+                    "countDiff": change.count_diff,
+                    "size": change.size,
+                    "count": change.count,
+                }
+                for change in changes[:max(top, 0)]
+            ],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        traced_bytes.set(current)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+            "tracedMb": round(current / (1024 * 1024), 1),
+            "peakMb": round(peak / (1024 * 1024), 1),
+            "baselineAgeS": round(time.time() - self.baseline_time, 1) if self.baseline is not None else None,
+        }
+
+
+heap = HeapSnapshots()
+
+
+def add_memory_stats(app, path: str = "/debug/memory"):
+    """Register the memory admin endpoints and the periodic metrics refresh."""
+    import asyncio
+
+    from fastapi import Request
+    from fastapi.responses import JSONResponse
+
+    from admin import admin_denied
+
+    refresh_task: Dict[str, Any] = {}
+
+    def _int_param(request: Request, name: str, default: int) -> int:
+        try:
+            return int(request.query_params.get(name, default))
+        except ValueError:
+            return default
+
+    async def run_blocking(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def memory_endpoint(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        return await run_blocking(memory_report, _int_param(request, "top", MEMORY_TOP_THREADS))
+
+    async def snapshot_endpoint(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        return await run_blocking(heap.start, _int_param(request, "frames", MEMORY_TRACEMALLOC_FRAMES))
+
+    async def stop_endpoint(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        return heap.stop()
+
+    async def diff_endpoint(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        group_by = request.query_params.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            return JSONResponse(content={"error": "group_by must be lineno, filename or traceback"}, status_code=400)
+        reset = request.query_params.get("reset", "false").lower() == "true"
+        try:
+            return await run_blocking(heap.diff, _int_param(request, "top", 20), group_by, reset)
+        except RuntimeError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=409)
+
+    async def refresh_loop():
+        while True:
+            await asyncio.sleep(MEMORY_STATS_INTERVAL_S)
+            try:
+                await run_blocking(memory_report, 0)
+            except Exception as e:
+                print(f"Memory stats refresh failed: {e}")
+
+    async def start_refresh():
+        if MEMORY_STATS_INTERVAL_S > 0:
+            refresh_task["task"] = asyncio.get_running_loop().create_task(refresh_loop())
+
+    async def stop_refresh():
+        task = refresh_task.pop("task", None)
+        if task is not None:
+            task.cancel()
+
+    on_startup(app, start_refresh)
+    on_shutdown(app, stop_refresh)
+    app.add_api_route(path, memory_endpoint, methods=["GET"], include_in_schema=False)
+    app.add_api_route(f"{path}/snapshot", snapshot_endpoint, methods=["POST"], include_in_schema=False)
+    app.add_api_route(f"{path}/snapshot", stop_endpoint, methods=["DELETE"], include_in_schema=False)
+    app.add_api_route(f"{path}/diff", diff_endpoint, methods=["GET"], include_in_schema=False)
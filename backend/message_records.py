@@ -0,0 +1,188 @@
+"""
+Compact message records for the graph state.
+
+By default the state holds LangChain messages: each one is a pydantic model with
+its own `additional_kwargs`, `response_metadata` and `usage_metadata` dicts, and
+every turn the servers build one per message of the request. With
+STATE_MESSAGES=compact the state holds `MessageRecord`s instead:
+- a tuple-backed `__slots__` record with only what the prompt needs (type, content, id,
+  name, tool calls, tool call id, and token usage on AI messages)
+- the short repeated strings (types, ids, names, tool names, short contents such
+  as "ok") are interned, so every thread and checkpoint shares one copy
+- LangChain messages are only materialized for the model call
+  (`as_langchain`, used by prompt_layout.build_prompt)
+
+Records expose the same attributes as LangChain messages (`type`, `content`,
+`tool_calls`, ...), so code that reads messages by attribute works on both.
+
+The graph state reducer (`add_message_records`) has the semantics of LangGraph's
+add_messages: messages get an id, a message with a known id replaces it, and
+RemoveMessage deletes it.
+
+LangGraph Studio (`langgraph dev`) and the CopilotKit SDK server read LangChain
+messages from the state, so keep the default (STATE_MESSAGES=langchain) for them.
+Compare with `python benchmarks/state_memory.py`.
+"""
+
+import os
+import sys
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+STATE_MESSAGES = os.getenv("STATE_MESSAGES", "langchain").lower()
+
+# Contents up to this length are interned ("ok", "yes", "thanks", ...)
+_INTERN_CONTENT_CHARS = 64
+_ROLE_TYPES = {
+    "user": "human", "human": "human",
+    "assistant": "ai", "ai": "ai",
+    "system": "system",
+    "tool": "tool",
+}
+_LANGCHAIN_CLASSES = {
+    "human": "HumanMessage",
+    "ai": "AIMessage",
+    "system": "SystemMessage",
+    "tool": "ToolMessage",
+}
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _RecordFields(NamedTuple):
+    type: str
+    content: Any
+    id: Optional[str] = None
+    name: Optional[str] = None
+    tool_calls: Optional[tuple] = None
+    tool_call_id: Optional[str] = None
+    usage_metadata: Optional[Dict[str, Any]] = None
+
+
+class MessageRecord(_RecordFields):
+    """
+    One state message: an immutable tuple (no per-instance __dict__), which
+    LangGraph's serializer checkpoints as is. Strings are interned on construction,
+    including when a checkpoint is loaded.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, type: str, content: Any = "", id: Optional[str] = None, name: Optional[str] = None,
+                tool_calls: Optional[Sequence[Dict[str, Any]]] = None, tool_call_id: Optional[str] = None,
+                usage_metadata: Optional[Dict[str, Any]] = None):
+        if isinstance(content, str) and len(content) <= _INTERN_CONTENT_CHARS:
+            content = sys.intern(content)
+        return super().__new__(
+            cls,
+            sys.intern(_ROLE_TYPES.get(type, type)),
+            content,
+            _intern(id),
+            _intern(name),
+            tuple(
+                {**call, "id": _intern(call.get("id")), "name": _intern(call.get("name"))}
+                for call in tool_calls
+            ) if tool_calls else None,
+            _intern(tool_call_id),
+            usage_metadata or None,
+        )
+
+
+def to_record(message: Any) -> MessageRecord:
+    """A record for a record, a LangChain message, or an OpenAI-style {"role", "content"} dict."""
+    if isinstance(message, MessageRecord):
+        return message
+    if isinstance(message, dict):
+        return MessageRecord(
+            message.get("type") or message.get("role") or "human",
+            message.get("content", ""),
+            message.get("id"),
+            message.get("name"),
+            message.get("tool_calls"),
+            message.get("tool_call_id"),
+        )
+    if isinstance(message, str):
+        return MessageRecord("human", message)
+    usage = getattr(message, "usage_metadata", None)
+    return MessageRecord(
+        getattr(message, "type", "human"),
+        getattr(message, "content", ""),
+        getattr(message, "id", None),
+        getattr(message, "name", None),
+        getattr(message, "tool_calls", None),
+        getattr(message, "tool_call_id", None),
+        dict(usage) if usage else None,
+    )
+
+
+def new_message(role: str, content: Any = "", **fields: Any) -> Any:
+    """
+    A message for the graph input in the configured STATE_MESSAGES format: a record,
+    or the LangChain message for `role` ("user", "assistant", "system", ...).
+    """
+    record = MessageRecord(role, content, **fields)
+    return record if STATE_MESSAGES == "compact" else as_langchain([record])[0]
+
+
+def as_langchain(messages: Sequence[Any]) -> List[Any]:
+    """LangChain messages for the model call; LangChain messages pass through unchanged."""
+    import langchain_core.messages as lc
+
+    materialized = []
+    for message in messages:
+        if not isinstance(message, MessageRecord):
+            materialized.append(message)
+            continue
+        cls = getattr(lc, _LANGCHAIN_CLASSES.get(message.type, "ChatMessage"))
+        fields: Dict[str, Any] = {"content": message.content}
+        if message.id is not None:
+            fields["id"] = message.id
+        if message.name is not None:
+            fields["name"] = message.name
+        if message.type == "ai":
+            if message.tool_calls:
+                fields["tool_calls"] = [dict(call) for call in message.tool_calls]
+            if message.usage_metadata:
+                fields["usage_metadata"] = message.usage_metadata
+        elif message.type == "tool":
+            fields["tool_call_id"] = message.tool_call_id or ""
+        elif cls is lc.ChatMessage:
+            fields["role"] = message.type
+        materialized.append(cls(**fields))
+    return materialized
+
+
+def add_message_records(left: Sequence[Any], right: Any) -> List[MessageRecord]:
+    """
+    Reducer for the compact `messages` state channel, like LangGraph's add_messages:
+    appends new messages (as records, with a generated id), replaces the message
+    with the same id, and applies RemoveMessage.
+    """
+    # A record is itself a tuple
+    if isinstance(right, MessageRecord) or not isinstance(right, (list, tuple)):
+        right = [right]
+    merged = [to_record(message) for message in left]
+    positions = {message.id: position for position, message in enumerate(merged)}
+    removed = set()
+    for message in right:
+        if getattr(message, "type", None) == "remove":
+            if message.id == "__remove_all__":
+                merged, positions, removed = [], {}, set()
+            elif message.id in positions:
+                removed.add(message.id)
+            continue
+        record = to_record(message)
+        if record.id is None:
+            record = record._replace(id=str(uuid.uuid4()))
+        position = positions.get(record.id)
+        if position is None:
+            positions[record.id] = len(merged)
+            merged.append(record)
+        else:
+            merged[position] = record
+            removed.discard(record.id)
+    if removed:
+        merged = [message for message in merged if message.id not in removed]
+    return merged
@@ -0,0 +1,143 @@
+"""
+Model response cassettes: recorded streaming responses with their timing.
+
+A cassette is a JSON-lines file with one recorded model call per line:
+    {"k": "<conversation key>", "u": "<last user message>",
+     "c": [[t_ms, "content", tool_call_chunks|null], ...], "usage": {...}}
+`t_ms` is the time since the request started, so replay can reproduce the
+original time to first token and token pacing.
+
+This module only uses the standard library; it is shared by the LangChain replay
+models (model_replay.py) and the OpenAI-compatible stand-in server
+(openai_standin.py).
+
+Settings:
+- MODEL_CASSETTE_PATH: cassette file (default "model_cassette.jsonl")
+- MODEL_REPLAY_TIMING: "original" (default), "accelerated" or "instant"
+- MODEL_REPLAY_SPEEDUP: divisor for accelerated timing (default 10)
+- MODEL_REPLAY_STRICT: "true" to fail on conversations missing from the cassette
+  (default: fall back to the last user message, then to recorded order)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from jsonl_writer import BackgroundJsonlWriter
+
+MODEL_CASSETTE_PATH = os.getenv("MODEL_CASSETTE_PATH", "model_cassette.jsonl")
+MODEL_REPLAY_TIMING = os.getenv("MODEL_REPLAY_TIMING", "original").lower()
+MODEL_REPLAY_SPEEDUP = float(os.getenv("MODEL_REPLAY_SPEEDUP", "10"))
+MODEL_REPLAY_STRICT = os.getenv("MODEL_REPLAY_STRICT", "false").lower() == "true"
+
+_LANGCHAIN_ROLES = {"human": "user", "ai": "assistant", "system": "system", "tool": "tool"}
+
+
+def content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return "" if content is None else str(content)
+
+
+def langchain_pairs(messages: Iterable[Any]) -> List[Tuple[str, str]]:
+    """(role, text) pairs for LangChain messages."""
+    return [(_LANGCHAIN_ROLES.get(message.type, message.type), content_text(message.content)) for message in messages]
+
+
+def openai_pairs(messages: Iterable[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(role, text) pairs for OpenAI chat-completions messages."""
+    return [(message.get("role", ""), content_text(message.get("content"))) for message in messages]
+
+
+def conversation_key(pairs: List[Tuple[str, str]]) -> str:
+    encoded = json.dumps(pairs, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:24]
+
+
+def last_user_text(pairs: List[Tuple[str, str]]) -> str:
+    for role, text in reversed(pairs):
+        if role == "user":
+            return text
+    return ""
+
+
+class Cassette:
+    """Recorded model responses, indexed by conversation key and by last user message."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: List[Dict[str, Any]] = []
+        self._by_key: Dict[str, Dict[str, Any]] = {}
+        self._by_user: Dict[str, Dict[str, Any]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._writer: Optional[BackgroundJsonlWriter] = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def _index(self, entry: Dict[str, Any]):
+        self.entries.append(entry)
+        self._by_key.setdefault(entry["k"], entry)
+        self._by_user.setdefault(entry.get("u", ""), entry)
+
+    def lookup(self, pairs: List[Tuple[str, str]], strict: bool = MODEL_REPLAY_STRICT) -> Dict[str, Any]:
+        entry = self._by_key.get(conversation_key(pairs))
+        if entry is None and not strict:
+            entry = self._by_user.get(last_user_text(pairs))
+            if entry is None and self.entries:
+                with self._lock:
+                    entry = self.entries[self._next % len(self.entries)]
+                    self._next += 1
+        if entry is None:
+            raise ValueError(
+                f"No recorded model response for this conversation in {self.path}. "
+                "Record one with AGENT_MODEL_BACKEND=record."
+            )
+        return entry
+
+    def append(self, pairs: List[Tuple[str, str]], chunks: List[list], usage: Optional[Dict[str, Any]]):
+        entry = {"k": conversation_key(pairs), "u": last_user_text(pairs), "c": chunks, "usage": usage}
+        with self._lock:
+            self._index(entry)
+            if self._writer is None:
+                self._writer = BackgroundJsonlWriter(self.path)
+        self._writer.submit(entry)
+
+
+_cassettes: Dict[str, Cassette] = {}
+
+
+def get_cassette(path: str = MODEL_CASSETTE_PATH) -> Cassette:
+    cassette = _cassettes.get(path)
+    if cassette is None:
+        cassette = _cassettes[path] = Cassette(path)
+    return cassette
+
+
+def replay_delay(previous_ms: float, current_ms: float, timing: str = MODEL_REPLAY_TIMING, speedup: float = MODEL_REPLAY_SPEEDUP) -> float:
+    """Seconds to wait before emitting a chunk recorded at `current_ms`."""
+    gap = max(0.0, current_ms - previous_ms) / 1000
+    if timing == "instant":
+        return 0.0
+    if timing == "accelerated":
+        return gap / max(speedup, 1e-9)
+    return gap
+
+
+async def replay_entry(entry: Dict[str, Any], timing: str = MODEL_REPLAY_TIMING, speedup: float = MODEL_REPLAY_SPEEDUP) -> AsyncIterator[Tuple[str, Optional[List[Dict[str, Any]]]]]:
+    """Yield (content, tool_call_chunks) of a recorded response with the requested pacing."""
+    previous_ms = 0.0
+    for t_ms, content, tool_call_chunks in entry["c"]:
+        delay = replay_delay(previous_ms, t_ms, timing, speedup)
+        if delay:
+            await asyncio.sleep(delay)
+        previous_ms = t_ms
+        yield content, tool_call_chunks
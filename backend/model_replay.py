@@ -0,0 +1,103 @@
+"""
+Record/replay model backend for deterministic, offline performance tests.
+
+Selected in agent.get_model through AGENT_MODEL_BACKEND:
+- "record": call OpenAI as usual and append every streamed response to the cassette
+- "replay": serve responses from the cassette, no API key or network needed
+
+See model_cassette.py for the cassette format and the replay timing settings.
+openai_standin.py serves the same cassettes over the OpenAI chat-completions
+streaming protocol, for tests that should exercise the real ChatOpenAI client.
+"""
+
+import time
+from typing import Any, AsyncIterator, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from model_cassette import (
+    MODEL_CASSETTE_PATH,
+    MODEL_REPLAY_SPEEDUP,
+    MODEL_REPLAY_TIMING,
+    content_text,
+    get_cassette,
+    langchain_pairs,
+    replay_entry,
+)
+
+
+def _chunk(content, tool_call_chunks=None, **kwargs):
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=content,
+        tool_call_chunks=tool_call_chunks or [],
+        **kwargs,
+    ))
+
+
+class ReplayChatModel(BaseChatModel):
+    """Serves streamed responses from a cassette with original, accelerated or no delay."""
+
+    cassette_path: str = MODEL_CASSETTE_PATH
+    timing: str = MODEL_REPLAY_TIMING
+    speedup: float = MODEL_REPLAY_SPEEDUP
+    model: str = "replay"
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        entry = get_cassette(self.cassette_path).lookup(langchain_pairs(messages))
+        message = AIMessage(content="".join(content for _, content, _ in entry["c"]))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[Any]:
+        entry = get_cassette(self.cassette_path).lookup(langchain_pairs(messages))
+        async for content, tool_call_chunks in replay_entry(entry, self.timing, self.speedup):
+            chunk = _chunk(content, tool_call_chunks)
+            if run_manager and content:
+                await run_manager.on_llm_new_token(content, chunk=chunk)
+            yield chunk
+        yield _chunk(
+            "",
+            usage_metadata=entry.get("usage") or None,
+            response_metadata={"model_name": self.model},
+        )
+
+
+class RecordingChatModel(BaseChatModel):
+    """Streams from the wrapped model and appends every response to the cassette."""
+
+    inner: Any
+    cassette_path: str = MODEL_CASSETTE_PATH
+
+    @property
+    def _llm_type(self) -> str:
+        return f"recording-{self.inner._llm_type}"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[Any]:
+        start = time.perf_counter()
+        chunks: List[list] = []
+        usage = None
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            message = chunk.message
+            t_ms = round((time.perf_counter() - start) * 1000, 1)
+            tool_call_chunks = [dict(tool_chunk) for tool_chunk in getattr(message, "tool_call_chunks", [])] or None
+            if message.content or tool_call_chunks:
+                chunks.append([t_ms, content_text(message.content), tool_call_chunks])
+            if getattr(message, "usage_metadata", None):
+                usage = dict(message.usage_metadata)
+            yield chunk
+        get_cassette(self.cassette_path).append(langchain_pairs(messages), chunks, usage)
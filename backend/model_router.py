@@ -0,0 +1,246 @@
+"""
+Cost/latency-aware model routing for chat_node.
+
+Every turn used to go to gpt-4o, including greetings and one-line follow-ups. The
+router classifies each turn with cheap local heuristics (no model call) and picks
+a route:
+- "fast" (AGENT_FAST_MODEL, default gpt-4o-mini): short messages in short
+  conversations that do not look like they need a tool or multi-step reasoning
+- "strong" (AGENT_STRONG_MODEL, default gpt-4o): everything else
+
+The other route is the fallback: when the chosen model fails with a rate limit,
+timeout or connection error, or produces no first token within
+ROUTER_FALLBACK_TTFT_MS, the turn is retried on it. A rate-limited model is
+skipped for ROUTER_COOLDOWN_S so the next turns go straight to the fallback.
+Falling back is only possible before the first token has been streamed.
+
+Per-route TTFT, latency, output tokens and fallbacks are exported on /metrics
+(`agent_model_*{route=...}`) to compare the routes. With AGENT_MODEL_BACKEND=fake
+both routes use the fake model with per-model latencies (see fake_model.py).
+
+Settings:
+- AGENT_MODEL_ROUTING: "auto" (default), "strong" or "fast" (route every turn)
+- ROUTER_FAST_MAX_CHARS: longest user message routed to the fast model (default 400)
+- ROUTER_FAST_MAX_DEPTH: most messages in the thread routed to the fast model (default 16)
+- ROUTER_FALLBACK_TTFT_MS: first-token deadline before falling back (default 8000, 0 = off)
+- ROUTER_COOLDOWN_S: how long a rate-limited model is skipped (default 30)
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import metrics
+from prompt_layout import tool_name
+from readiness import upstream_calls
+from tracing import current_span
+
+FAST_MODEL = os.getenv("AGENT_FAST_MODEL", "gpt-4o-mini")
+STRONG_MODEL = os.getenv("AGENT_STRONG_MODEL", "gpt-4o")
+MODEL_ROUTING = os.getenv("AGENT_MODEL_ROUTING", "auto").lower()
+FAST_MAX_CHARS = int(os.getenv("ROUTER_FAST_MAX_CHARS", "400"))
+FAST_MAX_DEPTH = int(os.getenv("ROUTER_FAST_MAX_DEPTH", "16"))
+FALLBACK_TTFT_MS = float(os.getenv("ROUTER_FALLBACK_TTFT_MS", "8000"))
+COOLDOWN_S = float(os.getenv("ROUTER_COOLDOWN_S", "30"))
+
+ROUTES = {"fast": FAST_MODEL, "strong": STRONG_MODEL}
+
+# Requests that usually need multi-step reasoning, whatever their length
+_COMPLEX_CUES = re.compile(
+    r"```|\b(?:explain|why|analy[sz]e|compare|debug|refactor|prove|step[- ]by[- ]step|plan|design|optimi[sz]e)\b",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z0-9]+")
+_NAME_PARTS = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+# Tool-name words too generic to signal that a tool is wanted
+_GENERIC_TOOL_WORDS = {"get", "set", "add", "update", "tool", "action", "data", "info", "value", "make", "with"}
+
+route_decisions = metrics.counter(
+    "agent_model_route_total", "Turns routed to each model route, by classification reason"
+)
+route_fallbacks = metrics.counter(
+    "agent_model_fallbacks_total", "Model calls retried on the fallback route"
+)
+route_ttft = metrics.histogram(
+    "agent_model_ttft_seconds", "Time to first token per model route"
+)
+route_latency = metrics.histogram(
+    "agent_model_latency_seconds", "Total model call latency per model route"
+)
+route_output_tokens = metrics.counter(
+    "agent_model_output_tokens_total", "Completion tokens per model route"
+)
+
+_cooldown_until: Dict[str, float] = {}
+_cooldown_lock = threading.Lock()
+
+
+class RouteDecision(NamedTuple):
+    route: str
+    reason: str
+
+
+def _message_type(message: Any) -> str:
+    if isinstance(message, dict):
+        return str(message.get("type") or message.get("role") or "")
+    return str(getattr(message, "type", ""))
+
+
+def _message_text(message: Any) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return "" if content is None else str(content)
+
+
+def _tool_words(tools: Sequence[Any]) -> set:
+    words = set()
+    for tool in tools:
+        for part in _NAME_PARTS.findall(tool_name(tool).replace("_", " ").replace("-", " ")):
+            part = part.lower()
+            if len(part) >= 4 and part not in _GENERIC_TOOL_WORDS:
+                words.add(part)
+    return words
+
+
+def _mentions_tool(text: str, tool_words: set) -> bool:
+    # Prefix match so "colors" and "coloring" match a "setBackgroundColor" tool
+    for word in _WORD.findall(text.lower()):
+        if len(word) < 4:
+            continue
+        for tool_word in tool_words:
+            if word.startswith(tool_word) or tool_word.startswith(word):
+                return True
+    return False
+
+
+def classify_turn(messages: Sequence[Any], tools: Sequence[Any] = ()) -> RouteDecision:
+    """
+    Pick the route for the next model call from the conversation and the bound tools.
+    Rules, first match wins: depth, tool results, message length, tool mentions,
+    reasoning cues; anything left is a simple turn for the fast model.
+    """
+    if MODEL_ROUTING in ROUTES:
+        return RouteDecision(MODEL_ROUTING, "forced")
+    if not messages:
+        return RouteDecision("strong", "empty")
+    if len(messages) > FAST_MAX_DEPTH:
+        return RouteDecision("strong", "deep_conversation")
+
+    last = messages[-1]
+    if _message_type(last) in ("tool", "function"):
+        # Answering from tool results (or chaining another call) needs the strong model
+        return RouteDecision("strong", "tool_result")
+    if _message_type(last) not in ("human", "user"):
+        return RouteDecision("strong", "no_user_message")
+
+    text = _message_text(last)
+    if len(text) > FAST_MAX_CHARS:
+        return RouteDecision("strong", "long_message")
+    if tools and _mentions_tool(text, _tool_words(tools)):
+        return RouteDecision("strong", "tools_needed")
+    if _COMPLEX_CUES.search(text):
+        return RouteDecision("strong", "complex_request")
+    return RouteDecision("fast", "simple")
+
+
+def _cooling_down(model_name: str) -> bool:
+    with _cooldown_lock:
+        return _cooldown_until.get(model_name, 0.0) > time.monotonic()
+
+
+def _start_cooldown(model_name: str):
+    with _cooldown_lock:
+        _cooldown_until[model_name] = time.monotonic() + COOLDOWN_S
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why `error` is worth retrying (on the fallback model or later), or None to raise it."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    name = type(error).__name__
+    if status == 429 or "RateLimit" in name:
+        return "rate_limited"
+    if isinstance(error, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    if isinstance(error, ConnectionError) or "Connection" in name:
+        return "connection_error"
+    if isinstance(status, int) and status >= 500:
+        return "server_error"
+    return None
+
+
+def route_order(decision: RouteDecision) -> List[str]:
+    """Routes to try, in order: the chosen one first unless it is cooling down."""
+    other = "strong" if decision.route == "fast" else "fast"
+    order = [decision.route, other]
+    if _cooling_down(ROUTES[decision.route]) and not _cooling_down(ROUTES[other]):
+        order.reverse()
+    return order
+
+
+async def stream_routed(
+    decision: RouteDecision,
+    bind: Callable[[str], Any],
+    messages: List[Any],
+    config: Any = None,
+) -> AsyncIterator[Any]:
+    """
+    Stream the model call for `decision`, falling back to the other route on
+    rate limits, errors or a missed first-token deadline.
+    `bind(model_name)` returns the tool-bound model for a model name.
+    """
+    import asyncio
+
+    route_decisions.inc(labels={"route": decision.route, "reason": decision.reason})
+    order = route_order(decision)
+    model_span = current_span()
+
+    for attempt, route in enumerate(order):
+        model_name = ROUTES[route]
+        is_last = attempt == len(order) - 1
+        start = time.perf_counter()
+        iterator = bind(model_name).astream(messages, config).__aiter__()
+        try:
+            if FALLBACK_TTFT_MS > 0 and not is_last:
+                first = await asyncio.wait_for(iterator.__anext__(), FALLBACK_TTFT_MS / 1000)
+            else:
+                first = await iterator.__anext__()
+        except StopAsyncIteration:
+            upstream_calls.observe()
+            return
+        except Exception as e:
+            reason = "slow" if isinstance(e, asyncio.TimeoutError) and not is_last else retry_reason(e)
+            # Provider-side failures only (not e.g. a rejected request)
+            upstream_calls.observe(error=reason is not None)
+            if reason == "rate_limited":
+                _start_cooldown(model_name)
+            if reason is None or is_last:
+                raise
+            await iterator.aclose()
+            next_route = order[attempt + 1]
+            route_fallbacks.inc(labels={"from": route, "to": next_route, "reason": reason})
+            model_span.add_event("model.fallback", model=model_name, reason=reason)
+            print(f"Model {model_name} ({route}) {reason}, falling back to {ROUTES[next_route]} ({next_route})")
+            continue
+
+        upstream_calls.observe()
+        labels = {"route": route, "model": model_name}
+        route_ttft.observe(time.perf_counter() - start, labels=labels)
+        model_span.set_attribute("route", route)
+        model_span.set_attribute("model", model_name)
+        output_tokens = 0
+        chunk = first
+        while True:
+            usage = getattr(chunk, "usage_metadata", None)
+            if usage:
+                output_tokens += int(usage.get("output_tokens", 0) or 0)
+            yield chunk
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+        route_latency.observe(time.perf_counter() - start, labels=labels)
+        route_output_tokens.inc(output_tokens, labels=labels)
+        return
@@ -0,0 +1,200 @@
+"""
+Local stand-in for the OpenAI chat-completions API (streaming and non-streaming).
+
+Serves recorded responses from a model cassette (see model_cassette.py) with their
+original, accelerated or no timing, or a canned reply when the cassette has no
+match. Point the real client at it to test the full ChatOpenAI path offline:
+
+    python openai_standin.py --port 8099 --cassette model_cassette.jsonl --timing accelerated
+    OPENAI_BASE_URL=http://localhost:8099/v1 OPENAI_API_KEY=standin uvicorn server_ndjson:app
+
+Only the standard library is used, so it runs anywhere the tests do.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from model_cassette import (
+    MODEL_CASSETTE_PATH,
+    MODEL_REPLAY_SPEEDUP,
+    MODEL_REPLAY_TIMING,
+    get_cassette,
+    openai_pairs,
+    replay_entry,
+)
+
+CANNED_REPLY = "This is a canned reply from the local OpenAI stand-in."
+
+
+class StandinServer:
+    """Minimal HTTP/1.1 server for POST /v1/chat/completions and GET /v1/models."""
+
+    def __init__(self, cassette_path: str, timing: str, speedup: float, ttft_ms: float = 0.0):
+        self.cassette_path = cassette_path
+        self.timing = timing
+        self.speedup = speedup
+        self.ttft_ms = ttft_ms
+
+    def _entry(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            return get_cassette(self.cassette_path).lookup(openai_pairs(messages))
+        except ValueError:
+            # Canned reply, streamed word by word after the configured TTFT
+            words = CANNED_REPLY.split()
+            chunks = [[self.ttft_ms + i * 10.0, word if i == 0 else f" {word}", None] for i, word in enumerate(words)]
+            return {"c": chunks, "usage": None}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    return
+                method, path, body = request
+                if method == "GET" and path.rstrip("/").endswith("/models"):
+                    await _send_json(writer, 200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model"}]})
+                elif method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    await self.chat_completions(writer, json.loads(body or b"{}"))
+                else:
+                    await _send_json(writer, 404, {"error": {"message": f"Unknown route {method} {path}"}})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def chat_completions(self, writer: asyncio.StreamWriter, payload: Dict[str, Any]):
+        model = payload.get("model", "gpt-4o")
+        entry = self._entry(payload.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = _openai_usage(entry.get("usage"))
+
+        if not payload.get("stream"):
+            content, tool_calls = _collect(entry)
+            message: Dict[str, Any] = {"role": "assistant", "content": content or None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            await _send_json(writer, 200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": usage,
+            })
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        def event(data: Dict[str, Any]) -> Dict[str, Any]:
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, **data}
+
+        await _send_sse(writer, event({"choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}))
+        saw_tool_calls = False
+        async for content, tool_call_chunks in replay_entry(entry, self.timing, self.speedup):
+            delta: Dict[str, Any] = {}
+            if content:
+                delta["content"] = content
+            if tool_call_chunks:
+                saw_tool_calls = True
+                delta["tool_calls"] = [_openai_tool_delta(tool_chunk) for tool_chunk in tool_call_chunks]
+            await _send_sse(writer, event({"choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+        await _send_sse(writer, event({"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls" if saw_tool_calls else "stop"}]}))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            await _send_sse(writer, event({"choices": [], "usage": usage}))
+        writer.write(_chunked(b"data: [DONE]\n\n") + b"0\r\n\r\n")
+        await writer.drain()
+
+
+def _collect(entry: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    content = "".join(chunk[1] for chunk in entry["c"])
+    calls: Dict[int, Dict[str, Any]] = {}
+    for _, _, tool_call_chunks in entry["c"]:
+        for tool_chunk in tool_call_chunks or []:
+            call = calls.setdefault(tool_chunk.get("index") or 0, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+            call["id"] = call["id"] or tool_chunk.get("id") or ""
+            call["function"]["name"] += tool_chunk.get("name") or ""
+            call["function"]["arguments"] += tool_chunk.get("args") or ""
+    return content, [calls[index] for index in sorted(calls)]
+
+
+def _openai_tool_delta(tool_chunk: Dict[str, Any]) -> Dict[str, Any]:
+    delta: Dict[str, Any] = {"index": tool_chunk.get("index") or 0, "function": {"arguments": tool_chunk.get("args") or ""}}
+    if tool_chunk.get("id"):
+        delta["id"] = tool_chunk["id"]
+        delta["type"] = "function"
+    if tool_chunk.get("name"):
+        delta["function"]["name"] = tool_chunk["name"]
+    return delta
+
+
+def _openai_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    usage = usage or {}
+    prompt = int(usage.get("input_tokens", 0))
+    completion = int(usage.get("output_tokens", 0))
+    cached = int((usage.get("input_token_details") or {}).get("cache_read", 0))
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, body
+
+
+def _chunked(data: bytes) -> bytes:
+    return f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n"
+
+
+async def _send_sse(writer: asyncio.StreamWriter, data: Dict[str, Any]):
+    writer.write(_chunked(f"data: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")))
+    await writer.drain()
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, data: Dict[str, Any]):
+    body = json.dumps(data).encode("utf-8")
+    reason = "OK" if status == 200 else "Not Found"
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+    )
+    await writer.drain()
+
+
+async def serve(host: str, port: int, standin: StandinServer):
+    server = await asyncio.start_server(standin.handle, host, port)
+    print(f"OpenAI stand-in listening on http://{host}:{port}/v1 (cassette: {standin.cassette_path}, timing: {standin.timing})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--cassette", default=MODEL_CASSETTE_PATH)
+    parser.add_argument("--timing", choices=["original", "accelerated", "instant"], default=MODEL_REPLAY_TIMING)
+    parser.add_argument("--speedup", type=float, default=MODEL_REPLAY_SPEEDUP)
+    parser.add_argument("--ttft-ms", type=float, default=0.0, help="TTFT of the canned reply")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port, StandinServer(args.cassette, args.timing, args.speedup, args.ttft_ms)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+On-demand sampling profiler: GET /debug/profile (admin token, see admin.py).
+
+Profiles a live worker without restarting it. For the requested seconds, every
+thread's Python stack (the event loop thread and the executor threads running
+graph nodes, checkpointer calls, ...) is sampled every PROFILE_INTERVAL_MS:
+- of process CPU time, from a SIGPROF timer, when the loop runs on the main thread
+  (uvicorn, gunicorn workers): unbiased, CPU-bound loop code shows up as such
+- otherwise of wall time, from a sampler thread, which only runs when a thread
+  releases the GIL (CPU-bound loop code is under-sampled)
+then the endpoint returns the aggregated stacks:
+- format=collapsed (default): one "frame;frame;... count" line per distinct stack,
+  for flamegraph.pl, inferno or speedscope
+- format=speedscope: speedscope's JSON file format, one sampled profile per thread
+
+Each stack starts with tags, so the flame graph splits by them:
+- the thread ("loop", or the thread name, e.g. "ThreadPoolExecutor-0_1")
+- the route: the path of the request whose task is running on the loop thread
+  ("route=/copilotkit"; "route=-" when unknown: executor threads, tasks created
+  before the profile started)
+- the graph node on the stack ("node=chat_node", "node=-" outside a node)
+
+Query parameters: seconds (default 10, at most PROFILE_MAX_SECONDS), interval_ms,
+format, idle=true to keep samples of threads waiting for work (the loop in its
+selector, idle executor workers), which are dropped by default.
+
+Overhead: reading the stacks takes tens of microseconds per sample (about 1% of
+one core at the default 10 ms), and only while a profile runs. One profile at a
+time (409 otherwise).
+
+Settings:
+- PROFILE_INTERVAL_MS: default sampling interval (default 10)
+- PROFILE_MAX_SECONDS: longest profile (default 60)
+"""
+
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import metrics
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_MAX_DEPTH = 256
+# (file name, function) of the innermost frame of a thread waiting for work
+_IDLE_FRAMES = frozenset({
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("watchdog.py", "_monitor"),
+})
+
+profiles = metrics.counter("profiler_runs_total", "Profiles taken through /debug/profile, by format")
+
+# Request path of the current request; copied into every task it creates
+_route: ContextVar[Optional[str]] = ContextVar("profile_route", default=None)
+# Route of each task created while a profile runs (the sampler thread cannot read task contexts)
+_task_routes: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+_profile_lock = threading.Lock()
+_profiling = threading.Event()
+_project_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class RouteTagMiddleware:
+    """ASGI middleware recording the request path for the profiler's route tag."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            route = scope.get("path") or "/"
+            _route.set(route)
+            if _profiling.is_set():
+                # Created before the route was known: tag the request's own task
+                task = asyncio.current_task()
+                if task is not None:
+                    _task_routes[task] = route
+        await self.app(scope, receive, send)
+
+
+def _short_file(filename: str) -> str:
+    if filename.startswith(_project_dir):
+        return os.path.relpath(filename, _project_dir)
+    marker = filename.rfind("-packages" + os.sep)
+    if marker != -1:
+        return filename[marker + len("-packages" + os.sep):]
+    return os.path.basename(filename)
+
+
+def _graph_node_names() -> FrozenSet[str]:
+    """Node names of the graphs loaded in the registry (chat_node, router_node, ...)."""
+    try:
+        from agent_registry import registry
+
+        names = {
+            name
+            for entry in registry.entries.values() if entry.graph is not None
+            for name in getattr(entry.graph, "nodes", {})
+        }
+    except Exception:
+        names = set()
+    return frozenset(name for name in names if not name.startswith("__"))
+
+
+class StackSampler:
+    """
+    Aggregates stack samples of every thread. Driven either by a SIGPROF interval
+    timer (start_signal) or by a background thread (start_thread).
+    """
+
+    def __init__(self, interval_s: float, loop: Any = None, loop_thread_id: Optional[int] = None,
+                 node_names: FrozenSet[str] = frozenset(), idle: bool = False):
+        self.interval = max(interval_s, 0.001)
+        self.loop = loop
+        self.loop_thread_id = loop_thread_id
+        self.node_names = node_names
+        self.idle = idle
+        self.mode = ""
+        # (thread, route, node, frames root first) -> samples
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._names: Dict[Tuple[Any, int], Tuple[str, str, int]] = {}
+        # Thread ident -> name. Never built by the SIGPROF handler: threading.enumerate()
+        # takes a non-reentrant lock the interrupted loop thread may hold (Thread.start)
+        self._thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._previous_handler: Any = None
+
+    def start_signal(self):
+        """
+        Sample on SIGPROF, every `interval` of process CPU time. The handler runs on
+        the main (loop) thread at the next bytecode, so the loop thread is sampled
+        wherever it is, not only where it releases the GIL. Main thread only.
+        """
+        self.mode = "signal"
+        own = threading.get_ident()
+        self._refresh_thread_names()
+
+        def on_timer(signum, frame):
+            self.sample(own, frame)
+
+        self._previous_handler = signal.signal(signal.SIGPROF, on_timer)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def start_thread(self, on_done=None):
+        """
+        Sample from a background thread every `interval` of wall time. It only gets
+        the GIL when a thread releases it, so CPU-bound loop code is under-sampled:
+        the fallback when the loop does not run on the main thread.
+        """
+        self.mode = "thread"
+
+        def run():
+            own = threading.get_ident()
+            while not self._stop.is_set():
+                self._refresh_thread_names()
+                self.sample(own)
+                self._stop.wait(self.interval)
+            if on_done is not None:
+                on_done()
+
+        threading.Thread(target=run, name="stack-sampler", daemon=True).start()
+
+    def stop(self):
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+            # Name the threads started during the profile (sampled by ident until now)
+            self._refresh_thread_names()
+            renamed: Counter = Counter()
+            for (thread, route, node, stack), count in self.counts.items():
+                renamed[(self._thread_names.get(thread, str(thread)) if isinstance(thread, int) else thread, route, node, stack)] += count
+            self.counts = renamed
+        self._stop.set()
+
+    def _refresh_thread_names(self):
+        self._thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+
+    def _frame_name(self, frame) -> Tuple[str, str, int]:
+        code, line = frame.f_code, frame.f_lineno or 0
+        name = self._names.get((code, line))
+        if name is None:
+            name = self._names[(code, line)] = (code.co_name, _short_file(code.co_filename), line)
+        return name
+
+    def sample(self, own: int, own_frame: Any = None):
+        """Record every thread's stack; `own_frame` stands for the calling thread's (signal mode)."""
+        frames = sys._current_frames()
+        if own_frame is not None:
+            frames[own] = own_frame
+        else:
+            frames.pop(own, None)
+        route = None
+        if self.loop is not None:
+            try:
+                task = asyncio.current_task(self.loop)
+                route = _task_routes.get(task) if task is not None else None
+            except Exception:
+                route = None
+        self.samples += 1
+        for ident, frame in frames.items():
+            code = frame.f_code
+            if not self.idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                continue
+            stack = []
+            node = None
+            while frame is not None and len(stack) < _MAX_DEPTH:
+                name = self._frame_name(frame)
+                if node is None and name[0] in self.node_names:
+                    node = name[0]
+                stack.append(name)
+                frame = frame.f_back
+            stack.reverse()
+            is_loop = ident == self.loop_thread_id
+            # Unknown threads keep their ident, named when the profile stops
+            thread = "loop" if is_loop else self._thread_names.get(ident, ident)
+            self.counts[(thread, (route if is_loop else None) or "-", node or "-", tuple(stack))] += 1
+
+
+def _tags(thread: str, route: str, node: str) -> List[str]:
+    return [thread, f"route={route}", f"node={node}"]
+
+
+def collapsed(counts: Counter) -> str:
+    """Brendan Gregg's collapsed stack format, heaviest stacks first."""
+    lines = []
+    for (thread, route, node, stack), count in counts.most_common():
+        frames = _tags(thread, route, node) + [f"{name} ({file}:{line})" for name, file, line in stack]
+        lines.append(";".join(frame.replace(";", ":") for frame in frames) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(counts: Counter, interval_s: float, name: str = "backend profile") -> Dict[str, Any]:
+    """speedscope's file format (https://www.speedscope.app/file-format-schema.json)."""
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[Tuple[str, str, int], int] = {}
+
+    def index(frame: Tuple[str, str, int]) -> int:
+        position = frame_index.get(frame)
+        if position is None:
+            position = frame_index[frame] = len(frames)
+            frames.append({"name": frame[0], "file": frame[1], "line": frame[2]} if frame[1] else {"name": frame[0]})
+        return position
+
+    by_thread: Dict[str, Dict[str, list]] = {}
+    for (thread, route, node, stack), count in counts.most_common():
+        profile = by_thread.setdefault(thread, {"samples": [], "weights": []})
+        tags = [(tag, "", 0) for tag in _tags(thread, route, node)[1:]]
+        profile["samples"].append([index(frame) for frame in tags + list(stack)])
+        profile["weights"].append(round(count * interval_s * 1000, 3))
+
+    thread_profiles = [
+        {
+            "type": "sampled",
+            "name": thread,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(profile["weights"]), 3),
+            "samples": profile["samples"],
+            "weights": profile["weights"],
+        }
+        for thread, profile in sorted(by_thread.items(), key=lambda item: item[0] != "loop")
+    ]
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": thread_profiles,
+        "name": name,
+        "activeProfileIndex": 0,
+        "exporter": "copilotkit-backend profiler.py",
+    }
+
+
+def _tagging_task_factory(previous):
+    """A loop task factory recording the creating request's route for each new task."""
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous is not None else asyncio.Task(coro, loop=loop, **kwargs)
+        route = _route.get()
+        if route is not None:
+            _task_routes[task] = route
+        return task
+
+    return factory
+
+
+def _can_use_signal() -> bool:
+    return (
+        hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+        # Another profiler owns SIGPROF
+        and signal.getsignal(signal.SIGPROF) in (signal.SIG_DFL, signal.SIG_IGN, None)
+    )
+
+
+async def profile(seconds: float, interval_s: float = PROFILE_INTERVAL_MS / 1000, idle: bool = False) -> StackSampler:
+    """Sample every thread for `seconds` while the loop keeps serving; the finished sampler."""
+    loop = asyncio.get_running_loop()
+    previous_factory = loop.get_task_factory()
+    loop.set_task_factory(_tagging_task_factory(previous_factory))
+    _profiling.set()
+    current = asyncio.current_task()
+    route = _route.get()
+    if current is not None and route is not None:
+        _task_routes[current] = route
+    sampler = StackSampler(interval_s, loop, threading.get_ident(), _graph_node_names(), idle)
+    start = time.monotonic()
+    try:
+        if _can_use_signal():
+            sampler.start_signal()
+        else:
+            sampler.start_thread()
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+        sampler.duration = time.monotonic() - start
+        _profiling.clear()
+        loop.set_task_factory(previous_factory)
+        _task_routes.clear()
+    return sampler
+
+
+def add_profiler(app, path: str = "/debug/profile"):
+    """Register the admin profiling endpoint and the route tagging middleware."""
+    from fastapi import Request
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    from admin import admin_denied
+
+    async def profile_endpoint(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        params = request.query_params
+        try:
+            seconds = min(float(params.get("seconds", "10")), PROFILE_MAX_SECONDS)
+            interval_ms = float(params.get("interval_ms", PROFILE_INTERVAL_MS))
+        except ValueError:
+            return JSONResponse(content={"error": "seconds and interval_ms must be numbers"}, status_code=400)
+        output = params.get("format", "collapsed")
+        if output not in ("collapsed", "speedscope") or seconds <= 0 or interval_ms <= 0:
+            return JSONResponse(
+                content={"error": "format must be collapsed or speedscope, seconds and interval_ms positive"},
+                status_code=400,
+            )
+        if not _profile_lock.acquire(blocking=False):
+            return JSONResponse(content={"error": "A profile is already running"}, status_code=409)
+        try:
+            sampler = await profile(seconds, interval_ms / 1000, params.get("idle", "false").lower() == "true")
+        finally:
+            _profile_lock.release()
+        profiles.inc(labels={"format": output})
+        print(f"Profile ({sampler.mode}): {sampler.samples} samples over {sampler.duration:.1f}s, {len(sampler.counts)} distinct stacks")
+        headers = {"Cache-Control": "no-store", "X-Profile-Samples": str(sampler.samples), "X-Profile-Mode": sampler.mode}
+        if output == "speedscope":
+            headers["Content-Disposition"] = 'attachment; filename="profile.speedscope.json"'
+            return JSONResponse(content=speedscope(sampler.counts, sampler.interval), headers=headers)
+        return PlainTextResponse(collapsed(sampler.counts), headers=headers)
+
+    app.add_middleware(RouteTagMiddleware)
+    app.add_api_route(path, profile_endpoint, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,164 @@
+"""
+Prompt assembly for chat_node, laid out for upstream prompt-prefix caching.
+
+OpenAI (and most providers) cache the longest previously seen prompt prefix: tool
+definitions first, then the system prompt, then the conversation. A prefix hit
+requires those leading bytes to be identical from one turn to the next, so:
+- tools are ordered by name and their schemas canonicalized (sorted keys), so the
+  order in which the frontend registered its CopilotKit actions does not matter
+- the canonical tool list and the system message are built once per distinct
+  tool set and reused as the same objects on every turn
+- the cached-token count reported in the response usage metadata is recorded, so
+  cache hits can be verified on /metrics
+
+Settings:
+- AGENT_SYSTEM_PROMPT
+- PROMPT_CACHE_LOG: also print the cached-token count of every model call
+  (default "false"; a synchronous stdout write per call, for debugging only)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+from message_records import as_langchain
+
+SYSTEM_PROMPT = os.getenv("AGENT_SYSTEM_PROMPT", "You are a helpful assistant.")
+PROMPT_CACHE_LOG = os.getenv("PROMPT_CACHE_LOG", "false").lower() == "true"
+
+_TOOL_CACHE_SIZE = 256
+_tool_cache: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_bound_models: "OrderedDict[str, Any]" = OrderedDict()
+_tool_cache_lock = threading.Lock()
+_system_message = None
+
+prompt_tokens = metrics.counter(
+    "agent_prompt_tokens_total", "Prompt tokens sent to the model"
+)
+prompt_cached_tokens = metrics.counter(
+    "agent_prompt_cached_tokens_total", "Prompt tokens served from the provider's prefix cache"
+)
+prompt_cache_hits = metrics.counter(
+    "agent_prompt_cache_hits_total", "Model calls that reported at least one cached prompt token"
+)
+model_calls = metrics.counter(
+    "agent_model_calls_total", "Model calls with usage metadata"
+)
+
+
+def tool_name(tool: Any) -> str:
+    if isinstance(tool, dict):
+        function = tool.get("function")
+        if isinstance(function, dict) and function.get("name"):
+            return str(function["name"])
+        return str(tool.get("name", ""))
+    return str(getattr(tool, "name", ""))
+
+
+def _canonical(value: Any) -> Any:
+    """Recursively rebuild dicts with sorted keys so serialization is byte-stable."""
+    if isinstance(value, dict):
+        return {key: _canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def canonical_tools(tools: Sequence[Any]) -> Tuple[str, List[Any]]:
+    """
+    Return (fingerprint, tools) with tools ordered by name and dict schemas
+    canonicalized. The same tool set always yields the same list object.
+    """
+    if not tools:
+        return "", []
+
+    dict_tools = [tool for tool in tools if isinstance(tool, dict)]
+    other_tools = [tool for tool in tools if not isinstance(tool, dict)]
+    ordered = sorted((_canonical(tool) for tool in dict_tools), key=tool_name)
+    encoded = json.dumps(ordered, separators=(",", ":"), ensure_ascii=False)
+    other_names = ",".join(sorted(tool_name(tool) for tool in other_tools))
+    fingerprint = hashlib.sha256(f"{encoded}|{other_names}".encode("utf-8")).hexdigest()[:16]
+
+    with _tool_cache_lock:
+        cached = _tool_cache.get(fingerprint)
+        if cached is not None:
+            _tool_cache.move_to_end(fingerprint)
+            return fingerprint, cached
+        # Non-dict tools (LangChain BaseTool objects) are not serializable here,
+        # keep them after the dict tools, ordered by name
+        cached = ordered + sorted(other_tools, key=tool_name)
+        _tool_cache[fingerprint] = cached
+        if len(_tool_cache) > _TOOL_CACHE_SIZE:
+            _tool_cache.popitem(last=False)
+    return fingerprint, cached
+
+
+def bind_tools_cached(model: Any, tools_fingerprint: str, tools: List[Any], **kwargs):
+    """
+    Bind `tools` to `model`, reusing the binding for a tool set already seen.
+    The OpenAI tool conversion then runs once per tool set instead of every turn.
+    """
+    key = f"{id(model)}:{tools_fingerprint}:{sorted(kwargs.items())}"
+    with _tool_cache_lock:
+        bound = _bound_models.get(key)
+        if bound is not None:
+            _bound_models.move_to_end(key)
+            return bound
+    bound = model.bind_tools(tools, **kwargs)
+    with _tool_cache_lock:
+        _bound_models[key] = bound
+        if len(_bound_models) > _TOOL_CACHE_SIZE:
+            _bound_models.popitem(last=False)
+    return bound
+
+
+def system_message():
+    """The system message, built once so its content never changes between turns."""
+    global _system_message
+    if _system_message is None:
+        from langchain_core.messages import SystemMessage
+
+        _system_message = SystemMessage(content=SYSTEM_PROMPT)
+    return _system_message
+
+
+def build_prompt(state: Dict[str, Any], extra_tools: Sequence[Any] = ()) -> Tuple[str, List[Any], List[Any]]:
+    """
+    Assemble the prompt for one model call.
+    Returns (tools_fingerprint, tools, messages): the stable prefix (tools, system
+    prompt) followed by the conversation, as LangChain messages (compact state
+    records are materialized here, see message_records).
+    """
+    fingerprint, tools = canonical_tools([*state.get("tools", []), *extra_tools])
+    messages = [system_message(), *as_langchain(state["messages"])]
+    return fingerprint, tools, messages
+
+
+def record_usage(response: Any, tools_fingerprint: str = "") -> Optional[Dict[str, int]]:
+    """
+    Record prompt and cached-token counts from a model response's usage metadata.
+    Returns {"input_tokens", "cached_tokens"} or None when the provider reported no usage.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+
+    input_tokens = int(usage.get("input_tokens", 0) or 0)
+    details = usage.get("input_token_details") or {}
+    cached_tokens = int(details.get("cache_read", 0) or 0)
+
+    labels = {"model": str((getattr(response, "response_metadata", None) or {}).get("model_name", "unknown"))}
+    model_calls.inc(labels=labels)
+    prompt_tokens.inc(input_tokens, labels=labels)
+    prompt_cached_tokens.inc(cached_tokens, labels=labels)
+    if cached_tokens:
+        prompt_cache_hits.inc(labels=labels)
+
+    if PROMPT_CACHE_LOG:
+        ratio = cached_tokens / input_tokens if input_tokens else 0.0
+        print(f"Prompt cache: {cached_tokens}/{input_tokens} tokens cached ({ratio:.0%}), tools={tools_fingerprint or 'none'}")
+    return {"input_tokens": input_tokens, "cached_tokens": cached_tokens}
@@ -6,17 +6,46 @@ This provides the GraphQL streaming API that CopilotKit frontend v1.10.x expects
 import os
 import json
 import uuid
-from typing import Any, Dict, List, AsyncIterator
+from typing import Any, Dict, List, AsyncIterator, Optional
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
-from agent import agentic_chat_graph
+from fastapi.responses import JSONResponse
+from agent import load_env, thread_has_checkpoint, warm_up_on_startup
+from agent_registry import UnknownAgent, add_agent_registry, registry
+from checkpointer import close_checkpointer
+from lifespan import lifespan, on_shutdown, on_startup
+from hot_runs import hold_paused_run, resume_command
+from message_records import new_message
+from memory_stats import add_memory_stats
+from metrics import add_metrics_endpoint
+from profiler import add_profiler
+from readiness import add_readiness
+from serving import add_send_metrics
+from ws_sessions import add_ws_sessions
+from stream_compression import add_stream_compression
+from watchdog import add_loop_watchdog
+from run_scheduler import add_run_endpoints, run_response
+from request_body import RequestBodyError, RequestBodyTooLarge, read_copilot_body, select_new_messages
+from stream_buffer import resume_position, resume_response
+from stream_frames import KEEPALIVE_PAYLOAD, action_execution_payload, client_tools_hash, iso_timestamp, snapshot_tools
+from tracing import span, stage, traced_endpoint, traced_steps
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-app = FastAPI(title="CopilotKit LangGraph GraphQL Runtime")
+app = FastAPI(title="CopilotKit LangGraph GraphQL Runtime", lifespan=lifespan)
+on_startup(app, warm_up_on_startup)
+on_shutdown(app, close_checkpointer)
+add_metrics_endpoint(app)
+add_loop_watchdog(app)
+add_readiness(app)
+add_stream_compression(app)
+add_run_endpoints(app)
+add_agent_registry(app)
+add_profiler(app)
+add_memory_stats(app)
+add_send_metrics(app)
+add_ws_sessions(app)
 
 # CORS middleware
 app.add_middleware(
@@ -27,6 +56,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def encode_frame(payload: Dict[str, Any]) -> str:
+    """
+    Serialize one complete multipart part, boundary and headers included (timed as
+    the "encode" trace stage). One write per frame, and keep-alive frames can only
+    land between parts.
+    """
+    with stage("encode"):
+        return "---\nContent-Type: application/json; charset=utf-8\n\n" + json.dumps(payload) + "\n"
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -34,25 +72,30 @@ async def health_check():
 
 @app.get("/copilotkit/")
 @app.post("/copilotkit/")
+@traced_endpoint("copilotkit_graphql")
 async def copilotkit_graphql(request: Request):
     """
     Handle GraphQL requests from CopilotKit frontend.
     This mimics the LangGraph Platform GraphQL API.
     """
+    # Reconnect after a dropped stream: replay the run instead of starting a new one
+    resume = resume_position(request)
+    if resume is not None:
+        return await resume_response(*resume, encode_frame(KEEPALIVE_PAYLOAD), "multipart/mixed; boundary=---")
+
     try:
-        body = await request.json()
-    except:
+        with span("request.parse"):
+            body = await read_copilot_body(request)
+    except RequestBodyTooLarge as e:
+        return JSONResponse(content={"errors": [{"message": str(e)}]}, status_code=e.status_code)
+    except RequestBodyError:
         body = None
     
     # Handle GET request or info request
-    if request.method == "GET" or not body:
+    if request.method == "GET" or not isinstance(body, dict) or not body:
         return {
             "actions": [],
-            "agents": [{
-                "name": "agentic_chat",
-                "description": "A simple agentic chat flow using LangGraph",
-                "type": "langgraph"
-            }],
+            "agents": registry.describe(),
             "sdkVersion": "0.1.72"
         }
     
@@ -62,24 +105,34 @@ async def copilotkit_graphql(request: Request):
     if operation_name == "generateCopilotResponse":
         variables = body.get("variables", {})
         data = variables.get("data", {})
+        run_id = str(uuid.uuid4())
+        # Hash of the tool schemas the client already holds (snapshots omit them when it matches)
+        tools_hash = client_tools_hash(request)
+        try:
+            agent_name = registry.request_agent(data)
+        except UnknownAgent as e:
+            return JSONResponse(content={"errors": [{"message": f"Unknown agent: {e.args[0]}"}]}, status_code=e.status_code)
         
-        return StreamingResponse(
-            generate_copilot_response(data),
-            media_type="multipart/mixed; boundary=---",
-        )
+        # Streamed by this response, or by a scheduled run in background mode (see run_scheduler.py);
+        # keep-alive frames during long model/tool waits so proxies don't buffer or time out
+        return await run_response(request, run_id, lambda: generate_copilot_response(data, run_id, agent_name, tools_hash), encode_frame(KEEPALIVE_PAYLOAD), "multipart/mixed; boundary=---", thread_id=data.get("threadId"))
     
     # Default response
     return {
         "actions": [],
-        "agents": [{
-            "name": "agentic_chat",
-            "description": "A simple agentic chat flow using LangGraph",
-            "type": "langgraph"
-        }],
+        "agents": registry.describe(),
         "sdkVersion": "0.1.72"
     }
 
-async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
+@app.get("/copilotkit/runs/{run_id}/frames")
+async def resume_run(run_id: str, request: Request, after: Optional[int] = None):
+    """
+    Resume a run's stream after a dropped connection: the frames after frame
+    `after` (or the Last-Event-ID header), then the live tail (see stream_buffer.py).
+    """
+    return await resume_response(*resume_position(request, run_id, after), encode_frame(KEEPALIVE_PAYLOAD), "multipart/mixed; boundary=---")
+
+async def generate_copilot_response(data: Dict[str, Any], run_id: str, agent_name: str, tools_hash: Optional[str] = None) -> AsyncIterator[str]:
     """
     Generate streaming GraphQL response for CopilotKit.
     Mimics the LangGraph Platform API response format.
@@ -104,31 +157,12 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
         }
         tools.append(tool)
     
-    # Convert messages to LangChain format
-    lc_messages = []
-    for msg in messages:
-        text_msg = msg.get("textMessage", {})
-        content = text_msg.get("content", "")
-        role = text_msg.get("role", "user")
-        
-        if role == "system":
-            from langchain_core.messages import SystemMessage
-            lc_messages.append(SystemMessage(content=content))
-        elif role == "user":
-            from langchain_core.messages import HumanMessage
-            lc_messages.append(HumanMessage(content=content))
-        elif role == "assistant":
-            from langchain_core.messages import AIMessage
-            lc_messages.append(AIMessage(content=content))
-    
-    # Initial response
-    yield "---\n"
-    yield f"Content-Type: application/json; charset=utf-8\n\n"
+    # Initial response, flushed before the checkpoint load and the model call
     initial_response = {
         "data": {
             "generateCopilotResponse": {
                 "threadId": thread_id,
-                "runId": None,
+                "runId": run_id,
                 "extensions": None,
                 "__typename": "CopilotResponse",
                 "messages": [],
@@ -137,23 +171,21 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
         },
         "hasNext": True
     }
-    yield json.dumps(initial_response) + "\n"
+    yield encode_frame(initial_response)
     
     # Agent state message - starting
-    yield "---\n"
-    yield f"Content-Type: application/json; charset=utf-8\n\n"
     agent_state_msg = {
         "incremental": [{
             "items": [{
                 "__typename": "AgentStateMessageOutput",
                 "id": f"ck-{uuid.uuid4()}",
-                "createdAt": "2025-11-19T15:00:00.000Z",
+                "createdAt": iso_timestamp(),
                 "threadId": thread_id,
-                "state": json.dumps({"tools": tools}),
+                "state": json.dumps(snapshot_tools(tools, tools_hash)),
                 "running": True,
-                "agentName": "agentic_chat",
+                "agentName": agent_name,
                 "nodeName": "chat_node",
-                "runId": str(uuid.uuid4()),
+                "runId": run_id,
                 "active": True,
                 "role": "assistant"
             }],
@@ -161,12 +193,32 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
         }],
         "hasNext": True
     }
-    yield json.dumps(agent_state_msg) + "\n"
+    yield encode_frame(agent_state_msg)
     
     try:
+        graph = await registry.aget_graph(agent_name)
+        # Frontend tool results resume the run paused at the tool calls (TOOL_RESUME=interrupt)
+        resume = await resume_command(graph, thread_id, messages) if "threadId" in data else None
+
+        lc_messages = []
+        if resume is None:
+            # Delta sync: the checkpointer already holds the earlier turns of this thread,
+            # so only the messages sent since the last assistant reply are decoded
+            if "threadId" in data:
+                messages = select_new_messages(messages, await thread_has_checkpoint(thread_id))
+
+            # Convert messages to state messages (LangChain or compact, see message_records)
+            for msg in messages:
+                text_msg = msg.get("textMessage", {})
+                content = text_msg.get("content", "")
+                role = text_msg.get("role", "user")
+                
+                if role in ("system", "user", "assistant"):
+                    lc_messages.append(new_message(role, content))
+        
         # Invoke the LangGraph agent
         config = {"configurable": {"thread_id": thread_id}}
-        input_state = {
+        input_state = resume if resume is not None else {
             "messages": lc_messages,
             "tools": tools
         }
@@ -174,8 +226,12 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
         # Stream the response
         message_idx = 1
         content_parts = []
+        tool_calls = []
+        paused = None
         
-        async for event in agentic_chat_graph.astream(input_state, config):
+        async for event in traced_steps(graph.astream(input_state, config)):
+            if "__interrupt__" in event:
+                paused = event
             # Get the AI message from the event
             if "chat_node" in event:
                 node_output = event["chat_node"]
@@ -185,18 +241,21 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
                         ai_message = ai_messages[-1]
                     else:
                         ai_message = ai_messages
+                    tool_calls = getattr(ai_message, "tool_calls", None) or []
+                    content = ai_message.content if hasattr(ai_message, 'content') else str(ai_message)
+                    
+                    # Split into words for streaming effect
+                    words = content.split()
                     
                     # Start text message
-                    if not content_parts:
+                    if words and not content_parts:
                         message_idx += 1
-                        yield "---\n"
-                        yield f"Content-Type: application/json; charset=utf-8\n\n"
                         text_msg_start = {
                             "incremental": [{
                                 "items": [{
                                     "__typename": "TextMessageOutput",
                                     "id": f"run--{uuid.uuid4()}",
-                                    "createdAt": "2025-11-19T15:00:00.000Z",
+                                    "createdAt": iso_timestamp(),
                                     "role": "assistant",
                                     "parentMessageId": None,
                                     "content": []
@@ -205,19 +264,13 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
                             }],
                             "hasNext": True
                         }
-                        yield json.dumps(text_msg_start) + "\n"
+                        yield encode_frame(text_msg_start)
                     
                     # Stream content
-                    content = ai_message.content if hasattr(ai_message, 'content') else str(ai_message)
-                    
-                    # Split into words for streaming effect
-                    words = content.split()
                     for i, word in enumerate(words):
                         content_part = word if i == 0 else f" {word}"
                         content_parts.append(content_part)
                         
-                        yield "---\n"
-                        yield f"Content-Type: application/json; charset=utf-8\n\n"
                         content_chunk = {
                             "incremental": [{
                                 "items": [content_part],
@@ -225,12 +278,12 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
                             }],
                             "hasNext": True
                         }
-                        yield json.dumps(content_chunk) + "\n"
+                        yield encode_frame(content_chunk)
         
+        await hold_paused_run(graph, thread_id, paused)
+
         # Mark message as complete
         if content_parts:
-            yield "---\n"
-            yield f"Content-Type: application/json; charset=utf-8\n\n"
             msg_complete = {
                 "incremental": [{
                     "data": {
@@ -244,24 +297,28 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
                 }],
                 "hasNext": True
             }
-            yield json.dumps(msg_complete) + "\n"
+            yield encode_frame(msg_complete)
+        
+        # Frontend tool calls: the frontend runs them and sends each result back as a
+        # resultMessage whose actionExecutionId is the tool-call id (see hot_runs.py)
+        for call in tool_calls:
+            message_idx += 1
+            yield encode_frame(action_execution_payload(call, message_idx))
         
         # Final agent state
         message_idx += 1
-        yield "---\n"
-        yield f"Content-Type: application/json; charset=utf-8\n\n"
         final_state = {
             "incremental": [{
                 "items": [{
                     "__typename": "AgentStateMessageOutput",
                     "id": f"ck-{uuid.uuid4()}",
-                    "createdAt": "2025-11-19T15:00:00.000Z",
+                    "createdAt": iso_timestamp(),
                     "threadId": thread_id,
-                    "state": json.dumps({"tools": tools, "messages": [{"role": "user", "content": lc_messages[-1].content if lc_messages else ""}, {"role": "assistant", "content": "".join(content_parts)}]}),
+                    "state": json.dumps({**snapshot_tools(tools, tools_hash), "messages": [{"role": "user", "content": lc_messages[-1].content if lc_messages else ""}, {"role": "assistant", "content": "".join(content_parts)}]}),
                     "running": True,
-                    "agentName": "agentic_chat",
+                    "agentName": agent_name,
                     "nodeName": "chat_node",
-                    "runId": str(uuid.uuid4()),
+                    "runId": run_id,
                     "active": False,
                     "role": "assistant"
                 }],
@@ -269,11 +326,9 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
             }],
             "hasNext": True
         }
-        yield json.dumps(final_state) + "\n"
+        yield encode_frame(final_state)
         
         # Success response
-        yield "---\n"
-        yield f"Content-Type: application/json; charset=utf-8\n\n"
         success = {
             "incremental": [{
                 "data": {
@@ -287,13 +342,11 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
             }],
             "hasNext": False
         }
-        yield json.dumps(success) + "\n"
+        yield encode_frame(success)
         yield "-----\n"
         
     except Exception as e:
         # Error response
-        yield "---\n"
-        yield f"Content-Type: application/json; charset=utf-8\n\n"
         error = {
             "incremental": [{
                 "data": {
@@ -308,18 +361,11 @@ async def generate_copilot_response(data: Dict[str, Any]) -> AsyncIterator[str]:
             }],
             "hasNext": False
         }
-        yield json.dumps(error) + "\n"
+        yield encode_frame(error)
         yield "-----\n"
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    port = int(os.getenv("PORT", 3006))
-    uvicorn.run(
-        "server_graphql:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,
-        log_level="info"
-    )
+    from serving import serve
+
+    serve(app, "server_graphql:app", int(os.getenv("PORT", 3006)), reload=True)
 
@@ -6,22 +6,48 @@ This server provides the /copilotkit/langgraph endpoint that the frontend expect
 import os
 import json
 import time
+import uuid
 from datetime import datetime
 from typing import Dict, Any, Optional
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
-from dotenv import load_dotenv
-from agent import agentic_chat_graph
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.runnables import RunnableConfig
+from fastapi.responses import JSONResponse
+from agent import load_env, warm_up_on_startup
+from agent_registry import UnknownAgent, add_agent_registry, registry
+from checkpointer import close_checkpointer
+from lifespan import lifespan, on_shutdown, on_startup
+from message_records import new_message
+from memory_stats import add_memory_stats
+from metrics import add_metrics_endpoint
+from profiler import add_profiler
+from readiness import add_readiness
+from serving import add_send_metrics
+from ws_sessions import add_ws_sessions
+from stream_compression import add_stream_compression
+from watchdog import add_loop_watchdog
+from request_body import RequestBodyError, read_copilot_body, is_message_list
+from run_scheduler import add_run_endpoints, run_response
+from stream_buffer import resume_position, resume_response
+from stream_frames import KEEPALIVE_PAYLOAD
+from tracing import span, stage, traced_endpoint, traced_steps
 import asyncio
-from sse_starlette.sse import EventSourceResponse
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-app = FastAPI(title="CopilotKit LangGraph Runtime")
+app = FastAPI(title="CopilotKit LangGraph Runtime", lifespan=lifespan)
+on_startup(app, warm_up_on_startup)
+on_shutdown(app, close_checkpointer)
+add_metrics_endpoint(app)
+add_loop_watchdog(app)
+add_readiness(app)
+add_stream_compression(app)
+add_run_endpoints(app, prefix="/copilotkit/langgraph/runs")
+add_agent_registry(app)
+add_profiler(app)
+add_memory_stats(app)
+add_send_metrics(app)
+add_ws_sessions(app)
 
 # CORS middleware - allow requests from frontend
 app.add_middleware(
@@ -32,6 +58,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MULTIPART_MEDIA_TYPE = "multipart/mixed; boundary=-"
+# Written by resumed streams during long waits (see stream_frames.with_keepalive)
+KEEPALIVE_PART = b"---\nContent-Type: application/json; charset=utf-8\n\n" + json.dumps(KEEPALIVE_PAYLOAD).encode("utf-8") + b"\n"
+
 
 @app.get("/health")
 async def health_check():
@@ -40,28 +70,34 @@ async def health_check():
 
 
 @app.post("/copilotkit/langgraph")
+@traced_endpoint("copilotkit_langgraph")
 async def copilotkit_langgraph(request: Request):
     """
     Main endpoint for CopilotKit LangGraph runtime.
     This endpoint handles GraphQL requests from the CopilotKit frontend.
     """
+    # Reconnect after a dropped stream: replay the run instead of starting a new one
+    resume = resume_position(request)
+    if resume is not None:
+        return await resume_response(*resume, KEEPALIVE_PART, MULTIPART_MEDIA_TYPE)
+
     try:
         # Check content type
         content_type = request.headers.get("content-type", "")
         print(f"Content-Type: {content_type}")
         
-        # Parse JSON body
+        # Parse JSON body (size-limited, messages are decoded lazily)
         try:
-            body = await request.json()
+            with span("request.parse"):
+                body = await read_copilot_body(request)
+            if not isinstance(body, dict):
+                raise RequestBodyError(f"Invalid JSON: expected object, got {type(body).__name__}")
             print(f"Parsed JSON successfully, body keys: {list(body.keys())}")
-        except Exception as e:
-            # If JSON parsing fails, try to get raw body for debugging
-            raw_body = await request.body()
-            print(f"JSON decode error: {e}")
-            print(f"Raw body (first 500 chars): {raw_body[:500] if raw_body else 'Empty'}")
+        except RequestBodyError as e:
+            print(f"Request body error: {e}")
             return JSONResponse(
-                content={"errors": [{"message": f"Invalid JSON: {str(e)}"}]},
-                status_code=400
+                content={"errors": [{"message": str(e)}]},
+                status_code=e.status_code
             )
         
         # Extract GraphQL query and variables
@@ -82,8 +118,6 @@ async def copilotkit_langgraph(request: Request):
             if isinstance(data, dict) and "messages" in data:
                 messages = data.get("messages", [])
                 print(f"  Messages count: {len(messages)}")
-                for i, msg in enumerate(messages):
-                    print(f"    Message {i}: {list(msg.keys()) if isinstance(msg, dict) else type(msg)}")
         print(f"{'='*60}\n")
         
         # Handle CopilotKit's generateCopilotResponse mutation
@@ -108,11 +142,23 @@ async def copilotkit_langgraph(request: Request):
         )
 
 
+@app.get("/copilotkit/langgraph/runs/{run_id}/frames")
+async def resume_run(run_id: str, request: Request, after: Optional[int] = None):
+    """
+    Resume a run's stream after a dropped connection: the frames after frame
+    `after` (or the Last-Event-ID header), then the live tail (see stream_buffer.py).
+    """
+    return await resume_response(*resume_position(request, run_id, after), KEEPALIVE_PART, MULTIPART_MEDIA_TYPE)
+
+
 async def handle_generate_copilot_response(variables: Dict[str, Any], request: Request = None):
     """
     Handle CopilotKit's generateCopilotResponse GraphQL mutation.
     This is the main mutation used by CopilotKit for LangGraph agents.
     """
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableConfig
+
     try:
         # Validate variables structure
         if not isinstance(variables, dict):
@@ -127,7 +173,6 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
         
         if not isinstance(data, dict):
             print(f"ERROR: data is not a dict, it's {type(data)}")
-            print(f"Variables content: {json.dumps(variables, indent=2)}")
             return JSONResponse(
                 content={"errors": [{"message": f"Invalid data format: expected dict, got {type(data)}"}]},
                 status_code=400
@@ -135,21 +180,28 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
         
         # Extract thread ID
         thread_id = data.get("threadId", "default")
-        run_id = data.get("runId")
+        # Always a fresh server-side id: it keys the stream buffer and the scheduler, and
+        # CopilotKit reuses the client's runId on follow-up requests
+        run_id = str(uuid.uuid4())
         
         # Extract messages from data.messages array
         messages_data = data.get("messages", [])
         
-        if not isinstance(messages_data, list):
+        if not is_message_list(messages_data):
             print(f"ERROR: messages_data is not a list, it's {type(messages_data)}")
             return JSONResponse(
                 content={"errors": [{"message": f"Invalid messages format: expected list, got {type(messages_data)}"}]},
                 status_code=400
             )
         
-        # Extract agent name
-        agent_session = data.get("agentSession", {})
-        agent_name = agent_session.get("agentName", "agentic_chat") if isinstance(agent_session, dict) else "agentic_chat"
+        # Extract agent name (the default agent when the request names none)
+        try:
+            agent_name = registry.request_agent(data)
+        except UnknownAgent as e:
+            return JSONResponse(
+                content={"errors": [{"message": f"Unknown agent: {e.args[0]}"}]},
+                status_code=e.status_code
+            )
         
         print(f"Extracted data:")
         print(f"  Thread ID: {thread_id}")
@@ -179,7 +231,7 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
         if not user_message_content:
             # Log all messages for debugging
             print(f"ERROR: No user message found!")
-            print(f"Available messages: {json.dumps(messages_data, indent=2, default=str)}")
+            print(f"Messages in request: {len(messages_data)}")
             return JSONResponse(
                 content={"errors": [{"message": "No user message found in request. Check server logs for details."}]},
                 status_code=400
@@ -191,8 +243,8 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
         # Create a generator for streaming response
         async def event_generator():
             try:
-                # Convert message to LangChain format
-                human_message = HumanMessage(content=user_message_content)
+                # Convert message to a state message (LangChain or compact, see message_records)
+                human_message = new_message("user", user_message_content)
                 
                 # Prepare state for the graph
                 config = RunnableConfig(
@@ -206,10 +258,11 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
                 message_index = 0  # Track message index in the messages array
                 full_content = ""
                 
-                async for chunk in agentic_chat_graph.astream(
+                graph = await registry.aget_graph(agent_name)
+                async for chunk in traced_steps(graph.astream(
                     state,
                     config=config
-                ):
+                )):
                     # Extract the AI message from the chunk
                     if "chat_node" in chunk:
                         messages = chunk["chat_node"].get("messages", [])
@@ -342,9 +395,10 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
                 }
                 
                 # First chunk: initial response
-                json_data = json.dumps(initial_data, ensure_ascii=False)
-                json_bytes = json_data.encode('utf-8')
-                initial_chunk = f"---\nContent-Type: application/json; charset=utf-8\nContent-Length: {len(json_bytes)}\n\n".encode('utf-8') + json_bytes + b"\n"
+                with stage("encode"):
+                    json_data = json.dumps(initial_data, ensure_ascii=False)
+                    json_bytes = json_data.encode('utf-8')
+                    initial_chunk = f"---\nContent-Type: application/json; charset=utf-8\nContent-Length: {len(json_bytes)}\n\n".encode('utf-8') + json_bytes + b"\n"
                 print(f"Sending initial chunk: {len(initial_chunk)} bytes")
                 yield initial_chunk
                 
@@ -352,11 +406,12 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
                 chunk_count = 0
                 async for event in event_generator():
                     if event.get("event") == "message":
-                        data = json.loads(event.get("data", "{}"))
-                        json_data = json.dumps(data, ensure_ascii=False)
-                        json_bytes = json_data.encode('utf-8')
-                        chunk_header = f"---\nContent-Type: application/json; charset=utf-8\nContent-Length: {len(json_bytes)}\n\n".encode('utf-8')
-                        chunk = chunk_header + json_bytes + b"\n"
+                        with stage("encode"):
+                            data = json.loads(event.get("data", "{}"))
+                            json_data = json.dumps(data, ensure_ascii=False)
+                            json_bytes = json_data.encode('utf-8')
+                            chunk_header = f"---\nContent-Type: application/json; charset=utf-8\nContent-Length: {len(json_bytes)}\n\n".encode('utf-8')
+                            chunk = chunk_header + json_bytes + b"\n"
                         chunk_count += 1
                         print(f"Sending incremental chunk {chunk_count}: {len(chunk)} bytes, data keys: {list(data.keys())}")
                         if "incremental" in data:
@@ -380,13 +435,19 @@ async def handle_generate_copilot_response(variables: Dict[str, Any], request: R
         
         # Always use multipart format since that's what the working example uses
         # But ensure it's properly formatted
-        return StreamingResponse(
-            multipart_generator(),
-            media_type="multipart/mixed; boundary=-",
+        # Frames are numbered and buffered so a dropped connection can resume (see stream_buffer.py);
+        # in background mode the run executes on the scheduler (see run_scheduler.py)
+        return await run_response(
+            request,
+            run_id,
+            multipart_generator,
+            KEEPALIVE_PART,
+            MULTIPART_MEDIA_TYPE,
+            thread_id=thread_id,
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
+                "X-Accel-Buffering": "no",
             }
         )
         
@@ -405,6 +466,10 @@ async def handle_stream_messages(variables: Dict[str, Any]):
     Handle streaming messages from CopilotKit frontend.
     This creates a streaming response compatible with CopilotKit's GraphQL expectations.
     """
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableConfig
+    from sse_starlette.sse import EventSourceResponse
+
     thread_id = variables.get("threadId", "default")
     message_data = variables.get("message", {})
     
@@ -416,7 +481,13 @@ async def handle_stream_messages(variables: Dict[str, Any]):
     else:
         message_content = str(message_data)
     
-    agent_name = variables.get("agent", "agentic_chat")
+    try:
+        agent_name = registry.resolve(variables.get("agent"))
+    except UnknownAgent as e:
+        return JSONResponse(
+            content={"errors": [{"message": f"Unknown agent: {e.args[0]}"}]},
+            status_code=e.status_code
+        )
     
     if not message_content:
         return JSONResponse(
@@ -427,8 +498,8 @@ async def handle_stream_messages(variables: Dict[str, Any]):
     # Create a generator for streaming response
     async def event_generator():
         try:
-            # Convert message to LangChain format
-            human_message = HumanMessage(content=message_content)
+            # Convert message to a state message (LangChain or compact, see message_records)
+            human_message = new_message("user", message_content)
             
             # Prepare state for the graph
             config = RunnableConfig(
@@ -443,10 +514,11 @@ async def handle_stream_messages(variables: Dict[str, Any]):
             # Stream the response from the graph
             # The graph will automatically load previous messages from the checkpointer
             last_content = ""
-            async for chunk in agentic_chat_graph.astream(
+            graph = await registry.aget_graph(agent_name)
+            async for chunk in traced_steps(graph.astream(
                 state,
                 config=config
-            ):
+            )):
                 # Extract the AI message from the chunk
                 if "chat_node" in chunk:
                     messages = chunk["chat_node"].get("messages", [])
@@ -503,6 +575,8 @@ async def handle_send_message(variables: Dict[str, Any]):
     """
     Handle non-streaming message send.
     """
+    from langchain_core.runnables import RunnableConfig
+
     thread_id = variables.get("threadId", "default")
     message_data = variables.get("message", {})
     
@@ -521,8 +595,16 @@ async def handle_send_message(variables: Dict[str, Any]):
         )
     
     try:
-        # Convert message to LangChain format
-        human_message = HumanMessage(content=message_content)
+        agent_name = registry.resolve(variables.get("agent"))
+    except UnknownAgent as e:
+        return JSONResponse(
+            content={"errors": [{"message": f"Unknown agent: {e.args[0]}"}]},
+            status_code=e.status_code
+        )
+    
+    try:
+        # Convert message to a state message (LangChain or compact, see message_records)
+        human_message = new_message("user", message_content)
         
         # Prepare state for the graph
         config = RunnableConfig(
@@ -531,7 +613,8 @@ async def handle_send_message(variables: Dict[str, Any]):
         
         # Invoke the graph
         # The graph will automatically load previous messages from the checkpointer
-        result = await agentic_chat_graph.ainvoke(
+        graph = await registry.aget_graph(agent_name)
+        result = await graph.ainvoke(
             {"messages": [human_message]},
             config=config
         )
@@ -540,7 +623,7 @@ async def handle_send_message(variables: Dict[str, Any]):
         messages = result.get("messages", [])
         ai_message = None
         for msg in messages:
-            if isinstance(msg, AIMessage):
+            if getattr(msg, "type", None) == "ai":
                 ai_message = msg
                 break
         
@@ -572,14 +655,7 @@ async def handle_send_message(variables: Dict[str, Any]):
 
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    port = int(os.getenv("PORT", 3006))
-    uvicorn.run(
-        "server:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,
-        log_level="info"
-    )
+    from serving import serve
+
+    serve(app, "server:app", int(os.getenv("PORT", 3006)), reload=True)
 
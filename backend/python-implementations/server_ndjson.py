@@ -6,18 +6,46 @@ Uses newline-delimited JSON instead of multipart/mixed for better compatibility.
 import os
 import json
 import uuid
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
-from agent import agentic_chat_graph
-from langchain_core.messages import HumanMessage, AIMessage
+from fastapi.responses import JSONResponse
+from agent import load_env, thread_has_checkpoint, warm_up_on_startup
+from agent_registry import UnknownAgent, add_agent_registry, registry
+from checkpointer import close_checkpointer
+from lifespan import lifespan, on_shutdown, on_startup
+from hot_runs import hold_paused_run, resume_command
+from message_records import new_message
+from memory_stats import add_memory_stats
+from metrics import add_metrics_endpoint
+from profiler import add_profiler
+from readiness import add_readiness
+from serving import add_send_metrics
+from ws_sessions import add_ws_sessions
+from stream_compression import add_stream_compression
+from watchdog import add_loop_watchdog
+from run_scheduler import add_run_endpoints, run_response
+from request_body import RequestBodyError, RequestBodyTooLarge, read_copilot_body, select_new_messages
+from stream_buffer import resume_position, resume_response
+from stream_frames import KEEPALIVE_PAYLOAD, action_execution_payload, client_tools_hash, iso_timestamp, snapshot_tools
+from tracing import span, stage, traced_endpoint, traced_steps
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-app = FastAPI(title="CopilotKit LangGraph Runtime (NDJSON)")
+app = FastAPI(title="CopilotKit LangGraph Runtime (NDJSON)", lifespan=lifespan)
+on_startup(app, warm_up_on_startup)
+on_shutdown(app, close_checkpointer)
+add_metrics_endpoint(app)
+add_loop_watchdog(app)
+add_readiness(app)
+add_stream_compression(app)
+add_run_endpoints(app)
+add_agent_registry(app)
+add_profiler(app)
+add_memory_stats(app)
+add_send_metrics(app)
+add_ws_sessions(app)
 
 # CORS middleware
 app.add_middleware(
@@ -28,6 +56,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def encode_frame(payload: Dict[str, Any]) -> str:
+    """Serialize one NDJSON frame (timed as the "encode" trace stage)."""
+    with stage("encode"):
+        return json.dumps(payload) + "\n"
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -38,23 +71,31 @@ async def copilotkit_info():
     """Return agent info."""
     return {
         "actions": [],
-        "agents": [{
-            "name": "agentic_chat",
-            "description": "A simple agentic chat flow using LangGraph",
-            "type": "langgraph"
-        }],
+        "agents": registry.describe(),
         "sdkVersion": "0.1.72"
     }
 
 @app.post("/copilotkit/")
+@traced_endpoint("copilotkit_stream")
 async def copilotkit_stream(request: Request):
     """
     Handle GraphQL streaming requests using NDJSON format.
     Each JSON object is on its own line.
     """
+    # Reconnect after a dropped stream: replay the run instead of starting a new one
+    resume = resume_position(request)
+    if resume is not None:
+        return await resume_response(*resume, encode_frame(KEEPALIVE_PAYLOAD), "application/x-ndjson")
+
     try:
-        body = await request.json()
-    except:
+        with span("request.parse"):
+            body = await read_copilot_body(request)
+    except RequestBodyTooLarge as e:
+        return JSONResponse(content={"errors": [{"message": str(e)}]}, status_code=e.status_code)
+    except RequestBodyError:
+        return await copilotkit_info()
+    
+    if not isinstance(body, dict):
         return await copilotkit_info()
     
     operation_name = body.get("operationName")
@@ -69,18 +110,13 @@ async def copilotkit_stream(request: Request):
     messages_input = data.get("messages", [])
     frontend_data = data.get("frontend", {})
     frontend_actions = frontend_data.get("actions", [])
-    
-    # Parse messages
-    lc_messages = []
-    for msg in messages_input:
-        if "textMessage" in msg:
-            text_msg = msg["textMessage"]
-            role = text_msg.get("role")
-            content = text_msg.get("content", "")
-            if role == "user":
-                lc_messages.append(HumanMessage(content=content))
-            elif role == "assistant":
-                lc_messages.append(AIMessage(content=content))
+    run_id = str(uuid.uuid4())
+    # Hash of the tool schemas the client already holds (snapshots omit them when it matches)
+    tools_hash = client_tools_hash(request)
+    try:
+        agent_name = registry.request_agent(data)
+    except UnknownAgent as e:
+        return JSONResponse(content={"errors": [{"message": f"Unknown agent: {e.args[0]}"}]}, status_code=e.status_code)
     
     # Parse frontend tools
     tools = []
@@ -116,12 +152,12 @@ async def copilotkit_stream(request: Request):
     
     # Generate NDJSON streaming response
     async def generate_ndjson_stream():
-        # 1. Initial response
-        yield json.dumps({
+        # 1. Initial response, flushed before the checkpoint load and the model call
+        yield encode_frame({
             "data": {
                 "generateCopilotResponse": {
                     "threadId": thread_id,
-                    "runId": None,
+                    "runId": run_id,
                     "extensions": None,
                     "__typename": "CopilotResponse",
                     "messages": [],
@@ -129,56 +165,82 @@ async def copilotkit_stream(request: Request):
                 }
             },
             "hasNext": True
-        }) + "\n"
+        })
         
         # 2. Agent state (start)
-        yield json.dumps({
+        yield encode_frame({
             "incremental": [{
                 "items": [{
                     "__typename": "AgentStateMessageOutput",
                     "id": f"ck-{uuid.uuid4()}",
-                    "createdAt": "2025-11-19T16:00:00.000Z",
+                    "createdAt": iso_timestamp(),
                     "threadId": thread_id,
-                    "state": json.dumps({"tools": tools}),
+                    "state": json.dumps(snapshot_tools(tools, tools_hash)),
                     "running": True,
-                    "agentName": "agentic_chat",
+                    "agentName": agent_name,
                     "nodeName": "chat_node",
-                    "runId": str(uuid.uuid4()),
+                    "runId": run_id,
                     "active": True,
                     "role": "assistant"
                 }],
                 "path": ["generateCopilotResponse", "messages", 0]
             }],
             "hasNext": True
-        }) + "\n"
+        })
         
         try:
+            graph = await registry.aget_graph(agent_name)
+            # Frontend tool results resume the run paused at the tool calls (TOOL_RESUME=interrupt)
+            resume = await resume_command(graph, thread_id, messages_input)
+
+            lc_messages = []
+            if resume is None:
+                # Delta sync: the checkpointer already holds the earlier turns of this thread,
+                # so only the messages sent since the last assistant reply are decoded
+                new_messages = select_new_messages(messages_input, await thread_has_checkpoint(thread_id))
+
+                # Parse messages (LangChain or compact state messages, see message_records)
+                for msg in new_messages:
+                    if "textMessage" in msg:
+                        text_msg = msg["textMessage"]
+                        role = text_msg.get("role")
+                        content = text_msg.get("content", "")
+                        if role in ("user", "assistant"):
+                            lc_messages.append(new_message(role, content))
+
             # Invoke agent
             config = {"configurable": {"thread_id": thread_id}}
-            input_state = {
+            input_state = resume if resume is not None else {
                 "messages": lc_messages,
                 "tools": tools
             }
             
             content_parts = []
+            tool_calls = []
             message_idx = 1
+            paused = None
             
-            async for event in agentic_chat_graph.astream(input_state, config):
+            async for event in traced_steps(graph.astream(input_state, config)):
+                if "__interrupt__" in event:
+                    paused = event
                 if "chat_node" in event:
                     node_output = event["chat_node"]
                     if "messages" in node_output:
                         ai_messages = node_output["messages"]
                         ai_message = ai_messages[-1] if isinstance(ai_messages, list) else ai_messages
+                        tool_calls = getattr(ai_message, "tool_calls", None) or []
+                        content = ai_message.content if hasattr(ai_message, 'content') else str(ai_message)
+                        words = content.split()
                         
                         # Start text message
-                        if not content_parts:
+                        if words and not content_parts:
                             message_idx += 1
-                            yield json.dumps({
+                            yield encode_frame({
                                 "incremental": [{
                                     "items": [{
                                         "__typename": "TextMessageOutput",
                                         "id": f"run--{uuid.uuid4()}",
-                                        "createdAt": "2025-11-19T16:00:00.000Z",
+                                        "createdAt": iso_timestamp(),
                                         "role": "assistant",
                                         "parentMessageId": None,
                                         "content": []
@@ -186,27 +248,26 @@ async def copilotkit_stream(request: Request):
                                     "path": ["generateCopilotResponse", "messages", message_idx]
                                 }],
                                 "hasNext": True
-                            }) + "\n"
+                            })
                         
                         # Stream content word by word
-                        content = ai_message.content if hasattr(ai_message, 'content') else str(ai_message)
-                        words = content.split()
-                        
                         for i, word in enumerate(words):
                             content_part = word if i == 0 else f" {word}"
                             content_parts.append(content_part)
                             
-                            yield json.dumps({
+                            yield encode_frame({
                                 "incremental": [{
                                     "items": [content_part],
                                     "path": ["generateCopilotResponse", "messages", message_idx, "content", len(content_parts) - 1]
                                 }],
                                 "hasNext": True
-                            }) + "\n"
+                            })
             
+            await hold_paused_run(graph, thread_id, paused)
+
             # Mark message complete
             if content_parts:
-                yield json.dumps({
+                yield encode_frame({
                     "incremental": [{
                         "data": {
                             "__typename": "TextMessageOutput",
@@ -218,41 +279,47 @@ async def copilotkit_stream(request: Request):
                         "path": ["generateCopilotResponse", "messages", message_idx]
                     }],
                     "hasNext": True
-                }) + "\n"
+                })
+            
+            # Frontend tool calls: the frontend runs them and sends each result back as a
+            # resultMessage whose actionExecutionId is the tool-call id (see hot_runs.py)
+            for call in tool_calls:
+                message_idx += 1
+                yield encode_frame(action_execution_payload(call, message_idx))
             
             # Final agent state
             message_idx += 1
             full_message = "".join(content_parts)
             user_content = lc_messages[-1].content if lc_messages else ""
             
-            yield json.dumps({
+            yield encode_frame({
                 "incremental": [{
                     "items": [{
                         "__typename": "AgentStateMessageOutput",
                         "id": f"ck-{uuid.uuid4()}",
-                        "createdAt": "2025-11-19T16:00:00.000Z",
+                        "createdAt": iso_timestamp(),
                         "threadId": thread_id,
                         "state": json.dumps({
-                            "tools": tools,
+                            **snapshot_tools(tools, tools_hash),
                             "messages": [
                                 {"role": "user", "content": user_content},
                                 {"role": "assistant", "content": full_message}
                             ]
                         }),
                         "running": True,
-                        "agentName": "agentic_chat",
+                        "agentName": agent_name,
                         "nodeName": "chat_node",
-                        "runId": str(uuid.uuid4()),
+                        "runId": run_id,
                         "active": False,
                         "role": "assistant"
                     }],
                     "path": ["generateCopilotResponse", "messages", message_idx]
                 }],
                 "hasNext": True
-            }) + "\n"
+            })
             
             # Success
-            yield json.dumps({
+            yield encode_frame({
                 "incremental": [{
                     "data": {
                         "__typename": "CopilotResponse",
@@ -264,11 +331,11 @@ async def copilotkit_stream(request: Request):
                     "path": ["generateCopilotResponse"]
                 }],
                 "hasNext": False
-            }) + "\n"
+            })
             
         except Exception as e:
             # Error
-            yield json.dumps({
+            yield encode_frame({
                 "incremental": [{
                     "data": {
                         "__typename": "CopilotResponse",
@@ -281,22 +348,22 @@ async def copilotkit_stream(request: Request):
                     "path": ["generateCopilotResponse"]
                 }],
                 "hasNext": False
-            }) + "\n"
+            })
     
-    return StreamingResponse(
-        generate_ndjson_stream(),
-        media_type="application/x-ndjson"
-    )
+    # Streamed by this response, or by a scheduled run in background mode (see run_scheduler.py);
+    # keep-alive frames during long model/tool waits so proxies don't buffer or time out
+    return await run_response(request, run_id, generate_ndjson_stream, encode_frame(KEEPALIVE_PAYLOAD), "application/x-ndjson", thread_id=thread_id)
+
+@app.get("/copilotkit/runs/{run_id}/frames")
+async def resume_run(run_id: str, request: Request, after: Optional[int] = None):
+    """
+    Resume a run's stream after a dropped connection: the frames after frame
+    `after` (or the Last-Event-ID header), then the live tail (see stream_buffer.py).
+    """
+    return await resume_response(*resume_position(request, run_id, after), encode_frame(KEEPALIVE_PAYLOAD), "application/x-ndjson")
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    port = int(os.getenv("PORT", 3006))
-    uvicorn.run(
-        "server_ndjson:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,
-        log_level="info"
-    )
+    from serving import serve
+
+    serve(app, "server_ndjson:app", int(os.getenv("PORT", 3006)), reload=True)
 
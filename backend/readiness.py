@@ -0,0 +1,201 @@
+"""
+Capacity-aware readiness for load balancers: GET /ready.
+
+/health only says the process is up. /ready reports whether this worker should
+get more traffic, from live signals:
+- runs in flight (streamed runs, background runs executing and queued) against
+  READY_MAX_IN_FLIGHT
+- event loop lag, smoothed (watchdog.py), against READY_MAX_LOOP_LAG_MS
+- mean checkpointer operation latency over the window, against READY_MAX_CHECKPOINT_MS
+- upstream model error rate over the window (errors, rate limits, missed
+  first-token deadlines per model call attempt), against READY_MAX_UPSTREAM_ERROR_RATE;
+  only once the window holds READY_MIN_UPSTREAM_CALLS calls
+
+Each signal is a load ratio (value / threshold). The worker answers 503 once a
+ratio reaches 1 and 200 again when every ratio is back under 0.8 (no flapping at
+the threshold). The capacity score, 1 - the highest ratio (0 when not ready), is
+in the body, the X-Capacity-Score header and the `ready_capacity_score` gauge, for
+weighted balancing.
+
+Settings:
+- READY_MAX_IN_FLIGHT (default 256)
+- READY_MAX_LOOP_LAG_MS (default 250)
+- READY_MAX_CHECKPOINT_MS (default 500)
+- READY_MAX_UPSTREAM_ERROR_RATE (default 0.25)
+- READY_MIN_UPSTREAM_CALLS (default 10)
+- READY_WINDOW_S: window of the checkpointer and upstream signals (default 30)
+"""
+
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import metrics
+
+READY_MAX_IN_FLIGHT = int(os.getenv("READY_MAX_IN_FLIGHT", "256"))
+READY_MAX_LOOP_LAG_MS = float(os.getenv("READY_MAX_LOOP_LAG_MS", "250"))
+READY_MAX_CHECKPOINT_MS = float(os.getenv("READY_MAX_CHECKPOINT_MS", "500"))
+READY_MAX_UPSTREAM_ERROR_RATE = float(os.getenv("READY_MAX_UPSTREAM_ERROR_RATE", "0.25"))
+READY_MIN_UPSTREAM_CALLS = int(os.getenv("READY_MIN_UPSTREAM_CALLS", "10"))
+READY_WINDOW_S = int(os.getenv("READY_WINDOW_S", "30"))
+
+# Back to ready only when every load ratio is under this
+_RECOVER_RATIO = 0.8
+
+runs_in_flight = metrics.gauge("ready_runs_in_flight", "Graph runs (or SDK requests) in progress")
+capacity_score = metrics.gauge("ready_capacity_score", "Spare capacity reported by /ready (0 = not ready, 1 = idle)")
+not_ready = metrics.counter("ready_not_ready_total", "Transitions to not ready, by limiting signal")
+# Registered by run_scheduler; looked up here so the scheduler can depend on this module
+_runs_queued = metrics.gauge("scheduler_runs_queued", "Background runs waiting for a worker")
+
+
+class RollingWindow:
+    """Count, sum and errors of observations over the last `seconds`, in one-second buckets."""
+
+    def __init__(self, seconds: int = READY_WINDOW_S):
+        self.seconds = max(1, seconds)
+        # [second, count, sum, errors] per slot
+        self._slots = [[0, 0, 0.0, 0] for _ in range(self.seconds)]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float = 0.0, error: bool = False):
+        now = int(time.monotonic())
+        with self._lock:
+            slot = self._slots[now % self.seconds]
+            if slot[0] != now:
+                slot[:] = [now, 0, 0.0, 0]
+            slot[1] += 1
+            slot[2] += value
+            slot[3] += error
+
+    def totals(self) -> Dict[str, float]:
+        oldest = int(time.monotonic()) - self.seconds
+        count, total, errors = 0, 0.0, 0
+        with self._lock:
+            for second, slot_count, slot_sum, slot_errors in self._slots:
+                if second > oldest:
+                    count += slot_count
+                    total += slot_sum
+                    errors += slot_errors
+        return {"count": count, "sum": total, "errors": errors}
+
+
+checkpoint_latency = RollingWindow()
+upstream_calls = RollingWindow()
+
+
+class _State:
+    in_flight = 0
+    ready = True
+
+
+_state = _State()
+
+
+async def track_run(frames: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Count a run as in flight while its frames are produced."""
+    _state.in_flight += 1
+    runs_in_flight.set(_state.in_flight)
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        _state.in_flight -= 1
+        runs_in_flight.set(_state.in_flight)
+
+
+class InFlightRequestsMiddleware:
+    """
+    ASGI middleware counting requests under `prefix` as runs in flight, for servers
+    whose runs are not started through run_scheduler.run_response (the CopilotKit SDK).
+    """
+
+    def __init__(self, app, prefix: str):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        _state.in_flight += 1
+        runs_in_flight.set(_state.in_flight)
+        try:
+            # Returns once the (streamed) response has been sent
+            await self.app(scope, receive, send)
+        finally:
+            _state.in_flight -= 1
+            runs_in_flight.set(_state.in_flight)
+
+
+def capacity() -> Dict[str, Any]:
+    """Evaluate every signal; the /ready body."""
+    # Imported here: watchdog imports asyncio, kept out of agent's import time
+    from watchdog import watchdog
+
+    queued = int(_runs_queued.value())
+    loop_lag_ms = watchdog.smoothed_lag * 1000
+    checkpoints = checkpoint_latency.totals()
+    checkpoint_ms = checkpoints["sum"] / checkpoints["count"] * 1000 if checkpoints["count"] else 0.0
+    upstream = upstream_calls.totals()
+    error_rate = upstream["errors"] / upstream["count"] if upstream["count"] else 0.0
+
+    ratios = {
+        "inFlight": (_state.in_flight + queued) / max(READY_MAX_IN_FLIGHT, 1),
+        "loopLag": loop_lag_ms / READY_MAX_LOOP_LAG_MS if READY_MAX_LOOP_LAG_MS > 0 else 0.0,
+        "checkpointLatency": checkpoint_ms / READY_MAX_CHECKPOINT_MS if READY_MAX_CHECKPOINT_MS > 0 else 0.0,
+        "upstreamErrors": (
+            error_rate / READY_MAX_UPSTREAM_ERROR_RATE
+            if READY_MAX_UPSTREAM_ERROR_RATE > 0 and upstream["count"] >= READY_MIN_UPSTREAM_CALLS
+            else 0.0
+        ),
+    }
+    highest = max(ratios, key=ratios.get)
+    if _state.ready and ratios[highest] >= 1.0:
+        _state.ready = False
+        not_ready.inc(labels={"signal": highest})
+        print(f"Not ready: {highest} at {ratios[highest]:.0%} of its limit")
+    elif not _state.ready and ratios[highest] < _RECOVER_RATIO:
+        _state.ready = True
+
+    ready = _state.ready
+    score = round(max(0.0, 1.0 - ratios[highest]), 3) if ready else 0.0
+    capacity_score.set(score)
+    return {
+        "status": "ready" if ready else "not_ready",
+        "ready": ready,
+        "score": score,
+        "limitedBy": highest if ratios[highest] > 0 else None,
+        "signals": {
+            "inFlight": {"value": _state.in_flight, "queued": queued, "limit": READY_MAX_IN_FLIGHT},
+            "loopLagMs": {"value": round(loop_lag_ms, 2), "limit": READY_MAX_LOOP_LAG_MS},
+            "checkpointMs": {"value": round(checkpoint_ms, 2), "operations": checkpoints["count"], "limit": READY_MAX_CHECKPOINT_MS},
+            "upstreamErrorRate": {
+                "value": round(error_rate, 3), "calls": upstream["count"], "errors": upstream["errors"],
+                "limit": READY_MAX_UPSTREAM_ERROR_RATE, "minCalls": READY_MIN_UPSTREAM_CALLS,
+            },
+        },
+        "ratios": {name: round(ratio, 3) for name, ratio in ratios.items()},
+        "windowS": READY_WINDOW_S,
+    }
+
+
+def add_readiness(app, path: str = "/ready", count_requests_under: Optional[str] = None):
+    """
+    Register the readiness endpoint. With `count_requests_under`, requests under
+    that path prefix count as runs in flight.
+    """
+    from fastapi.responses import JSONResponse
+
+    async def ready_endpoint():
+        report = capacity()
+        return JSONResponse(
+            content=report,
+            status_code=200 if report["ready"] else 503,
+            headers={"X-Capacity-Score": str(report["score"]), "Cache-Control": "no-store"},
+        )
+
+    if count_requests_under:
+        app.add_middleware(InFlightRequestsMiddleware, prefix=count_requests_under)
+    app.add_api_route(path, ready_endpoint, methods=["GET"], include_in_schema=False)
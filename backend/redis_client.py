@@ -0,0 +1,171 @@
+"""
+Shared async Redis client for the thread-state cache and the stream buffer.
+
+REDIS_URI selects the backend:
+- unset/empty (default): Redis features are off
+- "redis://host:port/db": redis.asyncio (the `redis` package), e.g. the
+  langgraph-redis service from docker-compose.yml at redis://localhost:6380
+- "memory://": InProcessRedis, a single-process stand-in with the same subset of
+  commands, for tests and single-worker runs without a Redis server
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+REDIS_URI = os.getenv("REDIS_URI", "")
+
+_client = None
+
+
+def _stream_id(entry_id: Any) -> Tuple[int, int]:
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode("ascii")
+    ms, _, seq = str(entry_id).partition("-")
+    return int(ms), int(seq or 0)
+
+
+class InProcessRedis:
+    """
+    In-process stand-in for the Redis commands used here (strings with expiry,
+    capped streams with blocking reads). Values are bytes, like redis-py's.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._streams: Dict[str, List[Tuple[Tuple[int, int], Dict[bytes, bytes]]]] = {}
+        self._expiry: Dict[str, float] = {}
+        self._changed = None
+
+    def _condition(self):
+        import asyncio
+
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def _expired(self, name: str) -> bool:
+        deadline = self._expiry.get(name)
+        if deadline is not None and deadline <= time.monotonic():
+            self._values.pop(name, None)
+            self._streams.pop(name, None)
+            self._expiry.pop(name, None)
+            return True
+        return False
+
+    @staticmethod
+    def _bytes(value: Any) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+    async def get(self, name: str) -> Optional[bytes]:
+        if self._expired(name) or name not in self._values:
+            return None
+        return self._values[name][0]
+
+    async def set(self, name: str, value: Any, ex: Optional[float] = None):
+        self._values[name] = (self._bytes(value), None)
+        if ex:
+            self._expiry[name] = time.monotonic() + ex
+        else:
+            self._expiry.pop(name, None)
+        return True
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        value = int(await self.get(name) or 0) + amount
+        deadline = self._expiry.get(name)
+        self._values[name] = (str(value).encode("ascii"), None)
+        if deadline is not None:
+            self._expiry[name] = deadline
+        return value
+
+    async def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._values.pop(name, None) is not None or self._streams.pop(name, None) is not None:
+                deleted += 1
+            self._expiry.pop(name, None)
+        return deleted
+
+    async def expire(self, name: str, seconds: float) -> bool:
+        if name not in self._values and name not in self._streams:
+            return False
+        self._expiry[name] = time.monotonic() + seconds
+        return True
+
+    async def xadd(self, name: str, fields: Dict[Any, Any], id: str = "*", maxlen: Optional[int] = None, approximate: bool = True) -> bytes:
+        self._expired(name)
+        entries = self._streams.setdefault(name, [])
+        if id == "*":
+            last = entries[-1][0] if entries else (0, 0)
+            now_ms = int(time.time() * 1000)
+            entry_id = (now_ms, 0) if now_ms > last[0] else (last[0], last[1] + 1)
+        else:
+            entry_id = _stream_id(id)
+            if entries and entry_id <= entries[-1][0]:
+                raise ValueError("ERR The ID specified in XADD is equal or smaller than the target stream top item")
+        entries.append((entry_id, {self._bytes(k): self._bytes(v) for k, v in fields.items()}))
+        if maxlen is not None and len(entries) > maxlen:
+            del entries[: len(entries) - maxlen]
+        condition = self._condition()
+        async with condition:
+            condition.notify_all()
+        return f"{entry_id[0]}-{entry_id[1]}".encode("ascii")
+
+    def _after(self, name: str, last_id: Any, count: Optional[int]):
+        self._expired(name)
+        start = _stream_id(last_id)
+        found = [
+            (f"{entry_id[0]}-{entry_id[1]}".encode("ascii"), fields)
+            for entry_id, fields in self._streams.get(name, [])
+            if entry_id > start
+        ]
+        return found[:count] if count else found
+
+    async def xrange(self, name: str, min: str = "-", max: str = "+", count: Optional[int] = None):
+        self._expired(name)
+        low = (0, 0) if min == "-" else _stream_id(min)
+        high = None if max == "+" else _stream_id(max)
+        found = [
+            (f"{entry_id[0]}-{entry_id[1]}".encode("ascii"), fields)
+            for entry_id, fields in self._streams.get(name, [])
+            if entry_id >= low and (high is None or entry_id <= high)
+        ]
+        return found[:count] if count else found
+
+    async def xread(self, streams: Dict[str, Any], count: Optional[int] = None, block: Optional[int] = None):
+        import asyncio
+
+        deadline = time.monotonic() + block / 1000 if block else None
+        condition = self._condition()
+        while True:
+            result = []
+            for name, last_id in streams.items():
+                entries = self._after(name, last_id, count)
+                if entries:
+                    result.append([name.encode("utf-8"), entries])
+            if result or block is None:
+                return result
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return []
+            async with condition:
+                try:
+                    await asyncio.wait_for(condition.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return []
+
+    async def close(self):
+        pass
+
+
+def get_redis():
+    """The shared client for REDIS_URI, or None when Redis is not configured."""
+    global _client
+    if _client is None and REDIS_URI:
+        if REDIS_URI.startswith("memory://"):
+            _client = InProcessRedis()
+        else:
+            import redis.asyncio as redis
+
+            _client = redis.from_url(REDIS_URI)
+    return _client
@@ -0,0 +1,260 @@
+"""
+Bounded, incremental parsing of CopilotKit GraphQL request bodies.
+
+`await request.json()` buffers the whole body and turns every message of a long
+thread into Python dicts before a handler even looks at it. `read_copilot_body`
+instead:
+- streams the body and rejects it as soon as it exceeds MAX_REQUEST_BODY_BYTES
+- decodes every field eagerly except `variables.data.messages`, which is exposed
+  as a `LazyJSONArray`: only the byte offsets of each message are recorded and a
+  message is decoded when the handler accesses it
+
+Handlers that only need the tail (the last user message, or the messages added
+since the checkpointed state) therefore never materialize the rest of the thread.
+"""
+
+import json
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from session_recording import record_request_body
+
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(8 * 1024 * 1024)))
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb"[^,\]}\s]+")
+
+
+class RequestBodyError(ValueError):
+    """The request body is missing, malformed or too large."""
+
+    status_code = 400
+
+
+class RequestBodyTooLarge(RequestBodyError):
+    status_code = 413
+
+
+async def read_body_limited(request, max_bytes: int = MAX_REQUEST_BODY_BYTES) -> bytes:
+    """Read the request body, failing fast once it grows past `max_bytes`."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise RequestBodyTooLarge(f"Request body too large: {content_length} bytes (limit {max_bytes})")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            raise RequestBodyTooLarge(f"Request body too large: more than {max_bytes} bytes")
+    return bytes(body)
+
+
+def _skip_whitespace(buf: bytes, pos: int) -> int:
+    return _WHITESPACE.match(buf, pos).end()
+
+
+def _value_end(buf: bytes, pos: int) -> int:
+    """Return the index just past the JSON value starting at `pos`, without decoding it."""
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        match = _STRING.match(buf, pos)
+        if not match:
+            raise RequestBodyError(f"Invalid JSON: unterminated string at offset {pos}")
+        return match.end()
+
+    if first in (b"{", b"["):
+        depth = 0
+        while True:
+            match = _STRUCTURAL.search(buf, pos)
+            if not match:
+                raise RequestBodyError("Invalid JSON: unterminated object or array")
+            char = match.group()
+            if char == b'"':
+                string = _STRING.match(buf, match.start())
+                if not string:
+                    raise RequestBodyError(f"Invalid JSON: unterminated string at offset {match.start()}")
+                pos = string.end()
+                continue
+            pos = match.end()
+            depth += 1 if char in (b"{", b"[") else -1
+            if depth == 0:
+                return pos
+
+    match = _SCALAR.match(buf, pos)
+    if not match:
+        raise RequestBodyError(f"Invalid JSON: unexpected character at offset {pos}")
+    return match.end()
+
+
+def _iter_object(buf: bytes, pos: int) -> Iterator[Tuple[str, int, int]]:
+    """Yield (key, value_start, value_end) for the JSON object starting at `pos`."""
+    if buf[pos:pos + 1] != b"{":
+        raise RequestBodyError(f"Invalid JSON: expected object at offset {pos}")
+    pos = _skip_whitespace(buf, pos + 1)
+    if buf[pos:pos + 1] == b"}":
+        return
+
+    while True:
+        key_match = _STRING.match(buf, pos)
+        if not key_match:
+            raise RequestBodyError(f"Invalid JSON: expected key at offset {pos}")
+        key = json.loads(key_match.group())
+        pos = _skip_whitespace(buf, key_match.end())
+        if buf[pos:pos + 1] != b":":
+            raise RequestBodyError(f"Invalid JSON: expected ':' at offset {pos}")
+        start = _skip_whitespace(buf, pos + 1)
+        end = _value_end(buf, start)
+        yield key, start, end
+
+        pos = _skip_whitespace(buf, end)
+        separator = buf[pos:pos + 1]
+        if separator == b"}":
+            return
+        if separator != b",":
+            raise RequestBodyError(f"Invalid JSON: expected ',' or '}}' at offset {pos}")
+        pos = _skip_whitespace(buf, pos + 1)
+
+
+def _array_spans(buf: bytes, pos: int) -> array:
+    """Return the flattened (start, end) offsets of every element of the array at `pos`."""
+    if buf[pos:pos + 1] != b"[":
+        raise RequestBodyError(f"Invalid JSON: expected array at offset {pos}")
+    spans = array("q")
+    pos = _skip_whitespace(buf, pos + 1)
+    if buf[pos:pos + 1] == b"]":
+        return spans
+
+    while True:
+        end = _value_end(buf, pos)
+        spans.append(pos)
+        spans.append(end)
+        pos = _skip_whitespace(buf, end)
+        separator = buf[pos:pos + 1]
+        if separator == b"]":
+            return spans
+        if separator != b",":
+            raise RequestBodyError(f"Invalid JSON: expected ',' or ']' at offset {pos}")
+        pos = _skip_whitespace(buf, pos + 1)
+
+
+def _decode(buf: bytes, start: int, end: int) -> Any:
+    try:
+        return json.loads(buf[start:end])
+    except ValueError as e:
+        raise RequestBodyError(f"Invalid JSON: {e}") from e
+
+
+class LazyJSONArray(Sequence):
+    """
+    Read-only sequence over a JSON array inside a raw request body.
+    Elements are decoded on access; nothing is cached, so walking the tail of a
+    long array keeps memory proportional to the elements actually used.
+    """
+
+    __slots__ = ("_buf", "_spans")
+
+    def __init__(self, buf: bytes, spans: array):
+        self._buf = buf
+        self._spans = spans
+
+    def __len__(self) -> int:
+        return len(self._spans) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("LazyJSONArray index out of range")
+        return _decode(self._buf, self._spans[2 * index], self._spans[2 * index + 1])
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self[index]
+
+    def __repr__(self) -> str:
+        return f"LazyJSONArray(len={len(self)})"
+
+
+def parse_copilot_body(raw: bytes) -> Dict[str, Any]:
+    """
+    Parse a GraphQL request body into the same structure as `json.loads`, except
+    that `variables.data.messages` is a LazyJSONArray.
+    """
+    buf = raw
+    start = _skip_whitespace(buf, 0)
+    if start == len(buf):
+        raise RequestBodyError("Empty request body")
+    if buf[start:start + 1] != b"{":
+        # Not an object: nothing to be lazy about
+        return _decode(buf, start, len(buf))
+    end = _value_end(buf, start)
+    if _skip_whitespace(buf, end) != len(buf):
+        raise RequestBodyError(f"Invalid JSON: extra data at offset {end}")
+
+    body = {}
+    for key, value_start, value_end in _iter_object(buf, start):
+        if key == "variables" and buf[value_start:value_start + 1] == b"{":
+            body[key] = _parse_variables(buf, value_start)
+        else:
+            body[key] = _decode(buf, value_start, value_end)
+    return body
+
+
+def _parse_variables(buf: bytes, pos: int) -> Dict[str, Any]:
+    variables = {}
+    for key, start, end in _iter_object(buf, pos):
+        if key == "data" and buf[start:start + 1] == b"{":
+            data = {}
+            for data_key, data_start, data_end in _iter_object(buf, start):
+                if data_key == "messages" and buf[data_start:data_start + 1] == b"[":
+                    data[data_key] = LazyJSONArray(buf, _array_spans(buf, data_start))
+                else:
+                    data[data_key] = _decode(buf, data_start, data_end)
+            variables[key] = data
+        else:
+            variables[key] = _decode(buf, start, end)
+    return variables
+
+
+async def read_copilot_body(request, max_bytes: int = MAX_REQUEST_BODY_BYTES) -> Dict[str, Any]:
+    """Read and parse a CopilotKit GraphQL request body (see module docstring)."""
+    raw = await read_body_limited(request, max_bytes)
+    body = parse_copilot_body(raw)
+    record_request_body(raw, body)
+    return body
+
+
+def is_message_list(messages: Any) -> bool:
+    return isinstance(messages, (list, LazyJSONArray))
+
+
+def messages_since_last_assistant(messages: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Return the messages added after the last assistant message (the delta of a turn).
+    Walks the sequence backwards, so only the tail is decoded.
+    """
+    tail = []
+    for msg in reversed(messages):
+        text_msg = msg.get("textMessage") if isinstance(msg, dict) else None
+        if isinstance(text_msg, dict) and text_msg.get("role") == "assistant":
+            break
+        tail.append(msg)
+    tail.reverse()
+    return tail
+
+
+def select_new_messages(messages: Sequence[Dict[str, Any]], has_checkpoint: bool) -> Sequence[Dict[str, Any]]:
+    """
+    Delta sync: when the thread already has checkpointed state the graph only
+    needs the messages added since the last assistant reply; otherwise it needs
+    the whole history.
+    """
+    if has_checkpoint:
+        return messages_since_last_assistant(messages)
+    return messages
@@ -0,0 +1,309 @@
+"""
+Background run mode: graph runs execute on an in-process scheduler instead of
+inside the streaming response.
+
+In background mode a generateCopilotResponse request enqueues its run and the
+response only subscribes to the run's frames in the stream buffer (see
+stream_buffer.py). Runs execute on at most RUN_WORKERS workers, whatever the
+number of connected clients and however slowly they read, and the run's
+lifetime is independent of any connection:
+- fire-and-forget: `X-Run-Mode: detached` returns 202 with the run id and status
+  right away; the frames can be fetched later
+- any number of subscribers per run: GET /copilotkit/runs/{runId}/frames
+- GET /copilotkit/runs/{runId}: status (queued, running, succeeded, failed,
+  cancelled), timings and queue position
+- POST /copilotkit/runs/{runId}/cancel: drops a queued run or cancels a running one
+
+Queued runs start in priority order (X-Run-Priority: "high", "normal", "low" or
+an integer, lower first; FIFO within a priority).
+
+Run ids key the stream buffer, so the servers always generate them; submitting an
+id the scheduler already holds is refused (DuplicateRun, 409).
+
+Settings:
+- RUN_MODE: "stream" (default: the run is driven by the response, as before) or
+  "background"; the X-Run-Mode request header overrides it per request
+  ("stream", "background" or "detached")
+- RUN_WORKERS: runs executing at once (default 32)
+- RUN_MAX_QUEUED: queued runs before new ones get 503 (default 1000)
+
+Background runs are read from the stream buffer, so with STREAM_BUFFER=off every
+request is streamed.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import metrics
+from lifespan import on_shutdown
+from readiness import track_run
+from stream_buffer import buffered, get_store, open_run, read_frames, record
+from stream_frames import STREAMING_HEADERS, with_keepalive
+
+RUN_MODE = os.getenv("RUN_MODE", "stream").lower()
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", "32"))
+RUN_MAX_QUEUED = int(os.getenv("RUN_MAX_QUEUED", "1000"))
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Finished runs whose status is kept for the status endpoint
+_RUN_HISTORY = 10000
+
+runs_queued = metrics.gauge("scheduler_runs_queued", "Background runs waiting for a worker")
+runs_running = metrics.gauge("scheduler_runs_running", "Background runs executing")
+runs_finished = metrics.counter("scheduler_runs_total", "Background runs finished, by status")
+queue_wait = metrics.histogram(
+    "scheduler_queue_wait_seconds", "Time background runs waited for a worker",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class RunQueueFull(Exception):
+    """The scheduler already holds RUN_MAX_QUEUED queued runs."""
+
+    status_code = 503
+
+
+class DuplicateRun(Exception):
+    """A run with this id was already submitted."""
+
+    status_code = 409
+
+
+class Run:
+    """One background run: its frame source and lifecycle."""
+
+    def __init__(self, run_id: str, frames: Callable[[], AsyncIterator[Any]], priority: int, thread_id: Optional[str]):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.priority = priority
+        self.frames = frames
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.frame_count = 0
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.order = 0
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+        # The submitting request's context (e.g. its trace span), for the run's task
+        self.context = contextvars.copy_context()
+        # Set once the run started or was dropped; subscribers wait for it
+        self.started = asyncio.Event()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "runId": self.run_id,
+            "threadId": self.thread_id,
+            "status": self.status,
+            "priority": self.priority,
+            "frames": self.frame_count,
+            "error": self.error,
+            "queuedAt": self.queued_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class RunScheduler:
+    """Priority queue of runs executed by a fixed pool of worker tasks."""
+
+    def __init__(self, workers: int = RUN_WORKERS, max_queued: int = RUN_MAX_QUEUED):
+        self.worker_count = max(1, workers)
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._order = itertools.count()
+        self._runs: "OrderedDict[str, Run]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+
+    def _start(self):
+        # Created on first use, on the serving event loop
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            loop = asyncio.get_running_loop()
+            self._workers = [loop.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def submit(self, run_id: str, frames: Callable[[], AsyncIterator[Any]], priority: int = PRIORITIES["normal"], thread_id: Optional[str] = None) -> Run:
+        """Queue a run; `frames()` creates its frame generator when a worker picks it up."""
+        self._start()
+        if run_id in self._runs:
+            raise DuplicateRun(f"Run {run_id} already exists")
+        if self._queued >= self.max_queued:
+            raise RunQueueFull(f"{self._queued} runs already queued")
+        run = Run(run_id, frames, priority, thread_id)
+        run.order = next(self._order)
+        self._runs[run_id] = run
+        while len(self._runs) > _RUN_HISTORY:
+            oldest = next(iter(self._runs.values()))
+            if oldest.finished_at is None:
+                break
+            self._runs.popitem(last=False)
+        await open_run(run_id)
+        self._queue.put_nowait((priority, run.order, run))
+        self._queued += 1
+        runs_queued.set(self._queued)
+        return run
+
+    def get(self, run_id: str) -> Optional[Run]:
+        return self._runs.get(run_id)
+
+    def queue_position(self, run: Run) -> Optional[int]:
+        if run.status != "queued":
+            return None
+        key = (run.priority, run.order)
+        return sum(1 for other in self._runs.values() if other.status == "queued" and (other.priority, other.order) < key)
+
+    async def cancel(self, run_id: str) -> Optional[Run]:
+        """Cancel a queued or running run; returns it, or None for an unknown run."""
+        run = self._runs.get(run_id)
+        if run is None:
+            return None
+        if run.status == "queued":
+            # Stays in the heap until a worker pops and skips it
+            self._queued -= 1
+            runs_queued.set(self._queued)
+            self._finish(run, "cancelled")
+            await record(run_id, _no_frames())
+        elif run.status == "running" and run.task is not None:
+            run.cancel_requested = True
+            run.task.cancel()
+        return run
+
+    def _finish(self, run: Run, status: str, error: Optional[str] = None):
+        run.status = status
+        run.error = error
+        run.finished_at = time.time()
+        run.started.set()
+        runs_finished.inc(labels={"status": status})
+
+    async def _work(self):
+        while True:
+            _, _, run = await self._queue.get()
+            if run.status != "queued":
+                continue
+            self._queued -= 1
+            self._running += 1
+            runs_queued.set(self._queued)
+            runs_running.set(self._running)
+            run.status = "running"
+            run.started_at = time.time()
+            queue_wait.observe(run.started_at - run.queued_at)
+            run.started.set()
+            # Its own task, so cancelling the run leaves the worker running
+            run.task = run.context.run(asyncio.get_running_loop().create_task, record(run.run_id, track_run(run.frames())))
+            try:
+                run.frame_count = await run.task
+                self._finish(run, "succeeded")
+            except asyncio.CancelledError:
+                self._finish(run, "cancelled")
+                if not run.cancel_requested:
+                    # The worker itself is being stopped
+                    raise
+            except Exception as e:
+                self._finish(run, "failed", f"{type(e).__name__}: {e}")
+            finally:
+                run.task = None
+                self._running -= 1
+                runs_running.set(self._running)
+
+    async def stop(self):
+        """Cancel the workers and every queued or running run (shutdown hook)."""
+        for worker in self._workers:
+            # Also cancels the run the worker is awaiting
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        for run in self._runs.values():
+            if run.status == "queued":
+                self._finish(run, "cancelled")
+        self._queued = 0
+        runs_queued.set(0)
+
+
+async def _no_frames():
+    return
+    yield
+
+
+scheduler = RunScheduler()
+
+
+def run_priority(value: Optional[str]) -> int:
+    if not value:
+        return PRIORITIES["normal"]
+    value = value.strip().lower()
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+    try:
+        return int(value)
+    except ValueError:
+        return PRIORITIES["normal"]
+
+
+async def subscribe(run: Run, after: int = 0, keepalive: Any = None) -> AsyncIterator[Any]:
+    """The run's frames after `after` once it has started, then its live tail (see read_frames)."""
+    await run.started.wait()
+    async for frame in read_frames(run.run_id, after, keepalive):
+        yield frame
+
+
+async def run_response(request, run_id: str, frames: Callable[[], AsyncIterator[Any]], keepalive: Any, media_type: str, thread_id: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+    """
+    The response for a generateCopilotResponse request in the requested run mode:
+    streamed from the response itself ("stream"), streamed from a scheduled run
+    ("background"), or 202 with the scheduled run's status ("detached").
+    """
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    headers = {**(headers or STREAMING_HEADERS), "X-Run-Id": run_id}
+    request_headers = request.headers if request is not None else {}
+    mode = (request_headers.get("x-run-mode") or RUN_MODE).lower()
+    # Subscribers read the stream buffer, so background runs need it (STREAM_BUFFER=on)
+    if mode not in ("background", "detached") or get_store() is None:
+        return StreamingResponse(
+            with_keepalive(buffered(run_id, track_run(frames()), keepalive=keepalive), keepalive),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    try:
+        run = await scheduler.submit(run_id, frames, run_priority(request_headers.get("x-run-priority")), thread_id)
+    except RunQueueFull as e:
+        return JSONResponse(content={"errors": [{"message": str(e)}]}, status_code=e.status_code, headers={"Retry-After": "1"})
+    except DuplicateRun as e:
+        return JSONResponse(content={"errors": [{"message": str(e)}]}, status_code=e.status_code)
+    if mode == "detached":
+        return JSONResponse(content=run.describe(), status_code=202, headers={"X-Run-Id": run_id})
+    return StreamingResponse(
+        with_keepalive(subscribe(run, keepalive=keepalive), keepalive),
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def add_run_endpoints(app, prefix: str = "/copilotkit/runs"):
+    """Register the run status and cancel endpoints, and stop the scheduler on shutdown."""
+    from fastapi.responses import JSONResponse
+
+    async def run_status(run_id: str):
+        run = scheduler.get(run_id)
+        if run is None:
+            return JSONResponse(content={"errors": [{"message": f"Unknown run: {run_id}"}]}, status_code=404)
+        return {**run.describe(), "queuePosition": scheduler.queue_position(run)}
+
+    async def cancel_run(run_id: str):
+        run = await scheduler.cancel(run_id)
+        if run is None:
+            return JSONResponse(content={"errors": [{"message": f"Unknown run: {run_id}"}]}, status_code=404)
+        return JSONResponse(content=run.describe(), status_code=202)
+
+    app.add_api_route(prefix + "/{run_id}", run_status, methods=["GET"])
+    app.add_api_route(prefix + "/{run_id}/cancel", cancel_run, methods=["POST"])
+    on_shutdown(app, scheduler.stop)
@@ -1,28 +1,44 @@
 """
 FastAPI server using CopilotKit Python SDK for LangGraph runtime.
 This uses the official CopilotKit SDK which handles GraphQL formatting automatically.
+
+The SDK, the agent graph and the model client are loaded on first use (in a
+worker thread) or by the background warm-up hook, so the process starts serving as
+soon as FastAPI is up. The SDK keeps its graphs, so they are pinned in the agent
+registry (AGENT_MAX_LOADED / AGENT_MEMORY_LIMIT_MB never unload them here).
 """
 
 import os
-from fastapi import FastAPI
+import threading
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-from agent import agentic_chat_graph
-
-# Import CopilotKit SDK
-try:
-    from copilotkit import LangGraphAGUIAgent, CopilotKitRemoteEndpoint
-    from copilotkit.integrations.fastapi import add_fastapi_endpoint
-    COPILOTKIT_AVAILABLE = True
-except ImportError as e:
-    print(f"ERROR: CopilotKit Python SDK not installed. Install with: pip install copilotkit")
-    print(f"Import error: {e}")
-    COPILOTKIT_AVAILABLE = False
+from agent import load_env, report_warm_up, warm_up
+from agent_registry import add_agent_registry, registry
+from checkpointer import close_checkpointer, open_checkpointer
+from lifespan import lifespan, on_shutdown, on_startup
+from memory_stats import add_memory_stats
+from metrics import add_metrics_endpoint
+from profiler import add_profiler
+from readiness import add_readiness
+from serving import add_send_metrics
+from ws_sessions import add_ws_sessions
+from stream_compression import add_stream_compression
+from watchdog import add_loop_watchdog
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-app = FastAPI(title="CopilotKit LangGraph Runtime")
+app = FastAPI(title="CopilotKit LangGraph Runtime", lifespan=lifespan)
+on_shutdown(app, close_checkpointer)
+add_metrics_endpoint(app)
+add_loop_watchdog(app)
+add_readiness(app, count_requests_under="/copilotkit")
+add_stream_compression(app)
+add_agent_registry(app)
+add_profiler(app)
+add_memory_stats(app)
+add_send_metrics(app)
+add_ws_sessions(app)
 
 # CORS middleware
 app.add_middleware(
@@ -33,47 +49,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_endpoint = None
+_endpoint_lock = threading.Lock()
+
+
+def get_copilotkit_endpoint():
+    """
+    Build the CopilotKit Remote Endpoint on first use, with one agent per graph
+    of the agent registry (the SDK needs them compiled, so all of them are, and it
+    keeps them: they are pinned). Importing the CopilotKit SDK is the most expensive
+    part of startup; blocking, so call it from a worker thread.
+    """
+    global _endpoint
+    if _endpoint is not None:
+        return _endpoint
+
+    with _endpoint_lock:
+        if _endpoint is None:
+            from copilotkit import LangGraphAGUIAgent, CopilotKitRemoteEndpoint
+
+            for name in registry.names():
+                registry.pin(name)
+            # Initialize LangGraph agents using LangGraphAGUIAgent (recommended)
+            langgraph_agents = [
+                LangGraphAGUIAgent(
+                    name=agent["name"],
+                    description=agent["description"],
+                    graph=registry.get_graph(agent["name"]),
+                )
+                for agent in registry.describe()
+            ]
+
+            # Initialize CopilotKit Remote Endpoint (replaces CopilotKitSDK)
+            _endpoint = CopilotKitRemoteEndpoint(agents=langgraph_agents)
+
+            print("✓ CopilotKit SDK initialized successfully")
+            print(f"  Agents: {', '.join(registry.names())}")
+            print("  Endpoint: /copilotkit/langgraph")
+    return _endpoint
+
+
+def _warm_up_copilotkit():
+    warm_up()
+    try:
+        get_copilotkit_endpoint()
+    except Exception as e:
+        print(f"✗ Error initializing CopilotKit SDK: {e}")
+
+
+async def warm_up_on_startup():
+    """
+    Pre-load the SDK, graph and model after the server starts listening.
+    See agent.warm_up_on_startup for the AGENT_WARMUP modes.
+    """
+    import asyncio
+
+    await open_checkpointer()
+    mode = os.getenv("AGENT_WARMUP", "background").lower()
+    if mode == "eager":
+        _warm_up_copilotkit()
+    elif mode != "off":
+        asyncio.get_running_loop().run_in_executor(None, _warm_up_copilotkit).add_done_callback(report_warm_up)
+
+
+on_startup(app, warm_up_on_startup)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {"status": "ok", "message": "CopilotKit LangGraph runtime is running"}
 
-if COPILOTKIT_AVAILABLE:
-    try:
-        # Initialize LangGraph agent using LangGraphAGUIAgent (recommended)
-        langgraph_agent = LangGraphAGUIAgent(
-            name="agentic_chat",
-            description="A simple agentic chat flow using LangGraph",
-            graph=agentic_chat_graph,
-        )
-        
-        # Initialize CopilotKit Remote Endpoint (replaces CopilotKitSDK)
-        endpoint = CopilotKitRemoteEndpoint(agents=[langgraph_agent])
-        
-        # Add CopilotKit endpoint to FastAPI app
-        # This automatically handles GraphQL formatting
-        add_fastapi_endpoint(app, endpoint, "/copilotkit/langgraph")
-        
-        print("✓ CopilotKit SDK initialized successfully")
-        print(f"  Agent name: agentic_chat")
-        print(f"  Endpoint: /copilotkit/langgraph")
-    except Exception as e:
-        print(f"✗ Error initializing CopilotKit SDK: {e}")
-        import traceback
-        traceback.print_exc()
-        COPILOTKIT_AVAILABLE = False
-else:
-    print("✗ CopilotKit SDK not available")
+
+@app.api_route("/copilotkit/langgraph/{path:path}", methods=["GET", "POST"])
+async def copilotkit_endpoint(request: Request):
+    """
+    CopilotKit endpoint, equivalent to add_fastapi_endpoint(app, endpoint, "/copilotkit/langgraph")
+    but resolving the SDK lazily. The SDK handler takes care of GraphQL formatting.
+    """
+    import asyncio
+
+    endpoint = _endpoint
+    if endpoint is None:
+        # Importing the SDK and compiling the graphs blocks; keep the event loop serving
+        endpoint = await asyncio.get_running_loop().run_in_executor(None, get_copilotkit_endpoint)
+    from copilotkit.integrations.fastapi import handler
+
+    return await handler(request, endpoint)
+
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    port = int(os.getenv("PORT", 3006))
-    uvicorn.run(
-        "server_copilotkit:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,
-        log_level="info"
-    )
+    from serving import serve
 
+    serve(app, "server_copilotkit:app", int(os.getenv("PORT", 3006)), reload=True)
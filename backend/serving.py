@@ -0,0 +1,139 @@
+"""
+How the FastAPI servers are served: HTTP/1.1 (uvicorn) or HTTP/2 (hypercorn).
+
+Over HTTP/1.1 every streaming generateCopilotResponse holds a connection, and
+browsers open at most 6 per origin, so a page with several copilot panels queues
+their streams. With SERVER_HTTP=2 the app is served by hypercorn, which speaks
+HTTP/2 and HTTP/1.1 on the same port:
+- with SERVER_TLS_CERTFILE / SERVER_TLS_KEYFILE: h2 over TLS (negotiated with ALPN;
+  browsers only use HTTP/2 over TLS)
+- without: cleartext h2c (prior knowledge or `Upgrade: h2c`), for a TLS-terminating
+  proxy that speaks h2c to the backend, and for benchmarks
+- at most H2_MAX_CONCURRENT_STREAMS streams per connection (default 256)
+
+Flow control: over HTTP/2 many streams share one connection, and each has its own
+flow-control window. Hypercorn only returns from a stream's ASGI `send` once the
+client's window for that stream has taken the data, so a panel that stops reading
+stalls only its own stream. The stall then reaches the run the way a slow HTTP/1.1
+client does: through the writer's bounded queue (stream_frames.with_keepalive) or
+the run's FrameOutbox, which coalesce frames and then fall back to the stream
+buffer. `SendWaitMiddleware` records how long sends wait, by HTTP version
+(`http_send_wait_seconds`, `http_send_blocked_total`, `http_streams_open`).
+
+Settings:
+- SERVER_HTTP: "1.1" (default) or "2" (needs the `http2` extra: hypercorn)
+- SERVER_HOST (default 0.0.0.0), PORT (default 3006)
+- SERVER_TLS_CERTFILE, SERVER_TLS_KEYFILE
+- H2_MAX_CONCURRENT_STREAMS (default 256)
+
+Usage: the servers' `__main__` blocks call `serve`, or
+    SERVER_HTTP=2 python serving.py server_ndjson:app
+"""
+
+import os
+import sys
+import time
+from typing import Any, Optional
+
+import metrics
+
+SERVER_HTTP = os.getenv("SERVER_HTTP", "1.1")
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_TLS_CERTFILE = os.getenv("SERVER_TLS_CERTFILE", "")
+SERVER_TLS_KEYFILE = os.getenv("SERVER_TLS_KEYFILE", "")
+H2_MAX_CONCURRENT_STREAMS = int(os.getenv("H2_MAX_CONCURRENT_STREAMS", "256"))
+
+# A send waiting longer than this was held back by flow control (or a full socket buffer)
+_BLOCKED_SEND_S = 0.05
+SEND_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+send_wait = metrics.histogram(
+    "http_send_wait_seconds", "Time a response body send waited for the client, by HTTP version",
+    buckets=SEND_WAIT_BUCKETS,
+)
+blocked_sends = metrics.counter(
+    "http_send_blocked_total", "Response body sends held back by flow control or a full socket buffer, by HTTP version"
+)
+open_streams = metrics.gauge("http_streams_open", "HTTP requests (HTTP/2 streams) in progress, by HTTP version")
+
+
+class SendWaitMiddleware:
+    """ASGI middleware timing the response body sends of every request, by HTTP version."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        labels = {"http_version": scope.get("http_version", "1.1")}
+
+        async def timed_send(message):
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            start = time.perf_counter()
+            await send(message)
+            waited = time.perf_counter() - start
+            send_wait.observe(waited, labels=labels)
+            if waited > _BLOCKED_SEND_S:
+                blocked_sends.inc(labels=labels)
+
+        open_streams.inc(labels=labels)
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            open_streams.dec(labels=labels)
+
+
+def add_send_metrics(app):
+    """Time response body sends by HTTP version (see SendWaitMiddleware)."""
+    app.add_middleware(SendWaitMiddleware)
+
+
+def hypercorn_config(port: int, host: str = SERVER_HOST) -> Any:
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.h2_max_concurrent_streams = H2_MAX_CONCURRENT_STREAMS
+    config.alpn_protocols = ["h2", "http/1.1"]
+    config.accesslog = None
+    config.loglevel = "INFO"
+    if SERVER_TLS_CERTFILE and SERVER_TLS_KEYFILE:
+        config.certfile = SERVER_TLS_CERTFILE
+        config.keyfile = SERVER_TLS_KEYFILE
+    return config
+
+
+def serve(app: Any, import_string: str, port: Optional[int] = None, reload: bool = False, http: str = SERVER_HTTP):
+    """
+    Serve `app` in the SERVER_HTTP mode. `import_string` ("module:app") is what
+    uvicorn imports (needed for reload); reload is not supported over HTTP/2.
+    """
+    port = port if port is not None else int(os.getenv("PORT", 3006))
+    if http != "2":
+        import uvicorn
+
+        uvicorn.run(import_string if reload else app, host=SERVER_HOST, port=port, reload=reload, log_level="info")
+        return
+
+    import asyncio
+
+    from hypercorn.asyncio import serve as hypercorn_serve
+
+    config = hypercorn_config(port)
+    scheme = "https (h2)" if config.ssl_enabled else "http (h2c)"
+    print(f"Serving {import_string} over HTTP/2 and HTTP/1.1 on {scheme}://{SERVER_HOST}:{port}")
+    asyncio.run(hypercorn_serve(app, config))
+
+
+if __name__ == "__main__":
+    import importlib
+
+    if len(sys.argv) != 2 or ":" not in sys.argv[1]:
+        raise SystemExit("Usage: python serving.py module:app")
+    module_name, _, attribute = sys.argv[1].partition(":")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    serve(getattr(importlib.import_module(module_name), attribute), sys.argv[1])
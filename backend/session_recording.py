@@ -0,0 +1,44 @@
+"""
+Recording of real generateCopilotResponse payloads for load testing.
+
+With RECORD_REQUESTS_PATH set, every generateCopilotResponse body read through
+request_body is appended to that file as a JSON line:
+    {"recordedAt": 1732030000.123, "threadId": "...", "body": "<raw JSON body>"}
+benchmarks/loadtest.py replays these sessions (grouped by threadId, in order) with
+their growing message histories and frontend action sets.
+"""
+
+import os
+import time
+import threading
+from typing import Optional
+
+from jsonl_writer import BackgroundJsonlWriter
+
+RECORD_REQUESTS_PATH = os.getenv("RECORD_REQUESTS_PATH", "")
+
+_writer: Optional[BackgroundJsonlWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> BackgroundJsonlWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundJsonlWriter(RECORD_REQUESTS_PATH, max_queue=10000)
+    return _writer
+
+
+def record_request_body(raw: bytes, body) -> None:
+    """Record a parsed request body if recording is enabled and it is a generateCopilotResponse."""
+    if not RECORD_REQUESTS_PATH or not isinstance(body, dict):
+        return
+    if body.get("operationName") != "generateCopilotResponse":
+        return
+    variables = body.get("variables")
+    data = variables.get("data") if isinstance(variables, dict) else None
+    _get_writer().submit({
+        "recordedAt": time.time(),
+        "threadId": data.get("threadId") if isinstance(data, dict) else None,
+        "body": raw.decode("utf-8", errors="replace"),
+    })
@@ -0,0 +1,428 @@
+"""
+Resumable streaming: every run's frames are numbered and buffered, so a dropped
+connection resumes where it stopped instead of re-sending the request and paying
+for a new model call.
+
+Frames are numbered from 1 in the order the run writes them, and each JSON frame
+carries its number as {"extensions": {"seq": N}} (see stream_frames.sequence_frame).
+Keep-alive frames are not numbered or buffered. The run is drained into the buffer
+by its own task, so it keeps going when the client disconnects. To resume, send
+the run id (from the initial envelope or the X-Run-Id header) and the last frame
+number received, either as
+
+    GET /copilotkit/runs/{runId}/frames?after=N      (or a Last-Event-ID: N header)
+
+or as the original POST again with X-Resume-Run-Id: <runId> and X-Resume-After: N
+headers. The response replays the frames after N, then follows the live tail
+until the run ends. 404: unknown or evicted run; 410: frame N+1 was already evicted.
+
+A reader the buffer's trimming overtakes (a resume, or a slow client catching up
+from the buffer, see `buffered`) never gets a silently truncated stream: it ends
+with a Failed response frame (hasNext false, `stream_frames.failed_frame`).
+
+Where the frames are kept:
+- in process (default): a bounded ring buffer per run. Runs are evicted
+  STREAM_BUFFER_TTL_S (default 600) after their last frame, and when all buffered
+  frames exceed STREAM_BUFFER_MAX_BYTES (default 64 MiB) finished runs go first,
+  least recently written first, then the oldest frames of running ones. A resume
+  has to reach the same worker (sticky sessions)
+- Redis, when REDIS_URI is set (see redis_client.py): a capped stream per run,
+  `stream:{runId}` with entry ids 0-N and an "end" entry, shared by all workers;
+  a queued run with no frame yet is marked by a `stream:{runId}:open` key
+
+STREAM_BUFFER_MAX_FRAMES (default 5000) caps the frames kept per run in both;
+STREAM_BUFFER=off disables buffering (and resuming).
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+
+import metrics
+from redis_client import get_redis
+from stream_frames import STREAMING_HEADERS, FrameOutbox, failed_frame, sequence_frame, with_keepalive
+
+STREAM_BUFFER = os.getenv("STREAM_BUFFER", "on").lower()
+STREAM_BUFFER_MAX_FRAMES = int(os.getenv("STREAM_BUFFER_MAX_FRAMES", "5000"))
+STREAM_BUFFER_TTL_S = int(os.getenv("STREAM_BUFFER_TTL_S", "600"))
+STREAM_BUFFER_MAX_BYTES = int(os.getenv("STREAM_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+# How long a resuming reader waits for the next frame before checking the run still exists
+_READ_BLOCK_MS = 5000
+
+buffered_frames = metrics.counter(
+    "stream_buffer_frames_total", "Frames appended to the resumable stream buffer"
+)
+resumes = metrics.counter(
+    "stream_buffer_resumes_total", "Stream resume requests by result (ok, gone, unknown)"
+)
+evictions = metrics.counter(
+    "stream_buffer_evictions_total", "Buffered runs evicted from the in-process buffer by reason (age, memory)"
+)
+truncated_reads = metrics.counter(
+    "stream_buffer_truncated_reads_total", "Buffer reads failed because frames the reader had not reached were trimmed or evicted"
+)
+buffer_bytes = metrics.gauge(
+    "stream_buffer_bytes", "Bytes of frames held by the in-process stream buffer"
+)
+
+# Drain tasks of runs whose client went away, kept referenced until they finish
+_detached = set()
+
+
+class StreamResumeError(Exception):
+    """A resume request that cannot be served (unknown run, or frames already evicted)."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _RunFrames:
+    __slots__ = ("frames", "first", "size", "ended", "evicted", "written_at", "changed")
+
+    def __init__(self):
+        self.frames: deque = deque()
+        self.first = 1  # number of frames[0]
+        self.size = 0
+        self.ended = False
+        self.evicted = False
+        self.written_at = time.monotonic()
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # Wake the readers waiting for this run and arm a fresh event for the next frame
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class RingBufferStore:
+    """In-process frame buffer: one bounded deque per run, evicted by age and total size."""
+
+    def __init__(self, max_frames: int = STREAM_BUFFER_MAX_FRAMES, ttl_s: float = STREAM_BUFFER_TTL_S, max_bytes: int = STREAM_BUFFER_MAX_BYTES):
+        self.max_frames = max_frames
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        # Ordered by last write, oldest first
+        self._runs: "OrderedDict[str, _RunFrames]" = OrderedDict()
+        self._bytes = 0
+
+    def _drop(self, run_id: str, reason: str):
+        run = self._runs.pop(run_id)
+        self._bytes -= run.size
+        # Attached readers finish the frames they hold; a run still writing fails them
+        run.evicted = True
+        run.notify()
+        evictions.inc(labels={"reason": reason})
+
+    def _pop_frame(self, run: _RunFrames):
+        frame = run.frames.popleft()
+        run.first += 1
+        run.size -= len(frame)
+        self._bytes -= len(frame)
+
+    def _evict(self):
+        deadline = time.monotonic() - self.ttl_s
+        while self._runs:
+            run_id, run = next(iter(self._runs.items()))
+            if run.written_at >= deadline:
+                break
+            self._drop(run_id, "age")
+        if self._bytes > self.max_bytes:
+            for run_id in [run_id for run_id, run in self._runs.items() if run.ended]:
+                self._drop(run_id, "memory")
+                if self._bytes <= self.max_bytes:
+                    break
+        # Still over: trim the oldest frames of the runs written least recently;
+        # resumes from before the trim get 410, readers behind it a Failed frame
+        if self._bytes > self.max_bytes:
+            for run in list(self._runs.values()):
+                while self._bytes > self.max_bytes and len(run.frames) > 1:
+                    self._pop_frame(run)
+                if self._bytes <= self.max_bytes:
+                    break
+        buffer_bytes.set(self._bytes)
+
+    async def open(self, run_id: str):
+        if run_id not in self._runs:
+            self._runs[run_id] = _RunFrames()
+
+    async def append(self, run_id: str, number: int, frame: Any):
+        run = self._runs.get(run_id)
+        if run is None:
+            run = self._runs[run_id] = _RunFrames()
+        if not run.frames:
+            run.first = number
+        run.frames.append(frame)
+        run.size += len(frame)
+        self._bytes += len(frame)
+        if len(run.frames) > self.max_frames:
+            self._pop_frame(run)
+        run.written_at = time.monotonic()
+        self._runs.move_to_end(run_id)
+        self._evict()
+        run.notify()
+
+    async def end(self, run_id: str, number: int):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run.ended = True
+            run.written_at = time.monotonic()
+            self._runs.move_to_end(run_id)
+            run.notify()
+
+    async def first(self, run_id: str) -> Optional[int]:
+        run = self._runs.get(run_id)
+        if run is None or (self.ttl_s and run.written_at < time.monotonic() - self.ttl_s):
+            return None
+        return run.first
+
+    async def read(self, run_id: str, after: int) -> AsyncIterator[Any]:
+        run = self._runs.get(run_id)
+        if run is None:
+            raise StreamResumeError(f"Unknown or expired run: {run_id}", 404)
+        while True:
+            if after + 1 < run.first:
+                raise StreamResumeError(f"Frames after {after} were trimmed from the buffer of run {run_id}", 410)
+            start = after + 1 - run.first
+            if start < len(run.frames):
+                batch = list(islice(run.frames, start, None))
+                after += len(batch)
+                for frame in batch:
+                    yield frame
+                continue
+            if run.ended:
+                return
+            if run.evicted:
+                raise StreamResumeError(f"Run {run_id} was evicted from the buffer before it ended", 410)
+            await run.changed.wait()
+
+
+class RedisStreamStore:
+    """Frame buffer in capped Redis streams, shared by every worker using the same Redis."""
+
+    def __init__(self, redis, max_frames: int = STREAM_BUFFER_MAX_FRAMES, ttl_s: int = STREAM_BUFFER_TTL_S):
+        self.redis = redis
+        self.max_frames = max_frames
+        self.ttl_s = ttl_s
+
+    @staticmethod
+    def _key(run_id: str) -> str:
+        return f"stream:{run_id}"
+
+    @staticmethod
+    def _number(entry_id: Any) -> int:
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode("ascii")
+        return int(str(entry_id).partition("-")[2] or 0)
+
+    @staticmethod
+    def _open_key(run_id: str) -> str:
+        return f"stream:{run_id}:open"
+
+    async def open(self, run_id: str):
+        # The stream itself is created by the first frame (entry ids start at 0-1);
+        # until then this marker makes the run known to first(), so resumes wait for it
+        await self.redis.set(self._open_key(run_id), "1", ex=self.ttl_s)
+
+    async def append(self, run_id: str, number: int, frame: Any):
+        key = self._key(run_id)
+        await self.redis.xadd(key, {"f": frame}, id=f"0-{number}", maxlen=self.max_frames, approximate=False)
+        if number == 1:
+            # Expire a run whose worker dies before writing the end entry
+            await self.redis.expire(key, self.ttl_s)
+            await self.redis.delete(self._open_key(run_id))
+
+    async def end(self, run_id: str, number: int):
+        key = self._key(run_id)
+        await self.redis.xadd(key, {"end": "1"}, id=f"0-{number}", maxlen=self.max_frames, approximate=False)
+        await self.redis.expire(key, self.ttl_s)
+
+    async def first(self, run_id: str) -> Optional[int]:
+        entries = await self.redis.xrange(self._key(run_id), "-", "+", count=1)
+        if entries:
+            return self._number(entries[0][0])
+        # Opened (queued) but no frame written yet: its first frame will be 1
+        return 1 if await self.redis.exists(self._open_key(run_id)) else None
+
+    async def read(self, run_id: str, after: int) -> AsyncIterator[Any]:
+        key = self._key(run_id)
+        last = after
+        while True:
+            result = await self.redis.xread({key: f"0-{last}"}, count=256, block=_READ_BLOCK_MS)
+            if not result:
+                if await self.first(run_id) is None:
+                    # Expired while idle: the producing worker is gone
+                    raise StreamResumeError(f"Run {run_id} expired before it ended", 410)
+                continue
+            for entry_id, fields in result[0][1]:
+                number = self._number(entry_id)
+                if number != last + 1:
+                    # Trimmed while we were reading; a partial stream would corrupt the client state
+                    raise StreamResumeError(f"Frames after {last} were trimmed from the buffer of run {run_id}", 410)
+                last = number
+                if b"end" in fields:
+                    return
+                yield fields[b"f"].decode("utf-8")
+
+
+_store = None
+
+
+def get_store():
+    """The frame store for this process (Redis when configured), or None with STREAM_BUFFER=off."""
+    global _store
+    if _store is None and STREAM_BUFFER != "off":
+        redis = get_redis()
+        _store = RedisStreamStore(redis) if redis is not None else RingBufferStore()
+    return _store
+
+
+async def record(run_id: str, frames: AsyncIterator[Any], number: Callable[[Any, int], Any] = sequence_frame, on_frame: Optional[Callable[[Any], None]] = None) -> int:
+    """
+    Drain `frames` into the run's buffer, numbering them with `number(frame, n)` and
+    passing each numbered frame to `on_frame`; ends the run's buffer when `frames`
+    is exhausted, fails or is cancelled. Returns the number of frames.
+    """
+    store = get_store()
+    count = 0
+    failed = store is None
+    try:
+        async for frame in frames:
+            count += 1
+            frame = number(frame, count)
+            if on_frame is not None:
+                on_frame(frame)
+            if failed:
+                continue
+            try:
+                await store.append(run_id, count, frame)
+                buffered_frames.inc()
+            except Exception as e:
+                # Keep streaming to the attached client; this run just can't be resumed
+                failed = True
+                print(f"Stream buffer append failed for run {run_id}: {e}")
+    finally:
+        aclose = getattr(frames, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        if not failed:
+            try:
+                await store.end(run_id, count + 1)
+            except Exception as e:
+                print(f"Stream buffer end marker failed for run {run_id}: {e}")
+    return count
+
+
+async def open_run(run_id: str):
+    """Make `run_id` known to the buffer before its first frame (e.g. while it is queued)."""
+    store = get_store()
+    if store is not None:
+        await store.open(run_id)
+
+
+async def buffered(run_id: str, frames: AsyncIterator[Any], number: Callable[[Any, int], Any] = sequence_frame, keepalive: Any = None) -> AsyncIterator[Any]:
+    """
+    Yield the frames of `frames`, numbered with `number(frame, n)`, while appending
+    them to the run's buffer. The run is drained by its own task, so it completes
+    (into the buffer) even if the consumer stops early. A consumer that falls back
+    to the buffer and is overtaken by its trimming gets a Failed frame encoded like
+    `keepalive` (see read_frames).
+    """
+    if get_store() is None:
+        async for frame in frames:
+            yield frame
+        return
+
+    # Bounded: a client reading slower than the run gets coalesced frames, then
+    # (past the outbox caps) continues from the buffer; see stream_frames.FrameOutbox
+    outbox = FrameOutbox()
+
+    async def drain():
+        try:
+            await record(run_id, frames, number, outbox.put)
+        finally:
+            outbox.close()
+
+    task = asyncio.get_running_loop().create_task(drain())
+    try:
+        while True:
+            batch = await outbox.get()
+            if batch is None:
+                break
+            for frame in batch:
+                yield frame
+        if outbox.overflowed:
+            async for frame in read_frames(run_id, outbox.accepted, keepalive):
+                yield frame
+        # Surface a failure of the run itself to the consumer
+        await task
+    finally:
+        outbox.discard()
+        if not task.done():
+            _detached.add(task)
+            task.add_done_callback(_detached.discard)
+
+
+def resume_position(request, run_id: Optional[str] = None, after: Optional[int] = None) -> Optional[Tuple[str, int]]:
+    """
+    (run id, last frame received) for a resume request, else None. Missing values
+    come from the X-Resume-Run-Id and X-Resume-After (or Last-Event-ID) headers.
+    """
+    run_id = run_id or request.headers.get("x-resume-run-id")
+    if not run_id:
+        return None
+    if after is None:
+        raw = request.headers.get("x-resume-after") or request.headers.get("last-event-id") or "0"
+        after = int(raw) if raw.isdigit() else 0
+    return run_id, after
+
+
+async def check_resume(run_id: str, after: int):
+    """Raise StreamResumeError unless the frames after `after` can be replayed for `run_id`."""
+    store = get_store()
+    first = await store.first(run_id) if store is not None else None
+    if first is None:
+        resumes.inc(labels={"result": "unknown"})
+        raise StreamResumeError(f"Unknown or expired run: {run_id}", 404)
+    if first > after + 1:
+        resumes.inc(labels={"result": "gone"})
+        raise StreamResumeError(f"Frames after {after} are no longer buffered for run {run_id}", 410)
+    resumes.inc(labels={"result": "ok"})
+
+
+async def read_frames(run_id: str, after: int = 0, keepalive: Any = None) -> AsyncIterator[Any]:
+    """
+    The run's frames numbered after `after`, then its live tail until it ends. When
+    frames the reader has not reached yet are trimmed or evicted, the stream ends
+    with a Failed frame encoded like `keepalive` (the server's keep-alive frame), or
+    raises StreamResumeError without one.
+    """
+    try:
+        async for frame in get_store().read(run_id, after):
+            yield frame
+    except StreamResumeError as e:
+        truncated_reads.inc()
+        if keepalive is None:
+            raise
+        yield failed_frame(keepalive, str(e))
+
+
+async def resume_response(run_id: str, after: int, keepalive: Any, media_type: str):
+    """
+    The streaming response replaying `run_id` after frame `after` (with keep-alives),
+    or a JSON error response with the StreamResumeError status.
+    """
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    try:
+        await check_resume(run_id, after)
+    except StreamResumeError as e:
+        return JSONResponse(content={"errors": [{"message": str(e)}]}, status_code=e.status_code)
+    return StreamingResponse(
+        with_keepalive(read_frames(run_id, after, keepalive), keepalive),
+        media_type=media_type,
+        headers={**STREAMING_HEADERS, "X-Run-Id": run_id},
+    )
@@ -0,0 +1,189 @@
+"""
+Response compression for streamed (and large JSON) responses, negotiated via Accept-Encoding.
+
+Streamed generateCopilotResponse bodies are many small, highly repetitive JSON
+frames, which compress very well as one stream. Starlette's GZipMiddleware does
+not flush per write, so it holds frames back (or skips event streams entirely).
+This ASGI middleware compresses each response body message and sync-flushes it:
+the client can decode everything written so far, and because the compression
+context spans the whole response, later frames reuse earlier ones as dictionary.
+Each body message is one batch of frames (see stream_frames.with_keepalive).
+
+- gzip: zlib, always available
+- br: only when the optional `brotli` package is installed
+
+Settings:
+- STREAM_COMPRESSION: "auto" (default: br if accepted and installed, else gzip),
+  "gzip", "br" or "off"
+- STREAM_COMPRESSION_LEVEL: gzip level / brotli quality (default 5)
+- STREAM_COMPRESSION_MIN_BYTES: smallest non-streamed response to compress (default 1024)
+"""
+
+import os
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+import metrics
+
+STREAM_COMPRESSION = os.getenv("STREAM_COMPRESSION", "auto").lower()
+COMPRESSION_LEVEL = int(os.getenv("STREAM_COMPRESSION_LEVEL", "5"))
+MIN_BYTES = int(os.getenv("STREAM_COMPRESSION_MIN_BYTES", "1024"))
+
+# Content types worth compressing; the streaming ones are compressed whatever their size
+STREAMING_TYPES = (b"multipart/mixed", b"application/x-ndjson", b"text/event-stream")
+COMPRESSIBLE_TYPES = STREAMING_TYPES + (b"application/json", b"application/graphql-response+json", b"text/")
+
+compressed_bytes_in = metrics.counter(
+    "stream_compression_bytes_in_total", "Response bytes before compression"
+)
+compressed_bytes_out = metrics.counter(
+    "stream_compression_bytes_out_total", "Response bytes after compression"
+)
+
+_brotli = None
+_brotli_checked = False
+
+
+def _brotli_module():
+    """The optional brotli module, or None when it is not installed."""
+    global _brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli
+
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_checked = True
+    return _brotli
+
+
+def supported_encodings() -> List[str]:
+    """Encodings this server can produce, in order of preference."""
+    if STREAM_COMPRESSION == "off":
+        return []
+    available = ["br", "gzip"] if _brotli_module() is not None else ["gzip"]
+    if STREAM_COMPRESSION in ("gzip", "br"):
+        return [STREAM_COMPRESSION] if STREAM_COMPRESSION in available else []
+    return available
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the response encoding for an Accept-Encoding header value: the highest
+    q-value among the supported encodings, ties broken by server preference.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class StreamCompressor:
+    """Incremental compressor: `compress(data)` returns bytes decodable up to this point."""
+
+    def __init__(self, encoding: str, level: int = COMPRESSION_LEVEL):
+        self.encoding = encoding
+        if encoding == "br":
+            brotli = _brotli_module()
+            self._brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=level)
+        else:
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class StreamCompressionMiddleware:
+    """ASGI middleware compressing streamed responses with a sync-flush per body message."""
+
+    def __init__(self, app, minimum_size: int = MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(
+            (_header(scope.get("headers", []), b"accept-encoding") or b"").decode("latin-1")
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self._compressing_send(send, encoding))
+
+    def _compressing_send(self, send: Callable, encoding: str) -> Callable:
+        compressor: Optional[StreamCompressor] = None
+        labels = {"encoding": encoding}
+
+        async def compressing_send(message):
+            nonlocal compressor
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                content_type = (_header(headers, b"content-type") or b"").lower()
+                length = _header(headers, b"content-length")
+                streaming = content_type.startswith(STREAMING_TYPES)
+                if (
+                    _header(headers, b"content-encoding") is None
+                    and content_type.startswith(COMPRESSIBLE_TYPES)
+                    and (streaming or length is None or int(length) >= self.minimum_size)
+                ):
+                    compressor = StreamCompressor(encoding)
+                    headers = [(key, value) for key, value in headers if key.lower() != b"content-length"]
+                    headers.append((b"content-encoding", encoding.encode("ascii")))
+                    headers.append((b"vary", b"Accept-Encoding"))
+                    message = {**message, "headers": headers}
+                await send(message)
+                return
+
+            if message["type"] == "http.response.body" and compressor is not None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                data = compressor.compress(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                compressed_bytes_in.inc(len(body), labels=labels)
+                compressed_bytes_out.inc(len(data), labels=labels)
+                message = {**message, "body": data}
+            await send(message)
+
+        return compressing_send
+
+
+def add_stream_compression(app):
+    """Install the compression middleware on a FastAPI/Starlette app (no-op when STREAM_COMPRESSION=off)."""
+    if STREAM_COMPRESSION != "off":
+        app.add_middleware(StreamCompressionMiddleware)
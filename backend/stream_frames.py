@@ -0,0 +1,403 @@
+"""
+Helpers shared by the streaming generateCopilotResponse handlers.
+
+Perceived latency is dominated by how soon the client sees the run start, so the
+handlers flush the initial envelope and a "running" agent-state frame (with the
+real runId and timestamps from here) before loading the checkpoint or calling the
+model. During long model or tool waits nothing else would be written, and
+proxies/load balancers may buffer the response or close an idle connection, so
+`with_keepalive` interleaves a no-op frame after STREAM_KEEPALIVE_INTERVAL_S
+seconds (default 10, 0 = off) without output.
+
+A keep-alive frame is an incremental-delivery payload with no data,
+{"hasNext": true}, which GraphQL clients ignore.
+
+Frames that are already waiting when the response is ready to write (the client
+reads slower than the per-word frames are produced) are joined into one write of
+up to STREAM_MAX_BATCH_FRAMES frames (default 64), and consecutive incremental
+frames in it are merged into one (`coalesce_frames`: the content deltas of a
+message become a single multi-item entry). With response compression (see
+stream_compression.py) every write is one sync-flushed batch.
+
+Backpressure: a buffered run never waits for its client, so its frames reach the
+writer through a bounded `FrameOutbox`. Past STREAM_PENDING_FRAMES (default 64)
+pending frames they are coalesced; past STREAM_PENDING_BYTES per stream (default
+256 KiB) or STREAM_PENDING_BYTES_TOTAL across streams (default 64 MiB) the
+stream stalls: the writer drops its pending handoff and catches up from the
+run's stream buffer instead.
+
+Frames of a buffered run are numbered (`sequence_frame`, see stream_buffer.py) so a
+client can resume a dropped stream from the last frame it received.
+
+State snapshots carry the frontend tool schemas and their hash (`toolsHash`). A
+client that already holds the schemas sends their hash in the X-Tools-Hash request
+header; when it matches, snapshots only carry `toolsHash`. Without the header, or
+with a stale hash, the schemas are always sent.
+
+The model's tool calls are streamed as ActionExecutionMessageOutput messages after
+its text (`action_execution_payload`), with the tool-call id as their id.
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+from prompt_layout import canonical_tools
+
+KEEPALIVE_INTERVAL_S = float(os.getenv("STREAM_KEEPALIVE_INTERVAL_S", "10"))
+MAX_BATCH_FRAMES = int(os.getenv("STREAM_MAX_BATCH_FRAMES", "64"))
+STREAM_PENDING_FRAMES = int(os.getenv("STREAM_PENDING_FRAMES", "64"))
+STREAM_PENDING_BYTES = int(os.getenv("STREAM_PENDING_BYTES", str(256 * 1024)))
+STREAM_PENDING_BYTES_TOTAL = int(os.getenv("STREAM_PENDING_BYTES_TOTAL", str(64 * 1024 * 1024)))
+KEEPALIVE_PAYLOAD: Dict[str, Any] = {"hasNext": True}
+
+# Response headers that stop reverse proxies (nginx, most PaaS routers) from buffering the stream
+STREAMING_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+keepalive_frames = metrics.counter(
+    "stream_keepalive_frames_total", "Keep-alive frames written during idle streaming responses"
+)
+coalesced_frames = metrics.counter(
+    "stream_coalesced_frames_total", "Frames merged into a neighbouring frame because the client read slower than the run produced"
+)
+stalled_streams = metrics.counter(
+    "stream_stalled_total", "Streams whose pending frames exceeded the per-stream or global cap, by cap"
+)
+pending_bytes = metrics.gauge(
+    "stream_pending_bytes", "Bytes of frames produced but not yet written, across all streams"
+)
+frames_per_write = metrics.histogram(
+    "stream_frames_per_write", "Frames joined into one response write",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+_pending_total = 0
+
+
+def iso_timestamp() -> str:
+    """Current UTC time in the format CopilotKit uses for createdAt (2025-11-19T16:00:00.000Z)."""
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def client_tools_hash(request: Any) -> Optional[str]:
+    """The hash of the tool schemas the client holds (X-Tools-Hash header), if any."""
+    return request.headers.get("x-tools-hash") or None
+
+
+def snapshot_tools(tools: Sequence[Any], client_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The tools part of an agent-state snapshot: only {"toolsHash": ...} when the
+    client's `client_hash` matches the schemas, the full schemas plus their hash otherwise.
+    """
+    fingerprint, _ = canonical_tools(tools)
+    if client_hash and client_hash == fingerprint:
+        return {"toolsHash": fingerprint}
+    return {"tools": list(tools), "toolsHash": fingerprint}
+
+
+def action_execution_payload(call: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """
+    The incremental payload announcing the model's tool call `call` (a LangChain
+    tool call) as messages[index], an ActionExecutionMessageOutput the frontend runs.
+    Its id is the tool-call id, which comes back as the resultMessage's
+    actionExecutionId (see hot_runs.py).
+    """
+    return {
+        "incremental": [{
+            "items": [{
+                "__typename": "ActionExecutionMessageOutput",
+                "id": call["id"],
+                "createdAt": iso_timestamp(),
+                "name": call["name"],
+                "arguments": [json.dumps(call.get("args") or {})],
+                "parentMessageId": None,
+                "status": {"code": "Success", "__typename": "SuccessMessageStatus"},
+            }],
+            "path": ["generateCopilotResponse", "messages", index],
+        }],
+        "hasNext": True,
+    }
+
+
+# Payload keys of a frame that can be merged with its neighbours
+_MERGEABLE_KEYS = {"incremental", "hasNext", "extensions"}
+_CONTENT_LENGTH = re.compile(r"Content-Length: \d+", re.IGNORECASE)
+
+
+def sequence_frame(frame: Any, seq: int) -> Any:
+    """
+    `frame` (str or bytes) with its number added to the JSON payload as top-level
+    {"extensions": {"seq": seq}}, GraphQL's slot for protocol metadata. Handles NDJSON
+    lines and multipart parts (Content-Length is updated); frames that don't end in
+    a JSON object, like the closing multipart boundary, are returned unchanged.
+    """
+    is_bytes = isinstance(frame, bytes)
+    text = frame.decode("utf-8") if is_bytes else frame
+    if not text.endswith("}\n"):
+        return frame
+    # A multipart part is headers, a blank line, then the payload (JSON has no raw newlines)
+    head, separator, payload = text.rpartition("\n\n")
+    return _frame(head + separator, payload[:-2] + f', "extensions": {{"seq": {seq}}}}}\n', is_bytes)
+
+
+def failed_frame(template: Any, reason: str) -> Any:
+    """
+    A terminal Failed response frame (hasNext false) for `reason`, encoded like
+    `template`: an NDJSON line or a multipart part, e.g. the server's keep-alive frame.
+    """
+    is_bytes = isinstance(template, bytes)
+    text = template.decode("utf-8") if is_bytes else template
+    head, separator, _ = text.rpartition("\n\n")
+    payload = {
+        "incremental": [{
+            "data": {
+                "__typename": "CopilotResponse",
+                "status": {"code": "Failed", "reason": reason, "__typename": "FailedResponseStatus"},
+            },
+            "path": ["generateCopilotResponse"],
+        }],
+        "hasNext": False,
+    }
+    return _frame(head + separator, json.dumps(payload) + "\n", is_bytes)
+
+
+def _frame(head: str, payload: str, is_bytes: bool) -> Any:
+    """Reassemble a frame from its multipart headers (or "") and payload line."""
+    if head and _CONTENT_LENGTH.search(head):
+        head = _CONTENT_LENGTH.sub(f"Content-Length: {len(payload.encode('utf-8')) - 1}", head)
+    text = head + payload
+    return text.encode("utf-8") if is_bytes else text
+
+
+def _incremental_payload(frame: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(multipart headers or "", payload) of a frame that only carries incremental results."""
+    text = frame.decode("utf-8") if isinstance(frame, bytes) else frame
+    if not text.endswith("}\n"):
+        return None
+    head, separator, payload = text.rpartition("\n\n")
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("incremental"), list) or not data.keys() <= _MERGEABLE_KEYS:
+        return None
+    return head + separator, data
+
+
+def _append_incremental(entries: List[Dict[str, Any]], entry: Dict[str, Any]):
+    """Append `entry`, extending the previous one when both stream items into the same list."""
+    if entries and "items" in entry and "items" in entries[-1]:
+        previous = entries[-1]
+        path, previous_path = entry.get("path") or [], previous.get("path") or []
+        if (
+            len(path) == len(previous_path) > 0
+            and path[:-1] == previous_path[:-1]
+            and isinstance(path[-1], int)
+            and isinstance(previous_path[-1], int)
+            and path[-1] == previous_path[-1] + len(previous["items"])
+            and entry.keys() == previous.keys() == {"items", "path"}
+        ):
+            previous["items"] = previous["items"] + entry["items"]
+            return
+    entries.append(dict(entry))
+
+
+def coalesce_frames(batch: List[Any]) -> List[Any]:
+    """
+    Merge consecutive frames that only carry incremental results into one frame:
+    their `incremental` entries are concatenated, and content deltas streaming into
+    the same list become one entry with several items (`items` plus the path of the
+    first, as in GraphQL @stream). The merged frame keeps the first frame's
+    multipart headers and the last one's hasNext/extensions (e.g. its seq), so a
+    client resuming after it continues after the last merged frame.
+    """
+    merged: List[Any] = []
+    pending: Optional[List[Any]] = None  # [head, incremental entries, last payload, is_bytes, frames, first frame]
+
+    def flush():
+        if pending is None:
+            return
+        head, entries, last, is_bytes, count, first = pending
+        if count == 1:
+            merged.append(first)
+            return
+        payload = {**last, "incremental": entries}
+        merged.append(_frame(head, json.dumps(payload, ensure_ascii=False) + "\n", is_bytes))
+        coalesced_frames.inc(count - 1)
+
+    for frame in batch:
+        parsed = _incremental_payload(frame)
+        if parsed is None:
+            flush()
+            pending = None
+            merged.append(frame)
+            continue
+        head, data = parsed
+        if pending is None:
+            pending = [head, [], data, isinstance(frame, bytes), 0, frame]
+        for entry in data["incremental"]:
+            _append_incremental(pending[1], entry)
+        pending[2] = data
+        pending[4] += 1
+    flush()
+    return merged
+
+
+def _join(batch: List[Any]) -> Any:
+    frames_per_write.observe(len(batch))
+    if len(batch) > 1:
+        batch = coalesce_frames(batch)
+    if len(batch) == 1:
+        return batch[0]
+    if all(isinstance(frame, str) for frame in batch):
+        return "".join(batch)
+    return b"".join(frame.encode("utf-8") if isinstance(frame, str) else frame for frame in batch)
+
+
+def _size(frame: Any) -> int:
+    return len(frame)
+
+
+class FrameOutbox:
+    """
+    Bounded handoff of a run's frames to its response writer. `put` never blocks the
+    run: past STREAM_PENDING_FRAMES pending frames they are coalesced, and once the
+    pending bytes still exceed STREAM_PENDING_BYTES (or all streams together exceed
+    STREAM_PENDING_BYTES_TOTAL) the outbox stops accepting frames (`overflowed`).
+    The writer then continues from the run's stream buffer after the `accepted`
+    frames, so a slow client costs a bounded amount of memory and loses nothing.
+    """
+
+    def __init__(self, max_frames: int = STREAM_PENDING_FRAMES, max_bytes: int = STREAM_PENDING_BYTES):
+        import asyncio
+        from collections import deque
+
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.accepted = 0
+        self.overflowed = False
+        self.closed = False
+        self._frames = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+
+    def _account(self, delta: int):
+        global _pending_total
+        self._bytes += delta
+        _pending_total += delta
+        pending_bytes.set(_pending_total)
+
+    def put(self, frame: Any) -> bool:
+        """Queue a frame; False once the outbox has overflowed (or closed)."""
+        if self.overflowed or self.closed:
+            return False
+        self._frames.append(frame)
+        self._account(_size(frame))
+        self.accepted += 1
+        self._ready.set()
+        if len(self._frames) > self.max_frames:
+            frames = coalesce_frames(list(self._frames))
+            self._frames.clear()
+            self._frames.extend(frames)
+            self._account(sum(_size(frame) for frame in frames) - self._bytes)
+        if self._bytes > self.max_bytes or _pending_total > STREAM_PENDING_BYTES_TOTAL:
+            self.overflowed = True
+            stalled_streams.inc(labels={"cap": "stream" if self._bytes > self.max_bytes else "global"})
+        return True
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[List[Any]]:
+        """All pending frames, waiting for one; None once closed or overflowed and drained."""
+        while not self._frames:
+            if self.closed or self.overflowed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        frames = list(self._frames)
+        self._frames.clear()
+        self._account(-self._bytes)
+        return frames
+
+    def discard(self):
+        """Release the pending frames (the writer went away)."""
+        self._frames.clear()
+        self._account(-self._bytes)
+        self.close()
+
+
+class _Failed:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def with_keepalive(frames: AsyncIterator[Any], keepalive: Any, interval: float = KEEPALIVE_INTERVAL_S) -> AsyncIterator[Any]:
+    """
+    Yield the frames of `frames`, plus `keepalive` whenever no frame was produced
+    for `interval` seconds (0 = never); frames already waiting are joined into one
+    write. Keep-alives are only inserted between frames, so every frame must be a
+    complete chunk (e.g. a whole multipart part).
+    """
+    import asyncio
+
+    # The frames are produced in one task (started here, so it inherits the request's
+    # context, e.g. the current trace span) and handed over through a bounded queue
+    queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_BATCH_FRAMES)
+    done = object()
+
+    async def produce():
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+                # Let the writer take the frame right away if it is idle; frames only
+                # pile up (and get batched) while it is waiting on the client
+                await asyncio.sleep(0)
+            await queue.put(done)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_Failed(e))
+        finally:
+            aclose = getattr(frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    producer = asyncio.create_task(produce())
+    try:
+        finished = False
+        while not finished:
+            try:
+                item = await asyncio.wait_for(queue.get(), interval if interval > 0 else None)
+            except asyncio.TimeoutError:
+                keepalive_frames.inc()
+                yield keepalive
+                continue
+            batch = []
+            while True:
+                if item is done:
+                    finished = True
+                    break
+                if isinstance(item, _Failed):
+                    if batch:
+                        yield _join(batch)
+                    raise item.error
+                batch.append(item)
+                if queue.empty():
+                    break
+                item = queue.get_nowait()
+            if batch:
+                yield _join(batch)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
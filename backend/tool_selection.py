@@ -0,0 +1,275 @@
+"""
+Per-turn frontend tool pruning for chat_node.
+
+Every CopilotKit frontend action is bound as a tool on every model call, so apps
+with dozens of actions pay their schemas in prompt tokens on every turn. Before
+binding, `select_tools` ranks the tools against the recent conversation and keeps:
+- the TOOL_SELECTION_TOP_K best matches (default 8) with a positive score
+- the pinned tools (TOOL_SELECTION_PINNED, comma-separated names)
+- every tool called in the recent messages, so a tool round-trip keeps its tool
+It binds all of them when nothing matches at all.
+
+Ranking uses an index built once per distinct tool set (names split on
+camel/snake case, descriptions, parameter names and descriptions):
+- BM25 over the last TOOL_SELECTION_CONTEXT_MESSAGES messages (default 4; the
+  latest one weighs double)
+- optionally blended with cosine similarity of averaged word vectors from a small
+  local embedding matrix: TOOL_EMBEDDINGS_PATH, an .npz with `words` (V) and
+  `vectors` (V x D), needs NumPy; TOOL_EMBEDDING_WEIGHT (default 0.5)
+
+The kept tools stay in canonical order (prompt_layout.canonical_tools), so turns
+selecting the same tools share the provider's cached prompt prefix.
+
+TOOL_SELECTION modes:
+- "on" (default): bind the selection when there are more than TOP_K tools
+- "shadow": bind every tool but compute the selection and record its recall
+  (did the model only call tools the selection would have kept?)
+- "off"
+
+Reports: the agent_tool_selection_* metrics, and benchmarks/tool_selection_report.py
+for recall and tokens saved on recorded sessions.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter as TermCounts, OrderedDict
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+import metrics
+from prompt_layout import canonical_tools, tool_name
+
+TOOL_SELECTION = os.getenv("TOOL_SELECTION", "on").lower()
+TOP_K = int(os.getenv("TOOL_SELECTION_TOP_K", "8"))
+PINNED = {name.strip() for name in os.getenv("TOOL_SELECTION_PINNED", "").split(",") if name.strip()}
+CONTEXT_MESSAGES = int(os.getenv("TOOL_SELECTION_CONTEXT_MESSAGES", "4"))
+EMBEDDINGS_PATH = os.getenv("TOOL_EMBEDDINGS_PATH", "")
+EMBEDDING_WEIGHT = float(os.getenv("TOOL_EMBEDDING_WEIGHT", "0.5"))
+
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_INDEX_CACHE_SIZE = 256
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do for from has have how i in is it its me my of on or "
+    "please that the this to was we what when where which who will with you your".split()
+)
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+selections = metrics.counter(
+    "agent_tool_selection_total", "Model calls by tool selection result (pruned, all)"
+)
+tokens_saved = metrics.counter(
+    "agent_tool_selection_tokens_saved_total", "Estimated prompt tokens of tool schemas left out of model calls"
+)
+tool_recall = metrics.counter(
+    "agent_tool_selection_recall_total", "Tool calls made in shadow mode, by whether the selection kept the tool (hit, miss)"
+)
+
+_indexes: "OrderedDict[str, ToolIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+_embeddings = None
+_embeddings_loaded = False
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms: words split on camelCase/snake_case, stopwords and 1-char terms dropped."""
+    terms = []
+    for word in _WORD.findall(text or ""):
+        for part in _CAMEL.findall(word) or [word]:
+            term = part.lower()
+            if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+                term = term[:-1]
+            if len(term) > 1 and term not in _STOPWORDS:
+                terms.append(term)
+    return terms
+
+
+def _tool_text(tool: Any) -> str:
+    if not isinstance(tool, dict):
+        return f"{tool_name(tool)} {getattr(tool, 'description', '')}"
+    function = tool.get("function") if isinstance(tool.get("function"), dict) else tool
+    parts = [tool_name(tool), str(function.get("description", ""))]
+    properties = (function.get("parameters") or {}).get("properties") or {}
+    for name, schema in properties.items():
+        parts.append(str(name))
+        if isinstance(schema, dict):
+            parts.append(str(schema.get("description", "")))
+    return " ".join(parts)
+
+
+def schema_tokens(tool: Any) -> int:
+    """Rough prompt-token cost of a tool schema (4 characters per token)."""
+    if isinstance(tool, dict):
+        return len(json.dumps(tool, separators=(",", ":"), ensure_ascii=False)) // 4
+    return len(_tool_text(tool)) // 4
+
+
+def _load_embeddings():
+    """(word -> row, unit-normalized vectors) from TOOL_EMBEDDINGS_PATH, or None."""
+    global _embeddings, _embeddings_loaded
+    if not _embeddings_loaded:
+        _embeddings_loaded = True
+        if EMBEDDINGS_PATH:
+            try:
+                import numpy as np
+
+                data = np.load(EMBEDDINGS_PATH, allow_pickle=False)
+                vectors = data["vectors"].astype("float32")
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+                _embeddings = ({str(word): row for row, word in enumerate(data["words"])}, vectors)
+            except Exception as e:
+                print(f"Tool embeddings unavailable ({EMBEDDINGS_PATH}): {e}")
+    return _embeddings
+
+
+class ToolIndex:
+    """BM25 (and optional embedding) index over one canonical tool list."""
+
+    def __init__(self, tools: Sequence[Any]):
+        self.tools = list(tools)
+        self.names = [tool_name(tool) for tool in self.tools]
+        self.costs = [schema_tokens(tool) for tool in self.tools]
+        docs = [tokenize(_tool_text(tool)) for tool in self.tools]
+        self.term_counts = [TermCounts(doc) for doc in docs]
+        self.lengths = [len(doc) for doc in docs]
+        self.average_length = (sum(self.lengths) / len(docs)) if docs else 0.0
+        document_frequency = TermCounts(term for doc in docs for term in set(doc))
+        count = len(docs)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+        self.vectors = None
+        embeddings = _load_embeddings()
+        if embeddings is not None:
+            self.vectors = self._embed_all(docs, embeddings)
+
+    @staticmethod
+    def _embed(terms: Sequence[str], embeddings):
+        import numpy as np
+
+        rows, vectors = embeddings
+        hits = [rows[term] for term in terms if term in rows]
+        if not hits:
+            return np.zeros(vectors.shape[1], dtype="float32")
+        vector = vectors[hits].mean(axis=0)
+        return vector / max(float(np.linalg.norm(vector)), 1e-9)
+
+    def _embed_all(self, docs, embeddings):
+        import numpy as np
+
+        return np.stack([self._embed(doc, embeddings) for doc in docs]) if docs else None
+
+    def scores(self, query: Dict[str, float]) -> List[float]:
+        """Relevance of every tool to the weighted query terms, in [0, 1]."""
+        bm25 = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * length / (self.average_length or 1.0))
+            for term, weight in query.items():
+                frequency = counts.get(term)
+                if frequency:
+                    score += weight * self.idf[term] * frequency * (_BM25_K1 + 1) / (frequency + norm)
+            bm25.append(score)
+        best = max(bm25, default=0.0)
+        scores = [score / best for score in bm25] if best > 0 else bm25
+        if self.vectors is not None:
+            similarity = self.vectors @ self._embed(list(query), _load_embeddings())
+            scores = [
+                (1 - EMBEDDING_WEIGHT) * score + EMBEDDING_WEIGHT * max(float(cosine), 0.0)
+                for score, cosine in zip(scores, similarity)
+            ]
+        return scores
+
+
+def tool_index(fingerprint: str, tools: Sequence[Any]) -> ToolIndex:
+    """The index of a canonical tool list, built once per tool set."""
+    with _indexes_lock:
+        index = _indexes.get(fingerprint)
+        if index is not None:
+            _indexes.move_to_end(fingerprint)
+            return index
+    index = ToolIndex(tools)
+    with _indexes_lock:
+        _indexes[fingerprint] = index
+        if len(_indexes) > _INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _message_text(message: Any) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+    if isinstance(content, list):
+        content = " ".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content or "")
+
+
+def _called_tools(message: Any) -> List[str]:
+    calls = message.get("tool_calls") if isinstance(message, dict) else getattr(message, "tool_calls", None)
+    return [call.get("name", "") for call in calls or [] if isinstance(call, dict)]
+
+
+def conversation_query(messages: Sequence[Any], context_messages: int = CONTEXT_MESSAGES) -> Tuple[Dict[str, float], List[str]]:
+    """(weighted query terms, tools called) from the last `context_messages` messages."""
+    recent = list(messages[-context_messages:]) if context_messages > 0 else []
+    query: Dict[str, float] = {}
+    called: List[str] = []
+    for position, message in enumerate(recent):
+        weight = 2.0 if position == len(recent) - 1 else 1.0
+        for term in tokenize(_message_text(message)):
+            query[term] = query.get(term, 0.0) + weight
+        called.extend(_called_tools(message))
+    return query, called
+
+
+class ToolSelection(NamedTuple):
+    fingerprint: str
+    tools: List[Any]
+    selected: frozenset
+    tokens_saved: int
+    mode: str
+
+
+def rank_tools(messages: Sequence[Any], fingerprint: str, tools: Sequence[Any], top_k: int = TOP_K, pinned=PINNED) -> frozenset:
+    """Names of the tools to keep for this turn (all of them when nothing matches)."""
+    index = tool_index(fingerprint, tools)
+    query, called = conversation_query(messages)
+    scores = index.scores(query)
+    ranked = sorted(
+        (position for position, score in enumerate(scores) if score > 0),
+        key=lambda position: -scores[position],
+    )[:top_k]
+    if not ranked:
+        return frozenset(index.names)
+    return frozenset(index.names[position] for position in ranked) | (frozenset(pinned) | frozenset(called)) & frozenset(index.names)
+
+
+def select_tools(messages: Sequence[Any], fingerprint: str, tools: List[Any], mode: str = TOOL_SELECTION, top_k: int = TOP_K) -> ToolSelection:
+    """
+    The tools to bind for this turn, as a canonical (fingerprint, tools) pair like
+    prompt_layout.build_prompt returns.
+    """
+    if mode == "off" or len(tools) <= top_k:
+        return ToolSelection(fingerprint, tools, frozenset(tool_name(tool) for tool in tools), 0, mode)
+    selected = rank_tools(messages, fingerprint, tools, top_k)
+    if mode == "shadow" or len(selected) >= len(tools):
+        selections.inc(labels={"result": "all"})
+        return ToolSelection(fingerprint, tools, selected, 0, mode)
+
+    kept = [tool for tool in tools if tool_name(tool) in selected]
+    saved = sum(schema_tokens(tool) for tool in tools if tool_name(tool) not in selected)
+    selections.inc(labels={"result": "pruned"})
+    tokens_saved.inc(saved)
+    kept_fingerprint, kept = canonical_tools(kept)
+    return ToolSelection(kept_fingerprint, kept, selected, saved, mode)
+
+
+def record_tool_recall(selection: ToolSelection, response: Any):
+    """In shadow mode, count the response's tool calls the selection kept (hit) or dropped (miss)."""
+    if selection.mode != "shadow":
+        return
+    for name in _called_tools(response):
+        tool_recall.inc(labels={"result": "hit" if name in selection.selected else "miss"})
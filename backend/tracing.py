@@ -0,0 +1,375 @@
+"""
+Lightweight per-request latency tracing (no external dependency).
+
+A trace is started per request with `start_trace`; nested work is wrapped in
+`span(...)` and fine-grained repeated work (JSON encoding of every frame, socket
+writes) is accumulated with `stage(...)` instead of one span per frame.
+When the root span ends the trace is:
+- logged as a per-stage breakdown (`Trace <id> 812.3ms | request.parse=1.2ms ...`)
+- observed in the `trace_stage_seconds` histogram on /metrics
+- appended to TRACE_EXPORT_PATH as one OTLP-JSON ExportTraceServiceRequest per line
+
+Configuration:
+- TRACE_SAMPLE_RATE: fraction of requests traced (default 0, tracing off)
+- TRACE_EXPORT_PATH: OTLP-JSON lines file (default: no export)
+- TRACE_LOG: print the breakdown of sampled traces (default "true")
+
+Unsampled requests only pay for a context-variable lookup per span.
+"""
+
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import metrics
+from jsonl_writer import BackgroundJsonlWriter
+from readiness import checkpoint_latency
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_LOG = os.getenv("TRACE_LOG", "true").lower() == "true"
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "copilotkit-langgraph-runtime")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+stage_seconds = metrics.histogram(
+    "trace_stage_seconds", "Time spent per request stage in sampled traces"
+)
+
+
+class Trace:
+    """All spans and accumulated stage timings of one request."""
+
+    def __init__(self, name: str):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.spans: List["Span"] = []
+        # stage name -> [total seconds, occurrences]
+        self.stages: Dict[str, list] = {}
+
+    def add_stage_time(self, stage_name: str, seconds: float):
+        totals = self.stages.setdefault(stage_name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "events")
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.events = []
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            _finish_trace(self.trace, self)
+
+
+class _NoopSpan:
+    """Returned when the current request is not sampled."""
+
+    trace = None
+    duration_ms = 0.0
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def start_trace(name: str, sample_rate: Optional[float] = None, **attributes):
+    """
+    Start the root span of a request and make it current.
+    Returns NOOP_SPAN when the request is not sampled. The caller must `end()` it,
+    usually once the streaming response is complete (see `traced_stream`).
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        return NOOP_SPAN
+    root = Span(Trace(name), name, None, attributes)
+    _current_span.set(root)
+    return root
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def use_span(span_to_activate):
+    """Make `span_to_activate` current (e.g. inside a response generator)."""
+    if span_to_activate is NOOP_SPAN:
+        yield span_to_activate
+        return
+    token = _current_span.set(span_to_activate)
+    try:
+        yield span_to_activate
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current span; a no-op when the request is not sampled."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.trace, name, parent, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_attribute("error", repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+@contextmanager
+def stage(name: str):
+    """Accumulate time spent in a repeated, fine-grained stage (e.g. "encode")."""
+    parent = _current_span.get()
+    if parent is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        parent.trace.add_stage_time(name, time.perf_counter() - start)
+
+
+async def traced_steps(iterator: AsyncIterator[Any], name: str = "graph.astream_step") -> AsyncIterator[Any]:
+    """
+    Wrap an async iterator (e.g. graph.astream) so that producing each item is a span.
+    The span is named after `name` and tagged with the graph nodes in the event.
+    """
+    iterator = iterator.__aiter__()
+    while True:
+        with span(name) as step:
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                step.set_attribute("last", True)
+                return
+            if isinstance(item, dict):
+                step.set_attribute("nodes", ",".join(str(key) for key in item))
+        yield item
+
+
+async def traced_stream(chunks: AsyncIterator[Any], root) -> AsyncIterator[Any]:
+    """
+    Wrap a streaming response body: activates `root` while the body is produced,
+    accounts the time the server waits on the client in the "wire.write" stage and
+    ends the root span when the stream finishes.
+    """
+    try:
+        with use_span(root):
+            async for chunk in chunks:
+                start = time.perf_counter()
+                yield chunk
+                if root is not NOOP_SPAN:
+                    root.trace.add_stage_time("wire.write", time.perf_counter() - start)
+    finally:
+        root.end()
+
+
+def traced_endpoint(name: str):
+    """
+    Decorator for FastAPI endpoints: starts the request trace and, for streaming
+    responses, keeps it open until the body has been fully sent.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            root = start_trace(name)
+            try:
+                response = await endpoint(*args, **kwargs)
+            except BaseException as e:
+                root.set_attribute("error", repr(e))
+                root.end()
+                raise
+            if root is not NOOP_SPAN and hasattr(response, "body_iterator"):
+                response.body_iterator = traced_stream(response.body_iterator, root)
+            else:
+                root.end()
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_checkpointer(checkpointer):
+    """
+    Wrap the get/put methods of a LangGraph checkpointer instance in spans
+    (checkpoint.get, checkpoint.put, checkpoint.put_writes), and time every call
+    for the readiness checkpointer-latency signal.
+    """
+    if checkpointer is None or getattr(checkpointer, "_traced", False):
+        return checkpointer
+
+    def wrap_async(method_name, span_name):
+        original = getattr(checkpointer, method_name, None)
+        if original is None:
+            return
+
+        async def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span(span_name):
+                    return await original(*args, **kwargs)
+            finally:
+                checkpoint_latency.observe(time.perf_counter() - start)
+
+        setattr(checkpointer, method_name, traced)
+
+    def wrap_sync(method_name, span_name):
+        original = getattr(checkpointer, method_name, None)
+        if original is None:
+            return
+
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span(span_name):
+                    return original(*args, **kwargs)
+            finally:
+                checkpoint_latency.observe(time.perf_counter() - start)
+
+        setattr(checkpointer, method_name, traced)
+
+    for suffix, span_name in (("get_tuple", "checkpoint.get"), ("put", "checkpoint.put"), ("put_writes", "checkpoint.put_writes")):
+        wrap_async(f"a{suffix}", span_name)
+        wrap_sync(suffix, span_name)
+    checkpointer._traced = True
+    return checkpointer
+
+
+def _finish_trace(trace: Trace, root: Span):
+    for name, (seconds, count) in trace.stages.items():
+        root.set_attribute(f"stage.{name}.ms", round(seconds * 1000, 3))
+        root.set_attribute(f"stage.{name}.count", count)
+
+    breakdown = breakdown_by_stage(trace)
+    for name, ms in breakdown.items():
+        stage_seconds.observe(ms / 1000, labels={"stage": name})
+
+    if TRACE_LOG:
+        parts = " ".join(f"{name}={ms:.1f}ms" for name, ms in breakdown.items())
+        print(f"Trace {trace.trace_id} {trace.name} {root.duration_ms:.1f}ms | {parts}")
+
+    if TRACE_EXPORT_PATH:
+        _exporter().submit(to_otlp_json(trace))
+
+
+def breakdown_by_stage(trace: Trace) -> Dict[str, float]:
+    """Total milliseconds per span name (excluding the root) and per accumulated stage."""
+    totals: Dict[str, float] = {}
+    for item in trace.spans:
+        if item.parent_id is None:
+            totals["total"] = item.duration_ms
+            continue
+        totals[item.name] = totals.get(item.name, 0.0) + item.duration_ms
+        ttft = item.attributes.get("ttft_ms")
+        if ttft is not None:
+            totals[f"{item.name}.ttft"] = totals.get(f"{item.name}.ttft", 0.0) + ttft
+    for name, (seconds, _count) in trace.stages.items():
+        totals[name] = seconds * 1000
+    return totals
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp_json(trace: Trace) -> Dict[str, Any]:
+    """Encode a finished trace as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for item in trace.spans:
+        encoded = {
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 2 if item.parent_id is None else 1,  # SERVER for the root, INTERNAL otherwise
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns),
+            "attributes": _otlp_attributes(item.attributes),
+        }
+        if item.parent_id:
+            encoded["parentSpanId"] = item.parent_id
+        if item.events:
+            encoded["events"] = [
+                {"name": name, "timeUnixNano": str(ts), "attributes": _otlp_attributes(attrs)}
+                for name, ts, attrs in item.events
+            ]
+        if "error" in item.attributes:
+            encoded["status"] = {"code": 2, "message": str(item.attributes["error"])}
+        spans.append(encoded)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "copilotkit.tracing"},
+                "spans": spans,
+            }],
+        }]
+    }
+
+
+_exporter_instance = None
+_exporter_lock = threading.Lock()
+
+
+def _exporter() -> BackgroundJsonlWriter:
+    global _exporter_instance
+    with _exporter_lock:
+        if _exporter_instance is None:
+            _exporter_instance = BackgroundJsonlWriter(TRACE_EXPORT_PATH)
+    return _exporter_instance
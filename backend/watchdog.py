@@ -0,0 +1,176 @@
+"""
+Event-loop health watchdog and blocking-call detector.
+
+Every stream of a worker shares one event loop, so a single blocking call (a
+synchronous print of a huge payload, json.dumps(..., indent=2) of a long thread,
+file or checkpointer I/O) stalls them all. The watchdog has two parts:
+- a heartbeat task on the loop that measures how late it wakes up (loop lag) and
+  records it in the `event_loop_lag_seconds` histogram, plus a moving average
+  (`smoothed_lag`, about the last half second) for readiness.py
+- a monitor thread that notices when the heartbeat stops for longer than the
+  threshold and samples the loop thread's stack while it is still blocked, so the
+  offending code shows up by file/line in the log, in `event_loop_stalls_total`
+  and in `recent_stalls()`
+
+Configuration:
+- LOOP_WATCHDOG: "true" (default) / "false"
+- LOOP_WATCHDOG_INTERVAL_MS: heartbeat interval (default 50)
+- LOOP_LAG_THRESHOLD_MS: a callback blocking longer than this is a stall (default 100)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import metrics
+from lifespan import on_shutdown, on_startup
+
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "true").lower() == "true"
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "50"))
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+
+# Weight of the latest heartbeat in smoothed_lag
+_LAG_SMOOTHING = 0.1
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+loop_lag = metrics.histogram(
+    "event_loop_lag_seconds", "How late the event loop heartbeat woke up", buckets=LAG_BUCKETS
+)
+loop_lag_current = metrics.gauge(
+    "event_loop_lag_current_seconds", "Loop lag measured by the latest heartbeat"
+)
+loop_stalls = metrics.counter(
+    "event_loop_stalls_total", "Blocking calls longer than LOOP_LAG_THRESHOLD_MS, by code location"
+)
+
+
+class LoopWatchdog:
+    """Measures loop lag and captures the stack of code that blocks the loop."""
+
+    def __init__(self, interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS, threshold_ms: float = LOOP_LAG_THRESHOLD_MS, max_samples: int = 50):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.samples: deque = deque(maxlen=max_samples)
+        self.current_lag = 0.0
+        self.smoothed_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the heartbeat on the running loop and the monitor thread."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.current_lag = max(0.0, now - expected)
+            self.smoothed_lag += (self.current_lag - self.smoothed_lag) * _LAG_SMOOTHING
+            self._last_beat = now
+            loop_lag.observe(self.current_lag)
+            loop_lag_current.set(self.current_lag)
+
+    def _monitor(self):
+        # Check a few times per threshold so the stack is sampled while still blocked
+        poll = max(self.threshold / 4, 0.005)
+        reported_beat = None
+        while not self._stop.wait(poll):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if blocked_for < self.threshold or reported_beat == last_beat:
+                continue
+            reported_beat = last_beat  # One sample per stall
+            self._record_stall(blocked_for)
+
+    def _record_stall(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        location = _blocking_location(stack)
+        sample = {
+            "timestamp": time.time(),
+            "blocked_ms": round(blocked_for * 1000, 1),
+            "location": location,
+            "stack": traceback.format_list(stack[-15:]),
+        }
+        self.samples.append(sample)
+        loop_stalls.inc(labels={"location": location})
+        print(f"WARNING: event loop blocked for >{sample['blocked_ms']}ms at {location}\n" + "".join(sample["stack"]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "current_lag_ms": round(self.current_lag * 1000, 2),
+            "threshold_ms": self.threshold * 1000,
+            "lag": loop_lag.snapshot(),
+            "recent_stalls": list(self.samples),
+        }
+
+
+def _blocking_location(stack: List[traceback.FrameSummary]) -> str:
+    """The innermost frame from this project's code (falls back to the innermost frame)."""
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    for frame in reversed(stack):
+        if frame.filename.startswith(project_dir) and not frame.filename.endswith("watchdog.py"):
+            return f"{os.path.relpath(frame.filename, project_dir)}:{frame.lineno} {frame.name}"
+    frame = stack[-1]
+    return f"{frame.filename}:{frame.lineno} {frame.name}"
+
+
+watchdog = LoopWatchdog()
+
+
+def current_loop_lag_ms() -> float:
+    return watchdog.current_lag * 1000
+
+
+def recent_stalls() -> List[Dict[str, Any]]:
+    return list(watchdog.samples)
+
+
+def add_loop_watchdog(app, path: str = "/debug/event-loop"):
+    """
+    Start the watchdog with the FastAPI app and expose its stats on `path`
+    (lag histogram and the most recent stall stack samples; admin token, see admin.py).
+    """
+    from fastapi import Request
+
+    from admin import admin_denied
+
+    async def start_watchdog():
+        if LOOP_WATCHDOG:
+            watchdog.start()
+
+    async def stop_watchdog():
+        watchdog.stop()
+
+    async def event_loop_stats(request: Request):
+        denied = admin_denied(request)
+        if denied is not None:
+            return denied
+        return watchdog.stats()
+
+    on_startup(app, start_watchdog)
+    on_shutdown(app, stop_watchdog)
+    app.add_api_route(path, event_loop_stats, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,348 @@
+"""
+Persistent WebSocket transport for chat sessions: one connection per session.
+
+Over POST every turn re-sends `variables.data` in full (the whole message history,
+every frontend action schema, the agent session) and opens a new streaming
+response. On a session socket (`/copilotkit/ws`):
+- the agent, thread and frontend action schemas are sent once, when the session
+  opens (and again only when the actions change)
+- a turn sends only its new messages
+- the run's events are streamed back as JSON text messages on the same socket
+- frontend tool calls go out as `tool_call` events and their results come back
+  as `tool_result` messages, which continue the run on the same thread
+
+Client → server (one JSON object per text message):
+- {"type": "session", "threadId"?, "agentName"?, "actions": [...], "messages"?: [...]}
+  first message; `actions` are CopilotKit frontend actions (`jsonSchema` or
+  `parameters`). `messages` (the history the client holds) is only used when the
+  server has no checkpoint for the thread, e.g. after a restart.
+- {"type": "actions", "actions": [...]}: replace the session's actions
+- {"type": "turn", "messages": [...]}: the new messages only (CopilotKit
+  `textMessage` / `resultMessage` objects, or {"role", "content"})
+- {"type": "tool_result", "toolCallId", "result", "name"?}: a frontend tool's result
+- {"type": "cancel"}: cancel the run in progress
+
+Server → client:
+- {"type": "session", "sessionId", "threadId", "agentName", "toolsHash", "resumed"}
+- {"type": "run", "runId", "status": "started" | "success" | "paused" | "failed" | "cancelled", "error"?}
+  ("paused": the run waits for its tool results, TOOL_RESUME=interrupt, see hot_runs.py)
+- {"type": "text", "runId", "messageId", "content"}
+- {"type": "tool_call", "runId", "toolCallId", "name", "args"}
+- {"type": "error", "message"}: a rejected client message (the session stays open)
+
+One run at a time per session; a turn sent while a run is in progress is
+rejected, so tool results are sent once the run's final status has arrived. Session runs are driven by the socket (like RUN_MODE=stream): closing
+the socket cancels the run in progress.
+
+Settings:
+- WS_IDLE_TIMEOUT_S: close sessions without a message for this long while no run
+  is in progress (default 900, 0 = never)
+- MAX_REQUEST_BODY_BYTES (request_body.py) also caps each client message
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import metrics
+from hot_runs import hold_paused_run, resume_command
+from readiness import track_run
+from request_body import MAX_REQUEST_BODY_BYTES
+from tracing import stage, start_trace, traced_steps, use_span
+
+WS_IDLE_TIMEOUT_S = float(os.getenv("WS_IDLE_TIMEOUT_S", "900"))
+
+# WebSocket close codes (RFC 6455)
+_CLOSE_NORMAL = 1000
+_CLOSE_POLICY = 1008
+_CLOSE_TOO_BIG = 1009
+
+sessions_open = metrics.gauge("ws_sessions_open", "Open WebSocket chat sessions")
+turns_total = metrics.counter("ws_turns_total", "Runs started on WebSocket sessions, by kind (message, tool_result)")
+message_bytes = metrics.counter("ws_bytes_total", "WebSocket session payload bytes, by direction (in, out)")
+turn_bytes = metrics.histogram(
+    "ws_turn_request_bytes", "Size of the client message that started a run on a WebSocket session",
+    buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+turn_seconds = metrics.histogram(
+    "ws_turn_seconds", "Duration of runs on WebSocket sessions",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class SessionError(ValueError):
+    """A client message the session cannot act on (answered with an error event)."""
+
+
+def frontend_tools(actions: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tool definitions for CopilotKit frontend actions, from `jsonSchema` or a `parameters` list."""
+    tools = []
+    for action in actions:
+        if not isinstance(action, dict) or not action.get("name"):
+            raise SessionError("Every action needs a name")
+        schema = action.get("jsonSchema")
+        if isinstance(schema, str):
+            schema = json.loads(schema or "{}")
+        if not isinstance(schema, dict):
+            schema = {"type": "object", "properties": {}, "required": []}
+            for param in action.get("parameters") or []:
+                schema["properties"][param.get("name")] = {
+                    "type": param.get("type", "string"),
+                    "description": param.get("description", ""),
+                }
+                if param.get("required", False):
+                    schema["required"].append(param.get("name"))
+        description = action.get("description", "")
+        tools.append({
+            "name": action["name"],
+            "description": description,
+            "type": "function",
+            "function": {"name": action["name"], "description": description, "parameters": schema},
+        })
+    return tools
+
+
+def input_messages(items: Sequence[Any]) -> List[Any]:
+    """Graph input messages for CopilotKit message objects or {"role", "content"} dicts."""
+    from message_records import new_message
+
+    messages = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise SessionError("Messages must be objects")
+        if "textMessage" in item:
+            text_msg = item["textMessage"]
+            if text_msg.get("role") in ("user", "assistant"):
+                messages.append(new_message(text_msg["role"], text_msg.get("content", "")))
+        elif "resultMessage" in item:
+            result = item["resultMessage"]
+            messages.append(new_message(
+                "tool", _result_content(result.get("result")),
+                tool_call_id=result.get("actionExecutionId"), name=result.get("actionName"),
+            ))
+        elif item.get("role") == "tool":
+            messages.append(new_message(
+                "tool", _result_content(item.get("content")), tool_call_id=item.get("toolCallId"), name=item.get("name"),
+            ))
+        elif item.get("role") in ("user", "assistant"):
+            messages.append(new_message(item["role"], item.get("content", "")))
+    return messages
+
+
+def _result_content(result: Any) -> str:
+    return result if isinstance(result, str) else json.dumps(result)
+
+
+class ChatSession:
+    """One socket's session: the agent, thread and tools set once, and the run in progress."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.session_id = str(uuid.uuid4())
+        self.thread_id: Optional[str] = None
+        self.agent_name: Optional[str] = None
+        self.tools: List[Dict[str, Any]] = []
+        # History to seed the thread with on the first run (no checkpoint on this server)
+        self.pending: List[Any] = []
+        self.run: Optional[asyncio.Task] = None
+        self.run_id: Optional[str] = None
+        # The last run stopped at frontend tool calls (TOOL_RESUME=interrupt)
+        self.paused = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, event: Dict[str, Any]):
+        with stage("encode"):
+            text = json.dumps(event, separators=(",", ":"))
+        message_bytes.inc(len(text), labels={"direction": "out"})
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    @property
+    def running(self) -> bool:
+        return self.run is not None and not self.run.done()
+
+    async def handle(self, message: Dict[str, Any], size: int):
+        kind = message.get("type")
+        if kind == "session":
+            await self.open(message)
+        elif self.thread_id is None:
+            raise SessionError("The first message must open the session")
+        elif kind == "actions":
+            await self.set_actions(message.get("actions") or [])
+        elif kind == "turn":
+            self.start_run(message.get("messages") or [], "message", size)
+        elif kind == "tool_result":
+            if not message.get("toolCallId"):
+                raise SessionError("tool_result needs a toolCallId")
+            self.start_run([{
+                "role": "tool", "toolCallId": message["toolCallId"],
+                "name": message.get("name"), "content": message.get("result"),
+            }], "tool_result", size)
+        elif kind == "cancel":
+            if self.running:
+                self.run.cancel()
+        else:
+            raise SessionError(f"Unknown message type: {kind!r}")
+
+    async def open(self, message: Dict[str, Any]):
+        from agent import thread_has_checkpoint
+        from agent_registry import UnknownAgent, registry
+
+        if self.thread_id is not None:
+            raise SessionError("The session is already open")
+        try:
+            self.agent_name = registry.resolve(message.get("agentName"))
+        except UnknownAgent as e:
+            raise SessionError(f"Unknown agent: {e.args[0]}")
+        self.tools = frontend_tools(message.get("actions") or [])
+        thread_id = message.get("threadId") or str(uuid.uuid4())
+        resumed = await thread_has_checkpoint(thread_id)
+        self.pending = [] if resumed else input_messages(message.get("messages") or [])
+        self.thread_id = thread_id
+        await self.send({
+            "type": "session", "sessionId": self.session_id, "threadId": thread_id,
+            "agentName": self.agent_name, "toolsHash": self.tools_hash(), "resumed": resumed,
+        })
+
+    async def set_actions(self, actions: Sequence[Dict[str, Any]]):
+        self.tools = frontend_tools(actions)
+        await self.send({"type": "session", "sessionId": self.session_id, "threadId": self.thread_id,
+                         "agentName": self.agent_name, "toolsHash": self.tools_hash(), "resumed": True})
+
+    def tools_hash(self) -> str:
+        from prompt_layout import canonical_tools
+
+        return canonical_tools(self.tools)[0]
+
+    def start_run(self, items: List[Any], kind: str, size: int):
+        if self.running:
+            raise SessionError("A run is in progress on this session")
+        messages = input_messages(items)
+        if not messages and not self.pending:
+            raise SessionError("The turn has no messages")
+        messages, self.pending = self.pending + messages, []
+        turns_total.inc(labels={"kind": kind})
+        turn_bytes.observe(size)
+        self.run_id = str(uuid.uuid4())
+        self.run = asyncio.create_task(self._run(self.run_id, items, messages))
+
+    async def _run(self, run_id: str, items: List[Any], messages: List[Any]):
+        root = start_trace("ws_turn", agent=self.agent_name, thread_id=self.thread_id)
+        start = time.perf_counter()
+        status = {"type": "run", "runId": run_id, "status": "success"}
+        self.paused = False
+        try:
+            with use_span(root):
+                await self.send({"type": "run", "runId": run_id, "status": "started"})
+                async for event in track_run(self._events(run_id, items, messages)):
+                    await self.send(event)
+        except asyncio.CancelledError:
+            status["status"] = "cancelled"
+        except Exception as e:
+            print(f"WebSocket session {self.session_id} run {run_id} failed: {e!r}")
+            status.update(status="failed", error=str(e))
+        else:
+            if self.paused:
+                status["status"] = "paused"
+        finally:
+            root.end()
+            turn_seconds.observe(time.perf_counter() - start)
+        try:
+            await self.send(status)
+        except Exception:
+            pass  # The socket is gone
+
+    async def _events(self, run_id: str, items: List[Any], messages: List[Any]):
+        from agent_registry import registry
+
+        graph = await registry.aget_graph(self.agent_name)
+        config = {"configurable": {"thread_id": self.thread_id}}
+        # Tool results resume the run paused at the tool calls (TOOL_RESUME=interrupt, see hot_runs)
+        resume = await resume_command(graph, self.thread_id, items)
+        input_state = resume if resume is not None else {"messages": messages, "tools": self.tools}
+        paused = None
+        async for event in traced_steps(graph.astream(input_state, config)):
+            if isinstance(event, dict) and "__interrupt__" in event:
+                paused = event
+            node_output = event.get("chat_node") if isinstance(event, dict) else None
+            if not isinstance(node_output, dict) or "messages" not in node_output:
+                continue
+            ai_messages = node_output["messages"]
+            ai_message = ai_messages[-1] if isinstance(ai_messages, list) else ai_messages
+            content = getattr(ai_message, "content", "")
+            if content:
+                yield {"type": "text", "runId": run_id, "messageId": getattr(ai_message, "id", None) or f"run--{uuid.uuid4()}",
+                       "content": content}
+            for call in getattr(ai_message, "tool_calls", None) or []:
+                yield {"type": "tool_call", "runId": run_id, "toolCallId": call.get("id"),
+                       "name": call.get("name"), "args": call.get("args", {})}
+        if await hold_paused_run(graph, self.thread_id, paused):
+            self.paused = True
+
+    async def close(self):
+        if self.running:
+            self.run.cancel()
+            try:
+                await self.run
+            except BaseException:
+                pass
+
+
+async def _receive(websocket, session: ChatSession) -> Optional[str]:
+    """The next text message, or None once the session has been idle for WS_IDLE_TIMEOUT_S."""
+    if WS_IDLE_TIMEOUT_S <= 0:
+        return await websocket.receive_text()
+    while True:
+        try:
+            return await asyncio.wait_for(websocket.receive_text(), WS_IDLE_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            if not session.running:
+                return None
+
+
+async def chat_session(websocket):
+    """WebSocket endpoint: one chat session per connection."""
+    from fastapi import WebSocketDisconnect
+
+    await websocket.accept()
+    session = ChatSession(websocket)
+    sessions_open.inc()
+    try:
+        while True:
+            text = await _receive(websocket, session)
+            if text is None:
+                await websocket.close(code=_CLOSE_NORMAL, reason="idle")
+                break
+            size = len(text.encode("utf-8"))
+            message_bytes.inc(size, labels={"direction": "in"})
+            if size > MAX_REQUEST_BODY_BYTES:
+                await websocket.close(code=_CLOSE_TOO_BIG, reason=f"Message exceeds {MAX_REQUEST_BODY_BYTES} bytes")
+                break
+            try:
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise SessionError("Messages must be JSON objects")
+                await session.handle(message, size)
+            except ValueError as e:  # SessionError or invalid JSON
+                if session.thread_id is None:
+                    await websocket.close(code=_CLOSE_POLICY, reason=str(e)[:120])
+                    break
+                await session.send({"type": "error", "message": str(e)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+        sessions_open.dec()
+
+
+def add_ws_sessions(app, path: str = "/copilotkit/ws"):
+    """Serve persistent chat sessions over a WebSocket at `path`."""
+    from fastapi import WebSocket
+
+    async def session_endpoint(websocket: WebSocket):
+        await chat_session(websocket)
+
+    app.add_api_websocket_route(path, session_endpoint)